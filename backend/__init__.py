@@ -0,0 +1,3 @@
+"""
+Host-side (CPython) services that turn the anchors' ranging reports into tag positions
+"""
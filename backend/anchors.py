@@ -0,0 +1,49 @@
+"""
+Anchor coordinate table
+
+Anchors are identified by the ID they publish ranging data under (AnchorNode.anchor_id, the
+hex MAC address of the Pico W). Their surveyed positions come from a JSON config:
+
+    {"anchors": {"28cdc1000001": [0.0, 0.0, 2.5], "28cdc1000002": [6.0, 0.0, 2.5], ...}}
+
+Coordinates are in meters. Two coordinates per anchor make a 2D table.
+"""
+import json
+
+import numpy as np
+
+
+class AnchorTable:
+    def __init__(self, anchors):
+        """
+        :param anchors: Mapping of anchor ID to its (x, y) or (x, y, z) coordinates
+        """
+        self.ids = list(anchors)
+        self.index = {anchor_id: i for i, anchor_id in enumerate(self.ids)}
+        self.positions = np.array([anchors[anchor_id] for anchor_id in self.ids], dtype=float)
+        if self.positions.ndim != 2 or self.positions.shape[1] not in (2, 3):
+            raise ValueError('anchor coordinates must all be (x, y) or all be (x, y, z)')
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: JSON config file with an "anchors" object of ID -> coordinates
+        :return: AnchorTable
+        """
+        with open(path) as f:
+            return cls(json.load(f)['anchors'])
+
+    @property
+    def dims(self):
+        return self.positions.shape[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def indices(self, anchor_ids):
+        """
+        :param anchor_ids: Iterable of anchor IDs
+        :return: Array of row indices into positions, -1 for unknown anchors
+        """
+        index = self.index
+        return np.array([index.get(anchor_id, -1) for anchor_id in anchor_ids], dtype=np.intp)
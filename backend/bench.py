@@ -0,0 +1,128 @@
+"""
+Benchmarks of the batch multilateration solver and the ranging report formats
+
+Run from the repository root (needs NumPy):
+
+    python -m backend.bench [tags]
+
+Places anchors around a 20 x 20 x 3 m hall, ranges randomly placed tags from every anchor
+with 5 cm of noise, and reports positions solved per second and the RMS position error for
+2D and 3D solves against the number of tags and anchors, then the size and encode/decode cost
+of a ranging report as AnchorNode's JSON and as a binary record.
+"""
+import json
+import sys
+import time
+
+import numpy as np
+
+import records
+from backend.anchors import AnchorTable
+from backend.multilateration import solve
+
+HALL = np.array([20.0, 20.0, 3.0])  # m
+
+
+def make_anchors(count, dims, rng):
+    """
+    :return: AnchorTable of count anchors on the hall's walls, alternately high and low
+    """
+    angle = np.linspace(0, 2 * np.pi, count, endpoint=False)
+    positions = np.column_stack((
+        HALL[0] / 2 * (1 + np.cos(angle)),
+        HALL[1] / 2 * (1 + np.sin(angle)),
+        np.where(np.arange(count) % 2, 0.3, HALL[2] - 0.3),
+    ))[:, :dims]
+    return AnchorTable({f'anchor{i}': position for i, position in enumerate(positions.tolist())})
+
+
+def make_ranges(anchors, tags, noise, rng):
+    """
+    :return: (true tag positions, (tag, anchor, distance, timestamp) rows of every tag/anchor pair)
+    """
+    truth = rng.uniform(0, 1, (tags, anchors.dims)) * HALL[:anchors.dims]
+    tag = np.repeat(np.arange(tags), len(anchors))
+    anchor = np.tile(np.arange(len(anchors)), tags)
+    distance = np.linalg.norm(truth[tag] - anchors.positions[anchor], axis=1)
+    distance += rng.normal(0, noise, len(distance))
+    timestamp = np.full(len(tag), time.time())
+    order = rng.permutation(len(tag))  # reports arrive interleaved
+    return truth, (tag[order], anchor[order], distance[order], timestamp[order])
+
+
+def multilateration(tags=1000, anchor_count=8, dims=3, noise=0.05, seed=0):
+    """
+    :return: dict of positions solved per second, RMS position error and tags left unsolved
+    """
+    rng = np.random.default_rng(seed)
+    anchors = make_anchors(anchor_count, dims, rng)
+    truth, rows = make_ranges(anchors, tags, noise, rng)
+    solve(*rows, anchors)  # warm up
+    start = time.perf_counter()
+    solution = solve(*rows, anchors)
+    elapsed = time.perf_counter() - start
+    error = np.linalg.norm(solution.positions - truth[solution.tags], axis=1)
+    solved = np.isfinite(error)
+    return {
+        'positions_per_second': len(solution.tags) / elapsed,
+        'rms_error': np.sqrt(np.mean(error[solved] ** 2)),
+        'unsolved': int((~solved).sum()),
+    }
+
+
+def record_formats(count=20000):
+    """
+    :return: dict per format of bytes, encode microseconds and decode microseconds per record
+    """
+    rng = np.random.default_rng(0)
+    ranges = [(int(tag), float(distance), int(time.time() * 1e6))
+              for tag, distance in zip(rng.integers(0, 0xFFFF, count), rng.uniform(0, 30, count))]
+
+    def encode_json():
+        return [json.dumps({"anchor_id": "28cdc1000001", "tag_id": tag, "distance": distance,
+                            "timestamp": timestamp / 1e6}) for tag, distance, timestamp in ranges]
+
+    buf = bytearray(records.RECORD_SIZE)
+
+    def encode_binary():
+        payloads = []
+        for tag, distance, timestamp in ranges:
+            records.encode_into(buf, 0, tag, distance, timestamp)
+            payloads.append(bytes(buf))  # stands in for the publish
+        return payloads
+
+    results = {}
+    for name, encode, decode in (('json', encode_json, json.loads), ('binary', encode_binary, records.decode)):
+        start = time.perf_counter()
+        payloads = encode()
+        encoded = time.perf_counter() - start
+        start = time.perf_counter()
+        for payload in payloads:
+            decode(payload)
+        decoded = time.perf_counter() - start
+        results[name] = {
+            'bytes': sum(len(payload) for payload in payloads) / count,
+            'encode_us': encoded / count * 1e6,
+            'decode_us': decoded / count * 1e6,
+        }
+    return results
+
+
+def main():
+    tag_counts = [int(sys.argv[1])] if len(sys.argv) > 1 else [100, 1000, 10000]
+    for dims in (2, 3):
+        print(f'{dims}D multilateration, 5 cm range noise')
+        for anchor_count in (4, 8, 16):
+            for tags in tag_counts:
+                result = multilateration(tags, anchor_count, dims)
+                print(f"  {anchor_count:2} anchors, {tags:5} tags: "
+                      f"{result['positions_per_second']:9.0f} positions/second, "
+                      f"RMS error {result['rms_error'] * 100:.1f} cm, {result['unsolved']} unsolved")
+    print('ranging report formats')
+    for name, result in record_formats().items():
+        print(f"  {name:6}: {result['bytes']:5.1f} bytes/record, encode {result['encode_us']:.2f} us/record, "
+              f"decode {result['decode_us']:.2f} us/record")
+
+
+if __name__ == '__main__':
+    main()
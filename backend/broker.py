@@ -0,0 +1,82 @@
+"""
+In-process stand-in for an MQTT broker
+
+LocalBroker routes publishes to the subscribed clients of the same event loop with MQTT topic
+filter semantics ('+' matches one level, '#' the rest), so the ingestion service and the load
+generator can run against each other without a network or a real broker. LocalClient offers
+the same calls as backend.mqtt.MQTTClient.
+"""
+import asyncio
+
+
+def topic_matches(topic_filter, topic):
+    """
+    :param topic_filter: MQTT topic filter, may contain '+' and a trailing '#'
+    :param topic: Topic name
+    :return: True if topic matches the filter
+    """
+    filter_levels = topic_filter.split('/')
+    levels = topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(levels) or (level != '+' and level != levels[i]):
+            return False
+    return len(levels) == len(filter_levels)
+
+
+class LocalBroker:
+    def __init__(self):
+        self.clients = []
+        self.published = 0
+
+    def client(self, client_id, max_queue=0):
+        """
+        :param client_id: Client identifier
+        :param max_queue: Messages queued for the client before publishes to it are dropped,
+                          0 for no limit
+        :return: LocalClient attached to this broker
+        """
+        client = LocalClient(self, client_id, max_queue)
+        self.clients.append(client)
+        return client
+
+    def route(self, topic, payload):
+        self.published += 1
+        for client in self.clients:
+            if any(topic_matches(topic_filter, topic) for topic_filter in client.filters):
+                client.deliver(topic, payload)
+
+
+class LocalClient:
+    def __init__(self, broker, client_id, max_queue=0):
+        self.broker = broker
+        self.client_id = client_id
+        self.filters = []
+        self.inbox = asyncio.Queue(max_queue)
+        self.dropped = 0  # messages lost to a full inbox
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        if self in self.broker.clients:
+            self.broker.clients.remove(self)
+
+    async def subscribe(self, topic_filter, qos=0):
+        self.filters.append(topic_filter)
+
+    async def publish(self, topic, payload, qos=0):
+        self.broker.route(topic, payload)
+
+    def deliver(self, topic, payload):
+        try:
+            self.inbox.put_nowait((topic, payload))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def recv(self):
+        """
+        :return: (topic, payload) of the next message for this client
+        """
+        return await self.inbox.get()
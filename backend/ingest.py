@@ -0,0 +1,197 @@
+"""
+Ingestion service for the anchors' ranging reports
+
+Subscribes to ranging/data/+ (AnchorNode.send_ranging_data), decodes each report, JSON or
+binary records, into (tag, anchor, distance, timestamp) rows, collects the rows of a time
+window and hands every window to the batch solver, so each tag gets one position per window
+from the newest range of each anchor that heard it.
+
+Receiving and solving run as separate tasks joined by a bounded queue: a slow solve backs up
+the queue instead of stalling the connection, and rows arriving at a full queue are dropped
+and counted. IngestMetrics reports throughput, queue depth and end-to-end latency from the
+measurement timestamp to the solved position, which assumes the anchors' clocks are synced
+to the backend's.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+import records
+from backend.multilateration import solve
+
+DATA_TOPIC = 'ranging/data/+'
+
+
+class IngestMetrics:
+    def __init__(self, latency_samples=10000):
+        """
+        :param latency_samples: Number of most recent end-to-end latencies kept for percentiles
+        """
+        self.start = time.monotonic()
+        self.messages = 0
+        self.decode_errors = 0
+        self.unknown_anchors = 0
+        self.dropped = 0  # rows lost to a full queue
+        self.rows = 0  # rows handed to the solver
+        self.windows = 0
+        self.positions = 0
+        self.max_queue_depth = 0
+        self.solve_seconds = 0.0
+        self.latencies = deque(maxlen=latency_samples)
+
+    def snapshot(self, queue_depth=0):
+        """
+        :param queue_depth: Current depth of the row queue
+        :return: dict of counters, rates per second and latency percentiles in milliseconds
+        """
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) * 1000
+        return {
+            'elapsed': elapsed,
+            'messages': self.messages,
+            'messages_per_second': self.messages / elapsed,
+            'rows': self.rows,
+            'positions': self.positions,
+            'positions_per_second': self.positions / elapsed,
+            'windows': self.windows,
+            'decode_errors': self.decode_errors,
+            'unknown_anchors': self.unknown_anchors,
+            'dropped': self.dropped,
+            'queue_depth': queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'solve_ms_per_window': self.solve_seconds / self.windows * 1000 if self.windows else 0.0,
+            'latency_p50_ms': p50,
+            'latency_p95_ms': p95,
+            'latency_p99_ms': p99,
+            'latency_max_ms': latencies.max() * 1000,
+        }
+
+
+class IngestService:
+    def __init__(self, client, anchors, window=0.1, max_queue=100000, on_positions=None, dims=None):
+        """
+        :param client: Connected backend.mqtt.MQTTClient or backend.broker.LocalClient
+        :param anchors: AnchorTable with the coordinates of the publishing anchors
+        :param window: Length of a solver window in seconds
+        :param max_queue: Rows queued for the solver before new rows are dropped
+        :param on_positions: Called with the multilateration.Solution of every window
+        :param dims: 2 or 3, defaults to the dimensions of the anchor table
+        """
+        self.client = client
+        self.anchors = anchors
+        self.window = window
+        self.queue = asyncio.Queue(max_queue)
+        self.on_positions = on_positions
+        self.dims = dims
+        self.metrics = IngestMetrics()
+        self._tasks = []
+
+    def decode(self, topic, payload):
+        """
+        :param topic: ranging/data/<anchor_id>
+        :param payload: JSON report or list of reports, or binary records (see records.py)
+        :return: List of (tag, anchor index, distance, timestamp) rows, empty if the report is unusable
+        """
+        anchor_id = topic.rsplit('/', 1)[-1]
+        try:
+            if records.is_binary(payload):
+                ranges = [(tag, distance, timestamp_us / 1e6)
+                          for tag, distance, timestamp_us, quality in records.decode(payload)]
+            else:
+                data = json.loads(payload)
+                if isinstance(data, dict):
+                    data = [data]
+                if data:
+                    anchor_id = data[0].get('anchor_id') or anchor_id
+                ranges = [(int(report['tag_id']), float(report['distance']), float(report['timestamp']))
+                          for report in data]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.metrics.decode_errors += 1
+            return []
+        anchor = self.anchors.index.get(anchor_id, -1)
+        if anchor < 0:
+            self.metrics.unknown_anchors += 1
+            return []
+        return [(tag, anchor, distance, timestamp) for tag, distance, timestamp in ranges]
+
+    async def receive(self):
+        """Read reports from the broker into the row queue"""
+        metrics = self.metrics
+        queue = self.queue
+        while True:
+            topic, payload = await self.client.recv()
+            metrics.messages += 1
+            for row in self.decode(topic, payload):
+                try:
+                    queue.put_nowait(row)
+                except asyncio.QueueFull:
+                    metrics.dropped += 1
+            if queue.qsize() > metrics.max_queue_depth:
+                metrics.max_queue_depth = queue.qsize()
+
+    def drain(self):
+        """
+        :return: All rows queued so far
+        """
+        rows = []
+        queue = self.queue
+        while not queue.empty():
+            rows.append(queue.get_nowait())
+        return rows
+
+    def solve_window(self, rows):
+        """
+        :param rows: (tag, anchor index, distance, timestamp) rows of one window
+        :return: multilateration.Solution
+        """
+        metrics = self.metrics
+        tag, anchor, distance, timestamp = (np.array(column) for column in zip(*rows))
+        start = time.perf_counter()
+        solution = solve(tag, anchor.astype(np.intp), distance, timestamp, self.anchors, self.dims)
+        metrics.solve_seconds += time.perf_counter() - start
+        metrics.rows += len(rows)
+        metrics.windows += 1
+        metrics.positions += int(np.isfinite(solution.positions[:, 0]).sum())
+        metrics.latencies.extend(time.time() - timestamp)
+        if self.on_positions:
+            self.on_positions(solution)
+        return solution
+
+    async def aggregate(self):
+        """Solve the queued rows once per window"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            deadline += self.window
+            await asyncio.sleep(max(deadline - loop.time(), 0))
+            rows = self.drain()
+            if rows:
+                self.solve_window(rows)
+
+    async def start(self):
+        await self.client.subscribe(DATA_TOPIC)
+        self._tasks = [asyncio.create_task(self.receive()), asyncio.create_task(self.aggregate())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        rows = self.drain()
+        if rows:
+            self.solve_window(rows)
+
+    def report(self):
+        """Print the service metrics"""
+        m = self.metrics.snapshot(self.queue.qsize())
+        print(f"  {m['messages']} messages with {m['rows']} ranges in {m['elapsed']:.1f} s, "
+              f"{m['messages_per_second']:.0f} messages/s, "
+              f"{m['positions_per_second']:.0f} positions/s in {m['windows']} windows "
+              f"({m['solve_ms_per_window']:.1f} ms solve/window)")
+        print(f"  queue depth {m['queue_depth']} (max {m['max_queue_depth']}), {m['dropped']} dropped, "
+              f"{m['decode_errors']} undecodable, {m['unknown_anchors']} from unknown anchors")
+        print(f"  end-to-end latency p50 {m['latency_p50_ms']:.1f} ms, p95 {m['latency_p95_ms']:.1f} ms, "
+              f"p99 {m['latency_p99_ms']:.1f} ms, max {m['latency_max_ms']:.1f} ms")
@@ -0,0 +1,158 @@
+"""
+Load generator for the ingestion service
+
+Simulates many anchors publishing ranging/data/<anchor_id> reports, as AnchorNode's binary
+records or JSON, for a population of tags at a fixed rate, runs an IngestService against
+them and prints its metrics and the RMS error of the solved positions. Runs against the
+in-process broker stand-in unless a broker address is given.
+
+    python -m backend.loadgen --anchors 8 --tags 200 --rate 10 --seconds 5
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+import records
+from backend.bench import make_anchors
+from backend.broker import LocalBroker
+from backend.ingest import IngestService
+from backend.mqtt import MQTTClient
+
+
+class AnchorSimulator:
+    def __init__(self, client, anchor_id, position, tags, rate, noise=0.05, seed=0, binary=True, batch=1):
+        """
+        :param client: Connected client the anchor publishes with
+        :param anchor_id: Anchor ID, published in the topic and the report
+        :param position: Anchor coordinates in meters
+        :param tags: dict of tag ID -> true tag coordinates
+        :param rate: Ranges per second per tag
+        :param noise: Standard deviation of the range noise in meters
+        :param binary: Publish binary records instead of JSON
+        :param batch: Ranges per publish, as AnchorNode batches them
+        """
+        self.client = client
+        self.anchor_id = anchor_id
+        self.topic = f'ranging/data/{anchor_id}'
+        self.ranges = {tag: float(np.linalg.norm(np.subtract(p, position))) for tag, p in tags.items()}
+        self.rate = rate
+        self.noise = noise
+        self.rng = random.Random(seed)
+        self.binary = binary
+        self.batch = batch
+        self.published = 0
+
+    async def run(self):
+        """Publish a report for every tag once per 1 / rate seconds, phase-shifted per anchor"""
+        loop = asyncio.get_running_loop()
+        period = 1 / self.rate
+        deadline = loop.time() + self.rng.uniform(0, period)
+        while True:
+            await asyncio.sleep(max(deadline - loop.time(), 0))
+            deadline += period
+            batch = []
+            for tag, distance in self.ranges.items():
+                distance += self.rng.gauss(0, self.noise)
+                if self.binary:
+                    batch.append(records.encode(tag, distance, time.time_ns() // 1000))
+                else:
+                    batch.append({
+                        "anchor_id": self.anchor_id,
+                        "tag_id": tag,
+                        "distance": distance,
+                        "timestamp": time.time(),
+                    })
+                if len(batch) == self.batch:
+                    await self.publish(batch)
+                    batch = []
+            if batch:
+                await self.publish(batch)
+
+    async def publish(self, batch):
+        if self.binary:
+            message = b''.join(batch)
+        else:
+            message = json.dumps(batch[0] if len(batch) == 1 else batch)
+        await self.client.publish(self.topic, message)
+        self.published += 1
+
+
+async def run(anchor_count=8, tags=200, rate=10, seconds=5, window=0.1, dims=2, broker=None, binary=True,
+              batch=1):
+    """
+    :param broker: (host, port) of a real MQTT broker, None for the in-process stand-in
+    :param binary: Publish binary records instead of JSON
+    :param batch: Ranges per publish
+    :return: (IngestService, RMS position error in meters)
+    """
+    rng = np.random.default_rng(0)
+    anchors = make_anchors(anchor_count, dims, rng)
+    truth = {0x1000 + i: p for i, p in enumerate((rng.uniform(0, 1, (tags, dims)) * 20).tolist())}
+
+    if broker is None:
+        local = LocalBroker()
+        service_client = local.client('backend')
+        publisher = local.client('anchors')
+    else:
+        service_client = MQTTClient('backend', *broker)
+        publisher = MQTTClient('anchors', *broker)
+    await service_client.connect()
+    await publisher.connect()
+
+    errors = []
+
+    def on_positions(solution):
+        expected = np.array([truth[tag] for tag in solution.tags.tolist()])
+        errors.extend(np.linalg.norm(solution.positions - expected, axis=1))
+
+    service = IngestService(service_client, anchors, window, on_positions=on_positions)
+    await service.start()
+    simulators = [AnchorSimulator(publisher, anchor_id, position, truth, rate, seed=i,
+                                  binary=binary, batch=batch)
+                  for i, (anchor_id, position) in enumerate(zip(anchors.ids, anchors.positions))]
+    tasks = [asyncio.create_task(simulator.run()) for simulator in simulators]
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0.05)  # let the last reports arrive
+        await service.stop()
+        await publisher.disconnect()
+        await service_client.disconnect()
+    errors = np.array(errors)
+    return service, float(np.sqrt(np.nanmean(errors ** 2))) if len(errors) else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--anchors', type=int, default=8)
+    parser.add_argument('--tags', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=10, help='ranges per second per tag and anchor')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--window', type=float, default=0.1, help='solver window in seconds')
+    parser.add_argument('--dims', type=int, default=2, choices=(2, 3))
+    parser.add_argument('--format', choices=('binary', 'json'), default='binary')
+    parser.add_argument('--batch', type=int, default=1, help='ranges per publish')
+    parser.add_argument('--broker', help='HOST[:PORT] of an MQTT broker instead of the in-process one')
+    args = parser.parse_args()
+    broker = None
+    if args.broker:
+        host, _, port = args.broker.partition(':')
+        broker = (host, int(port or 1883))
+    offered = args.anchors * args.tags * args.rate
+    print(f'{args.anchors} anchors x {args.tags} tags at {args.rate:g} Hz: {offered:.0f} {args.format} reports/s offered')
+    service, rms_error = asyncio.run(run(
+        args.anchors, args.tags, args.rate, args.seconds, args.window, args.dims, broker, args.format == 'binary',
+        args.batch))
+    service.report()
+    print(f'  position RMS error {rms_error * 100:.1f} cm')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Minimal asyncio MQTT 3.1.1 client for the backend
+
+Covers what the ingestion service needs from a real broker: a clean-session connection,
+QoS 0 subscriptions and publishes, and keepalive pings. It offers the same calls as
+backend.broker.LocalClient.
+"""
+import asyncio
+import struct
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+
+class MQTTException(Exception):
+    pass
+
+
+def _remaining_length(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+
+def _string(s):
+    if isinstance(s, str):
+        s = s.encode()
+    return struct.pack('!H', len(s)) + s
+
+
+class MQTTClient:
+    def __init__(self, client_id, host, port=1883, keepalive=60):
+        """
+        :param client_id: Client identifier
+        :param host: Broker host name
+        :param port: Broker port
+        :param keepalive: Keepalive interval in seconds, 0 to disable pings
+        """
+        self.client_id = client_id
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.reader = None
+        self.writer = None
+        self.pid = 0
+        self._pinger = None
+
+    def _send(self, packet_type, body):
+        self.writer.write(bytes((packet_type,)) + _remaining_length(len(body)) + body)
+
+    async def _read_packet(self):
+        header = (await self.reader.readexactly(1))[0]
+        n = shift = 0
+        while True:
+            byte = (await self.reader.readexactly(1))[0]
+            n |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        return header, await self.reader.readexactly(n)
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = _string('MQTT') + bytes((4, 0x02)) + struct.pack('!H', self.keepalive) + _string(self.client_id)
+        self._send(CONNECT, body)
+        await self.writer.drain()
+        header, body = await self._read_packet()
+        if header != CONNACK or body[1]:
+            raise MQTTException(body[1] if header == CONNACK else header)
+        if self.keepalive:
+            self._pinger = asyncio.create_task(self._ping())
+
+    async def _ping(self):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            self._send(PINGREQ, b'')
+            await self.writer.drain()
+
+    async def disconnect(self):
+        if self._pinger:
+            self._pinger.cancel()
+        self._send(DISCONNECT, b'')
+        await self.writer.drain()
+        self.writer.close()
+
+    async def subscribe(self, topic_filter, qos=0):
+        self.pid = self.pid % 0xFFFF + 1
+        self._send(SUBSCRIBE, struct.pack('!H', self.pid) + _string(topic_filter) + bytes((qos,)))
+        await self.writer.drain()
+
+    async def publish(self, topic, payload, qos=0):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self._send(PUBLISH, _string(topic) + payload)
+        await self.writer.drain()
+
+    async def recv(self):
+        """
+        :return: (topic, payload) of the next message published to a subscription
+        """
+        while True:
+            header, body = await self._read_packet()
+            packet_type = header & 0xF0
+            if packet_type == PUBLISH:
+                length = struct.unpack_from('!H', body)[0]
+                topic = body[2:2 + length].decode()
+                start = 2 + length + (2 if header & 0x06 else 0)
+                return topic, body[start:]
+            if packet_type == SUBACK and body[-1] == 0x80:
+                raise MQTTException('subscription refused')
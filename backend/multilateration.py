@@ -0,0 +1,118 @@
+"""
+Batch multilateration of tag positions from anchor ranges
+
+Solves every tag of a batch at once with NumPy: rows are grouped by tag, a linearised least
+squares solve gives each tag a starting point, and batched Gauss-Newton iterations on the
+range residuals refine it. Per-tag normal equations are summed with np.add.reduceat over the
+tag-sorted rows, so tags may be heard by different numbers of anchors.
+
+A tag needs dims + 1 anchors, and anchors that span the space: with all anchors at one
+height a 3D solve cannot resolve the tag's height, use dims=2 instead.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+Solution = namedtuple('Solution', 'tags positions residuals anchor_counts timestamps')
+Solution.__doc__ = """
+Positions solved from a batch, one row per tag
+
+tags: tag IDs, positions: (tags, dims) coordinates in meters, NaN for tags heard by too few
+anchors, residuals: RMS range residual in meters, anchor_counts: anchors used,
+timestamps: newest measurement time
+"""
+
+DAMPING = 1e-6  # keeps the Gauss-Newton normal equations invertible
+
+
+def batch_from_records(records, anchors):
+    """
+    Columns of ranging records as published by AnchorNode.send_ranging_data
+
+    :param records: Iterable of dicts with anchor_id, tag_id, distance and timestamp
+    :param anchors: AnchorTable the anchor IDs are looked up in
+    :return: (tag, anchor, distance, timestamp) arrays, anchor holds AnchorTable indices
+    """
+    records = list(records)
+    tag = np.array([record['tag_id'] for record in records], dtype=np.int64)
+    anchor = anchors.indices(record['anchor_id'] for record in records)
+    distance = np.array([record['distance'] for record in records], dtype=float)
+    timestamp = np.array([record['timestamp'] for record in records], dtype=float)
+    return tag, anchor, distance, timestamp
+
+
+def _newest_per_pair(tag, anchor, distance, timestamp):
+    """Drop unusable rows and all but the newest range of each tag/anchor pair, sorted by tag"""
+    valid = (anchor >= 0) & np.isfinite(distance) & (distance >= 0)
+    tag, anchor, distance, timestamp = tag[valid], anchor[valid], distance[valid], timestamp[valid]
+    order = np.lexsort((timestamp, anchor, tag))
+    tag, anchor, distance, timestamp = tag[order], anchor[order], distance[order], timestamp[order]
+    newest = np.ones(len(tag), dtype=bool)
+    newest[:-1] = (tag[1:] != tag[:-1]) | (anchor[1:] != anchor[:-1])
+    return tag[newest], anchor[newest], distance[newest], timestamp[newest]
+
+
+def _outer(rows):
+    return rows[:, :, None] * rows[:, None, :]
+
+
+def solve(tag, anchor, distance, timestamp, anchors, dims=None, iterations=10, tolerance=1e-4):
+    """
+    Solve the positions of all tags in a batch of ranges
+
+    :param tag: Tag ID per row
+    :param anchor: AnchorTable index per row, rows with -1 are ignored
+    :param distance: Range in meters per row
+    :param timestamp: Measurement time per row, only the newest range per tag/anchor pair is used
+    :param anchors: AnchorTable with the anchor coordinates
+    :param dims: 2 or 3, defaults to the dimensions of the anchor table
+    :param iterations: Maximum Gauss-Newton iterations
+    :param tolerance: Stop once no tag moves more than this many meters in an iteration
+    :return: Solution
+    """
+    dims = dims or anchors.dims
+    tag, anchor, distance, timestamp = _newest_per_pair(
+        np.asarray(tag), np.asarray(anchor), np.asarray(distance, dtype=float),
+        np.asarray(timestamp, dtype=float))
+    if not len(tag):
+        return Solution(tag, np.empty((0, dims)), np.empty(0), np.empty(0, dtype=np.intp), np.empty(0))
+
+    starts = np.flatnonzero(np.r_[True, tag[1:] != tag[:-1]])
+    counts = np.diff(np.r_[starts, len(tag)])
+    group = np.repeat(np.arange(len(starts)), counts)
+    solvable = counts > dims
+    a = anchors.positions[anchor, :dims]
+
+    # Linearised starting points: |p|^2 - 2 a.p = d^2 - |a|^2 with |p|^2 as an extra unknown
+    h = np.empty((len(tag), dims + 1))
+    h[:, :dims] = -2 * a
+    h[:, dims] = 1
+    b = distance * distance - np.einsum('ij,ij->i', a, a)
+    hth = np.add.reduceat(_outer(h), starts)
+    htb = np.add.reduceat(h * b[:, None], starts)
+
+    # Gauss-Newton on the range residuals of the solvable tags
+    positions = np.full((len(starts), dims), np.nan)
+    residuals = np.full(len(starts), np.nan)
+    if solvable.any():
+        position = np.einsum('gij,gj->gi', np.linalg.pinv(hth[solvable]), htb[solvable])[:, :dims]
+        rows = solvable[group]
+        a, distance = a[rows], distance[rows]
+        sub_starts = np.flatnonzero(np.r_[True, np.diff(group[rows]) != 0])
+        sub_group = np.repeat(np.arange(len(sub_starts)), counts[solvable])
+        damping = DAMPING * np.eye(dims)
+        for _ in range(iterations):
+            offset = position[sub_group] - a
+            ranges = np.maximum(np.linalg.norm(offset, axis=1), 1e-9)
+            jacobian = offset / ranges[:, None]
+            residual = ranges - distance
+            jtj = np.add.reduceat(_outer(jacobian), sub_starts) + damping
+            jtr = np.add.reduceat(jacobian * residual[:, None], sub_starts)
+            step = np.linalg.solve(jtj, -jtr[:, :, None])[:, :, 0]
+            position += step
+            if np.abs(step).max() < tolerance:
+                break
+        residual = np.linalg.norm(position[sub_group] - a, axis=1) - distance
+        positions[solvable] = position
+        residuals[solvable] = np.sqrt(np.add.reduceat(residual * residual, sub_starts) / counts[solvable])
+    return Solution(tag[starts], positions, residuals, counts, np.maximum.reduceat(timestamp, starts))
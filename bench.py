@@ -0,0 +1,97 @@
+import time
+import json
+import dwmCom
+import records
+from node import UWBNode
+import uasyncio
+
+# Example usage
+PAN_ID = 0xB34A  # Example PAN ID
+SRC_ADDR = 0x5678 #update for src
+TARGET_ADDR = 0x1234 #tag to range with
+
+RUNS = 20
+
+def time_config(apply):
+    """Average time in microseconds to configure the radio from reset"""
+    total = 0
+    for _ in range(RUNS):
+        dwmCom.reset()
+        start = time.ticks_us()
+        apply()
+        total += time.ticks_diff(time.ticks_us(), start)
+    return total / RUNS
+
+def per_call_config():
+    # One write_subregister call per register poke, as setup_radio() and lde_load() used to do
+    for register, offset, value, length in dwmCom.RADIO_PROFILE + dwmCom.LDE_PROFILE:
+        dwmCom.write_subregister(register, offset, value, 0, length)
+
+def table_config():
+    dwmCom.apply_profile(dwmCom._RADIO_RECORDS)
+    dwmCom.apply_profile(dwmCom._LDE_RECORDS)
+
+def per_call_setup_radio():
+    for register, offset, value, length in dwmCom.RADIO_PROFILE:
+        dwmCom.write_subregister(register, offset, value, 0, length)
+
+def per_call_lde_load():
+    # lde_load() as it was: the LDE pokes, then the microcode load sequence, a call per write
+    for register, offset, value, length in dwmCom.LDE_PROFILE:
+        dwmCom.write_subregister(register, offset, value, 0, length)
+    dwmCom.write_subregister(0x36, 0x00, 0x0301, 0, 2)
+    dwmCom.write_subregister(0x2D, 0x06, 0x8000, 0, 2)
+    time.sleep_us(150)
+    dwmCom.write_subregister(0x36, 0x00, 0x0200, 0, 2)
+
+async def boot_to_first_range(node, setup_radio=None, lde_load=None):
+    """Time in microseconds from reset until the first successful range, configuring the radio
+    with the given setup_radio() and lde_load() in place of dwmCom's profile-driven ones"""
+    ranged = []
+
+    def distance_callback(distance, dest_addr):
+        ranged.append(distance)
+
+    profile_setup_radio, profile_lde_load = dwmCom.setup_radio, dwmCom.lde_load
+    dwmCom.setup_radio = setup_radio or profile_setup_radio
+    dwmCom.lde_load = lde_load or profile_lde_load
+    try:
+        start = time.ticks_us()
+        await node.init()
+        while not ranged:
+            await node.start_ranging(TARGET_ADDR, callback=distance_callback)
+        return time.ticks_diff(time.ticks_us(), start), ranged[0]
+    finally:
+        dwmCom.setup_radio, dwmCom.lde_load = profile_setup_radio, profile_lde_load
+
+def time_report(encode):
+    """Average time in microseconds to encode one ranging report, and its size in bytes"""
+    start = time.ticks_us()
+    for i in range(RUNS):
+        message = encode(0x1234, 2.5 + i / 1000)
+    return time.ticks_diff(time.ticks_us(), start) / RUNS, len(message)
+
+def json_report(tag_id, distance):
+    # As AnchorNode.send_ranging_data builds it with binary_records off
+    return json.dumps({"anchor_id": "28cdc1000001", "tag_id": tag_id, "distance": distance, "timestamp": time.time()})
+
+_record = bytearray(records.RECORD_SIZE)
+
+def binary_report(tag_id, distance):
+    records.encode_into(_record, 0, tag_id, distance, time.time_ns() // 1000)
+    return _record
+
+async def main():
+    print(f"per-call configuration: {time_config(per_call_config):.0f} us")
+    print(f"table configuration: {time_config(table_config):.0f} us")
+    for name, encode in (("JSON", json_report), ("binary", binary_report)):
+        elapsed, size = time_report(encode)
+        print(f"{name} ranging report: {elapsed:.0f} us/record, {size} bytes/record")
+
+    node = UWBNode(PAN_ID, SRC_ADDR)
+    elapsed, distance = await boot_to_first_range(node, per_call_setup_radio, per_call_lde_load)
+    print(f"boot to first range, per-call configuration: {elapsed} us ({distance:.3f} m)")
+    elapsed, distance = await boot_to_first_range(node)
+    print(f"boot to first range, table configuration: {elapsed} us ({distance:.3f} m)")
+
+uasyncio.run(main())
@@ -0,0 +1,161 @@
+import dwmCom
+import time
+from machine import Pin
+import uasyncio
+
+# SYS_STATUS event bits
+TXFRB = 1 << 4    # Transmit Frame Begins
+TXPRS = 1 << 5    # Transmit Preamble Sent
+TXPHS = 1 << 6    # Transmit PHY Header Sent
+TXFRS = 1 << 7    # Transmit Frame Sent
+RXPRD = 1 << 8    # Receiver Preamble Detected
+RXSFDD = 1 << 9   # Receiver SFD Detected
+LDEDONE = 1 << 10 # LDE Processing Done
+RXPHD = 1 << 11   # Receiver PHY Header Detect
+RXPHE = 1 << 12   # Receiver PHY Header Error
+RXDFR = 1 << 13   # Receiver Data Frame Ready
+RXFCG = 1 << 14   # Receiver FCS Good
+RXFCE = 1 << 15   # Receiver FCS Error
+RXRFSL = 1 << 16  # Receiver Reed Solomon Frame Sync Loss
+RXRFTO = 1 << 17  # Receiver Frame Wait Timeout
+LDEERR = 1 << 18  # Leading Edge Detection Processing Error
+RXOVRR = 1 << 20  # Receiver Overrun
+RXPTO = 1 << 21   # Preamble Detection Timeout
+RXSFDTO = 1 << 26 # Receive SFD Timeout
+HPDWARN = 1 << 27 # Half Period Delay Warning
+
+RX_ERRORS = RXPHE | RXFCE | RXRFSL | LDEERR | RXSFDTO
+RX_TIMEOUTS = RXRFTO | RXPTO
+RX_EVENTS = RXFCG | RX_ERRORS | RX_TIMEOUTS | RXOVRR
+TX_EVENTS = TXFRS | HPDWARN
+
+
+class RxResult:
+    """Outcome of a receive: a good frame, a hardware timeout or the software deadline expiring"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+RX_OK = RxResult('RX_OK')
+RX_FRAME_TIMEOUT = RxResult('RX_FRAME_TIMEOUT')  # RX_FWTO expired (RXRFTO)
+RX_PREAMBLE_TIMEOUT = RxResult('RX_PREAMBLE_TIMEOUT')  # DRX_PRETOC expired (RXPTO)
+RX_DEADLINE = RxResult('RX_DEADLINE')  # no frame before the software deadline
+
+
+class StatusDispatcher:
+    def __init__(self, irq_pin):
+        """
+        Interrupt driven SYS_STATUS dispatcher.
+
+        Each IRQ reads SYS_STATUS once, clears the enabled events and wakes the task awaiting
+        them, so protocol code waits on the radio instead of polling it.
+
+        Args:
+            irq_pin (Pin): Pin connected to the DWM1000 IRQ line
+        """
+        self.irq_pin = irq_pin
+        self.flag = uasyncio.ThreadSafeFlag()
+        self.mask = 0
+        self.pending = 0  # events raised and not yet consumed
+        self.rx_errors = 0  # frames lost to receive errors, e.g. collisions, by receive()
+
+    def start(self, mask):
+        """
+        Enable events on the IRQ line and route the IRQ to the dispatcher.
+
+        Args:
+            mask (int): SYS_STATUS events to dispatch
+        """
+        self.mask = mask
+        self.pending = 0
+        dwmCom.clear_status(mask)
+        dwmCom.set_event_mask(mask)
+        self.irq_pin.irq(trigger=Pin.IRQ_RISING, handler=self._handle_irq)
+
+    def _handle_irq(self, pin):
+        """Read SYS_STATUS once and record every enabled event."""
+        events = dwmCom.read_status() & self.mask
+        if events:
+            dwmCom.clear_status(events)
+            self.pending |= events
+            self.flag.set()
+
+    async def wait(self, events, timeout_ms):
+        """
+        Wait for any of the given events.
+
+        Args:
+            events (int): SYS_STATUS event bits to wait for
+            timeout_ms (int): Time to wait in milliseconds
+
+        Returns:
+            int: The events that occurred (consumed), 0 on timeout
+        """
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while not self.pending & events:
+            remaining = time.ticks_diff(deadline, time.ticks_ms())
+            if remaining <= 0:
+                return 0
+            try:
+                await uasyncio.wait_for_ms(self.flag.wait(), remaining)
+            except uasyncio.TimeoutError:
+                return 0
+        raised = self.pending & events
+        self.pending &= ~raised
+        return raised
+
+    def set_rx_timeouts(self, frame_timeout_us=0, preamble_timeout_pacs=0):
+        """
+        Set the hardware receive timeouts used from the next receiver enable.
+
+        Args:
+            frame_timeout_us (int): Frame wait timeout in microseconds, 0 to disable
+            preamble_timeout_pacs (int): Preamble detection timeout in PACs, 0 to disable
+        """
+        dwmCom.init_rx_timeout(frame_timeout_us)
+        dwmCom.init_preamble_timeout(preamble_timeout_pacs)
+
+    async def receive(self, timeout_ms, frame_timeout_us=0, preamble_timeout_pacs=0, enable=True):
+        """
+        Enable the receiver and wait for a good frame, re-enabling it after receive errors.
+
+        The hardware timeouts end a reply wait within microseconds of the expected reply time,
+        timeout_ms bounds the whole receive.
+
+        Args:
+            timeout_ms (int): Time to wait in milliseconds
+            frame_timeout_us (int): Frame wait timeout in microseconds, 0 to disable
+            preamble_timeout_pacs (int): Preamble detection timeout in PACs, 0 to disable
+            enable (bool): False when the receiver was already enabled by a transmit with
+                WAIT4RESP, whose timeouts were set with set_rx_timeouts() beforehand
+
+        Returns:
+            RxResult: RX_OK if a frame with a good FCS was received, otherwise the timeout that ended the wait
+        """
+        if enable:
+            self.set_rx_timeouts(frame_timeout_us, preamble_timeout_pacs)
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while True:
+            remaining = time.ticks_diff(deadline, time.ticks_ms())
+            if remaining <= 0:
+                return RX_DEADLINE
+            if enable:
+                dwmCom.search()
+            enable = True
+            events = await self.wait(RX_EVENTS, remaining)
+            if events & RXFCG:
+                return RX_OK
+            if events & RXRFTO:
+                return RX_FRAME_TIMEOUT
+            if events & RXPTO:
+                return RX_PREAMBLE_TIMEOUT
+            if events & RX_ERRORS:
+                self.rx_errors += 1
+            if events & RXOVRR:
+                dwmCom.reset_rx()
+            if not events:
+                return RX_DEADLINE
@@ -1,13 +1,102 @@
 import time
-from machine import Pin, SPI
+try:
+    from machine import Pin, SPI
+except ImportError:
+    # Off-device: a transport must be bound with attach() before use
+    Pin = SPI = None
 
-# SPI configuration 
-spi = SPI(0, baudrate=1000000, polarity=0, phase=0, sck=Pin(18), mosi=Pin(19), miso=Pin(16))
-cs = Pin(17, Pin.OUT)  # Chip Select (CS) for the DWM1000
-irq = Pin(14, Pin.IN)  # Interrupt (IRQ) pin for receiving events
-rst = Pin(15, Pin.OUT)
+# SPI transport, bound by attach()
+spi = None
+cs = None
+irq = None
+rst = None
+led = None
 
-led = Pin("LED", Pin.OUT)  # Onboard LED on the Pico W
+
+def attach(spi_bus, cs_pin, irq_pin, rst_pin):
+    """
+    Bind dwmCom to the SPI bus and control pins of a DWM1000
+    Any objects providing the machine.SPI (write, readinto) and machine.Pin (value, irq) interfaces
+    can be used, such as the emulated DW1000 in sim.dw1000
+
+    :param spi_bus: SPI bus connected to the DWM1000
+    :param cs_pin: Chip Select (CS) output pin
+    :param irq_pin: Interrupt (IRQ) input pin
+    :param rst_pin: Reset (RST) output pin
+
+    """
+    global spi, cs, irq, rst
+    spi, cs, irq, rst = spi_bus, cs_pin, irq_pin, rst_pin
+    invalidate_shadow()
+
+
+
+# Configuration registers mirrored on the host (register ID: length in bytes).
+# Reads of these are served from the shadow once known and writes that would not
+# change the device contents are skipped entirely.
+_SHADOWED = {
+    0x03: 4,   # PANADR
+    0x04: 4,   # SYS_CFG
+    0x08: 5,   # TX_FCTRL
+    0x0C: 2,   # RX_FWTO
+    0x0E: 4,   # SYS_MASK
+    0x18: 2,   # TX_ANTD
+    0x1A: 4,   # ACK_RESP_T
+    0x1E: 4,   # TX_POWER
+    0x1F: 4,   # CHAN_CTRL
+    0x23: 32,  # AGC_CTRL
+    0x27: 45,  # DRX_CONF
+    0x28: 51,  # RF_CONF
+    0x2A: 12,  # TX_CAL
+    0x2B: 21,  # FS_CTRL
+}
+
+# register ID -> [bytearray contents, bitmask of bytes known to be valid]
+_shadow = {}
+
+# SPI header buffer: register ID byte plus up to two sub-address bytes
+_hdr = bytearray(3)
+_hdr_mv = memoryview(_hdr)
+_hdr_views = (None, _hdr_mv[:1], _hdr_mv[:2], _hdr_mv[:3])
+
+# Preallocated receive buffers, (register << 11) | length -> memoryview
+_rx_views = {}
+# SYS_STATUS write-1-to-clear buffer used by clear_status()
+_status_buf = bytearray(4)
+# DX_TIME buffer used by schedule_tx()
+_dx_time_buf = bytearray(5)
+
+# Device time units (15.65 ps) per microsecond, 128 * 499.2 MHz
+TICKS_PER_US = 63898
+_DEVICE_TIME_MASK = 0xFFFFFFFFFF
+_DX_TIME_MASK = 0xFFFFFFFE00  # the low 9 bits of DX_TIME are ignored by the DWM1000
+# DRX_CAR_INT units to clock offset ratio at 6.8 Mbps on channel 5:
+# 998.4 MHz / 2 / 1024 / 2^17 Hz per unit, -1 / 6489.6 MHz per Hz
+_CAR_INT_TO_RATIO = 998.4e6 / 2 / 1024 / 131072 / -6489.6e6
+
+# Constant strobe writes used on the RX/TX hot path
+_TXSTRT = b'\x02'                    # SYS_CTRL byte 0: TXSTRT
+_TXSTRT_WAIT4RESP = b'\x82'          # SYS_CTRL byte 0: TXSTRT | WAIT4RESP
+_TXSTRT_TXDLYS = b'\x06'             # SYS_CTRL byte 0: TXSTRT | TXDLYS
+_TXSTRT_TXDLYS_WAIT4RESP = b'\x86'   # SYS_CTRL byte 0: TXSTRT | TXDLYS | WAIT4RESP
+_RXENAB = b'\x01'                    # SYS_CTRL byte 1: RXENAB
+_HRBPT = b'\x01'                     # SYS_CTRL byte 3: HRBPT
+_LDELOAD = b'\x00\x80'               # OTP_CTRL: LDELOAD
+_CLEAR_RX_GOOD = b'\x00\xE4'         # SYS_STATUS: RXFCE | RXFCG | RXDFR | LDEDONE
+_TRXOFF = b'\x40'                    # SYS_CTRL byte 0: TRXOFF
+_CLEAR_STATUS = b'\xFE\xFF\xFF\x3F'   # SYS_STATUS: every event bit
+_RX_RESET = b'\xE0'                  # PMSC_CTRL0 byte 3: SOFTRESET with the receiver held in reset
+_RX_RESET_CLEAR = b'\xF0'            # PMSC_CTRL0 byte 3: SOFTRESET released
+
+_DEV_ID = b'\x30\x01\xCA\xDE'         # DEV_ID register contents of a DW1000 (0xDECA0130)
+
+# Registers restored by rearm() to the values captured by mark_baseline()
+_BASELINE_REGISTERS = (0x04, 0x0C, 0x0E, 0x1A)  # SYS_CFG, RX_FWTO, SYS_MASK, ACK_RESP_T
+# Configuration registers compared against the shadow by is_configured()
+_HEALTH_REGISTERS = (0x04, 0x1E, 0x1F)  # SYS_CFG, TX_POWER, CHAN_CTRL
+
+# register ID -> contents captured by mark_baseline()
+_baseline = {}
 
 
 def reset():
@@ -19,6 +108,183 @@ def reset():
     time.sleep_ms(2)
     rst.value(1)
     time.sleep_ms(10)
+    invalidate_shadow()
+
+def invalidate_shadow():
+    """
+    Forget all mirrored configuration register contents
+    Must be called whenever the DWM1000 may have reverted to its defaults
+
+    """
+    global _tx_template, _tx_length
+    _shadow.clear()
+    _baseline.clear()
+    _tx_template = None
+    _tx_length = None
+
+def mark_baseline():
+    """
+    Capture the current per-phase registers (SYS_CFG, RX_FWTO, SYS_MASK, ACK_RESP_T) as the state rearm() returns to
+    Call once the radio has been fully initialized
+
+    """
+    _baseline.clear()
+    for register in _BASELINE_REGISTERS:
+        size = _SHADOWED[register]
+        _baseline[register] = read_subregister(register, 0, size, size)
+
+def is_configured():
+    """
+    Health check of the DWM1000
+    
+    :return: True if the device ID reads back correctly and the checked configuration registers
+             still hold what was written since the last reset, False if a full init is needed
+
+    """
+    if not _baseline or bytes(read_view(0x00, 0, 4)) != _DEV_ID:
+        return False
+    for register in _HEALTH_REGISTERS:
+        size = _SHADOWED[register]
+        expected = _shadow_get(register, 0, size)
+        if expected is None or bytes(read_view(register, 0, size)) != expected:
+            return False
+    return True
+
+def rearm():
+    """
+    Warm re-arm of the DWM1000 between ranging phases
+
+    -Forces the transceiver off and resets the receiver state machine
+    -Clears all SYS_STATUS events
+    -Restores the registers captured by mark_baseline(), writing only the bytes that changed
+    The radio configuration and LDE microcode are left in place
+
+    """
+    reset_rx()
+    _spi_write(0x0F, 0, _CLEAR_STATUS)
+    for register in _BASELINE_REGISTERS:
+        _write(register, 0, _baseline[register])
+
+def reset_rx():
+    """
+    Force the transceiver off and reset the receiver state machine, e.g. after a receiver overrun
+
+    """
+    _spi_write(0x0D, 0, _TRXOFF)
+    _spi_write(0x36, 0x03, _RX_RESET)
+    _spi_write(0x36, 0x03, _RX_RESET_CLEAR)
+
+def _shadow_get(register, offset, length):
+    """
+    Look up mirrored register bytes
+
+    :param register: Hexidecimal register ID
+    :param offset: Byte offset within the register
+    :param length: Number of bytes wanted
+    :return: Mirrored bytes, or None if any of them are unknown
+
+    """
+    entry = _shadow.get(register)
+    if entry is None:
+        return None
+    needed = ((1 << length) - 1) << offset
+    if entry[1] & needed != needed:
+        return None
+    return bytes(entry[0][offset:offset + length])
+
+def _shadow_put(register, offset, data):
+    """
+    Record bytes that are now known to be held in a configuration register
+
+    :param register: Hexidecimal register ID
+    :param offset: Byte offset within the register
+    :param data: Bytes held at that offset (little endian)
+
+    """
+    size = _SHADOWED.get(register)
+    if size is None or offset + len(data) > size:
+        return
+    entry = _shadow.get(register)
+    if entry is None:
+        entry = _shadow[register] = [bytearray(size), 0]
+    entry[0][offset:offset + len(data)] = data
+    entry[1] |= ((1 << len(data)) - 1) << offset
+
+def _header(address, offset, write):
+    """
+    Build the SPI transaction header for a (sub-)register access into the header buffer
+
+    :param address: Hexidecimal register ID
+    :param offset: Sub-address within the register (0-0x7FFF)
+    :param write: True for a write transaction
+    :return: Number of header bytes used (1, 2 or 3)
+
+    """
+    b0 = address & 0x3F
+    if write:
+        b0 |= 0x80
+    if offset == 0:
+        _hdr[0] = b0
+        return 1
+    _hdr[0] = b0 | 0x40  # sub-index present
+    if offset <= 0x7F:
+        _hdr[1] = offset
+        return 2
+    _hdr[1] = 0x80 | (offset & 0x7F)  # extended address follows
+    _hdr[2] = (offset >> 7) & 0xFF
+    return 3
+
+def readinto(address, offset, buf):
+    """
+    Read (sub-)register bytes into a caller supplied buffer without allocating
+
+    :param address: Hexidecimal register ID
+    :param offset: Sub-address within the register
+    :param buf: bytearray or memoryview to fill, its length sets the number of bytes read
+    :return: buf
+
+    """
+    cs.value(0)
+    spi.write(_hdr_views[_header(address, offset, False)])
+    spi.readinto(buf)
+    cs.value(1)
+    return buf
+
+def read_view(address, offset, length):
+    """
+    Read (sub-)register bytes into a preallocated per-register buffer
+
+    :param address: Hexidecimal register ID
+    :param offset: Sub-address within the register
+    :param length: Number of bytes to read
+    :return: memoryview of the bytes (little endian). The buffer is reused by the next read
+             of the same register and length, so copy anything that must outlive it
+
+    """
+    key = (address << 11) | length
+    view = _rx_views.get(key)
+    if view is None:
+        view = _rx_views[key] = memoryview(bytearray(length))
+    return readinto(address, offset, view)
+
+def _spi_read(address, offset, length):
+    return bytes(read_view(address, offset, length))
+
+def _spi_write(address, offset, data):
+    cs.value(0)
+    spi.write(_hdr_views[_header(address, offset, True)])
+    spi.write(data)
+    cs.value(1)
+
+def _write(register, offset, data):
+    """
+    Write-through to the device, skipping writes that would not change a mirrored register
+
+    """
+    if _shadow_get(register, offset, len(data)) == data:
+        return
+    _spi_write(register, offset, data)
+    _shadow_put(register, offset, data)
 
 def read_register(address, length):
     """
@@ -29,11 +295,7 @@ def read_register(address, length):
     :return: Value stored in register as a byte or byte array (little endian)
     
     """
-    cs.value(0)
-    spi.write(bytes([address & 0x7f]))
-    data = spi.read(length)
-    cs.value(1)
-    return bytes(data)
+    return _spi_read(address, 0, length)
 
 def write_register(address, data):
     """
@@ -43,10 +305,7 @@ def write_register(address, data):
     :param data: value to be written to register. Byte or byte array little endian
 
     """
-    cs.value(0)
-    spi.write(bytes([address | 0x80]))
-    spi.write(bytes(data))  # Reverse byte order for writing
-    cs.value(1)
+    _write(address, 0, bytes(data))
 
 def read_register_intuitive(address, length):
     """
@@ -94,16 +353,27 @@ def read_and_display_register_bits(address, length, register_name):
     print("\n")
 
 def read_subregister(register, offset, register_length, sub_length):
-    full_data = read_register(register,register_length)    
-    # Extract the required bytes
-    subregister_data = full_data[offset:offset+sub_length]
-    
-    # Return the data (already in little-endian format)
-    return bytes(subregister_data)
+    """
+    Read a sub-register in the DWM1000 using a sub-addressed SPI transaction
+    Mirrored configuration registers are served from the shadow when known
+
+    :param register: Hexidecimal register ID
+    :param offset: Hexidecimal value of the sub-register offset with main register
+    :param register_length: Length of register (int), only the sub-register bytes are transferred
+    :param sub_length: Integer value of length of data in bytes being read
+    :return: Value stored in sub-register as bytes (little endian)
+
+    """
+    data = _shadow_get(register, offset, sub_length)
+    if data is None:
+        data = _spi_read(register, offset, sub_length)
+        _shadow_put(register, offset, data)
+    return data
 
 def write_subregister(register, offset, data, register_length, data_length):
     """
     Write a given value to a subregister in the DWM1000
+    Only the sub-register bytes are transferred, and nothing at all if a mirrored register already holds the value
     
     :param register: Hexidecimal register ID
     :param offset: Hexidecimal value of the sub-register offset with main register
@@ -131,14 +401,7 @@ def write_subregister(register, offset, data, register_length, data_length):
     else:
         raise ValueError("Data must be a hex string, an integer, or bytes")
 
-    # Read the entire register
-    full_register = bytearray(read_register(register, register_length))
-    
-    # Update only the specific bytes in the full register data
-    full_register[offset:offset+data_length] = data_bytes
-    
-    # Write the entire updated register back
-    write_register(register, full_register)
+    _write(register, offset, data_bytes)
 
 def write_bit(register_value, bit_index, bit_value):
     """
@@ -260,7 +523,7 @@ def init_frame_control(pan_id, device_address, enable_beacon=True, enable_data=T
     """
     
     # Set FEEN (Frame Filtering Enable) bit in register 0x04
-    sys_cfg = read_register(0x04, 4)
+    sys_cfg = read_subregister(0x04, 0, 4, 4)
     sys_cfg = int.from_bytes(sys_cfg, 'little')
     sys_cfg |= (1 << 0)  # Set bit 0 (FFEN)
     
@@ -292,7 +555,7 @@ def init_frame_control(pan_id, device_address, enable_beacon=True, enable_data=T
         raise ValueError("Device address must be either 2 bytes (short) or 8 bytes (extended)")
 
 def init_auto_ack(auto_ack=True, rx_auth=True):
-    sys_config = read_register(0x04,4)
+    sys_config = read_subregister(0x04, 0, 4, 4)
 
     if auto_ack:
         sys_config = write_bit(sys_config,30,1)
@@ -307,9 +570,137 @@ def init_auto_ack(auto_ack=True, rx_auth=True):
     write_register(0x04,sys_config)
     
 
+class FrameTemplate:
+    """
+    Encoded IEEE 802.15.4 MAC header for one (frame type, addresses, PAN IDs, flags) combination
+
+    Only the sequence number, destination address and payload change between frames, so once the
+    header is in the TX buffer they are patched in place and TX_FCTRL is only written when the
+    length changes. Templates are shared by every destination with the same address length.
+
+    """
+
+    def __init__(self, frame_type, dest_pan_id, dest_addr, src_pan_id, src_addr, security_enabled=False, frame_pending=False, ack_request=False, pan_id_compress=False):
+        """
+        :param frame_type: 0 for Beacon, 1 for Data, 2 for Acknowledgment, 3 for MAC Command
+        :param dest_pan_id: Destination PAN ID (2 bytes)
+        :param dest_addr: Destination address (int or bytes, 2 or 8 bytes)
+        :param src_pan_id: Source PAN ID (2 bytes)
+        :param src_addr: Source address (int or bytes, 2 or 8 bytes)
+        :param security_enabled: Boolean, set True if security is enabled
+        :param frame_pending: Boolean, set True if more data is pending
+        :param ack_request: Boolean, set True if acknowledgment is required
+        :param pan_id_compress: Boolean, set True to use PAN ID compression
+
+        """
+        fc = (frame_type & 0x07)  
+        fc |= (security_enabled << 3)
+        fc |= (frame_pending << 4)
+        fc |= (ack_request << 5)
+        fc |= (pan_id_compress << 6)
+
+        # Destination Addressing Mode
+        dest_addr_bytes, dest_addr_len = address_to_bytes(dest_addr)
+        if dest_addr_len == 2:
+            fc |= (0x02 << 10)  # Short Address
+        elif dest_addr_len == 8:
+            fc |= (0x03 << 10)  # Extended Address
+        
+        # Source Addressing Mode
+        src_addr_bytes, src_addr_len = address_to_bytes(src_addr)
+        if src_addr_len == 2:
+            fc |= (0x02 << 14)  # Short Address
+        elif src_addr_len == 8:
+            fc |= (0x03 << 14)  # Extended Address
+
+        # Assemble the header
+        header = bytearray()
+        header.extend(fc.to_bytes(2, 'little'))  # Frame Control
+        header.append(0)  # Sequence Number
+        header.extend(dest_pan_id.to_bytes(2, 'little'))  # Destination PAN ID
+        header.extend(dest_addr_bytes)  # Destination Address
+        if not pan_id_compress:
+            header.extend(src_pan_id.to_bytes(2, 'little'))  # Source PAN ID
+        header.extend(src_addr_bytes)  # Source Address
+
+        self.header = header
+        self.header_view = memoryview(header)
+        self.dest = dest_addr  # destination currently in the header
+        self.dest_length = dest_addr_len
+        self.payload_offset = len(header)
+
+    def load(self, seq_num, payload, dest_addr=None):
+        """
+        Write a frame built from this template into the TX buffer
+
+        :param seq_num: Sequence number (0-255)
+        :param payload: Message payload (bytes, bytearray or memoryview)
+        :param dest_addr: Destination address of the same length as the template's, None keeps it
+
+        """
+        global _tx_template, _tx_length
+        new_dest = dest_addr is not None and dest_addr != self.dest
+        if new_dest:
+            _put_address(self.header, _DEST_OFFSET, dest_addr, self.dest_length)
+            self.dest = dest_addr
+        if _tx_template is not self:
+            self.header[2] = seq_num
+            _spi_write(0x09, 0, self.header)
+            _tx_template = self
+        elif new_dest:
+            # Sequence number through destination address in one write
+            self.header[2] = seq_num
+            _spi_write(0x09, 2, self.header_view[2:_DEST_OFFSET + self.dest_length])
+        else:
+            _seq_buf[0] = seq_num
+            _spi_write(0x09, 2, _seq_buf)
+        if len(payload):
+            _spi_write(0x09, self.payload_offset, payload)
+
+        # Total frame length including 2 bytes for FCS, written to TX_FCTRL (0x08) on change
+        frame_length = self.payload_offset + len(payload) + 2
+        if frame_length != _tx_length:
+            _write(0x08, 0x00, bytes((frame_length,)))
+            _tx_length = frame_length
+
+# (frame type, dest PAN, dest address length, src PAN, src addr, flags) -> FrameTemplate,
+# bounded by the header layouts in use rather than the number of tags
+_templates = {}
+# Offset of the destination address, after frame control, sequence number and destination PAN
+_DEST_OFFSET = 5
+# Template whose header is currently in the TX buffer and the frame length in TX_FCTRL
+_tx_template = None
+_tx_length = None
+_seq_buf = bytearray(1)
+
+def frame_template(frame_type, dest_pan_id, dest_addr, src_pan_id, src_addr, security_enabled=False, frame_pending=False, ack_request=False, pan_id_compress=False):
+    """
+    Get the cached FrameTemplate for a header configuration, creating it on first use
+    Parameters are those of FrameTemplate
+
+    """
+    key = (frame_type, dest_pan_id, _address_length(dest_addr), src_pan_id, src_addr, security_enabled, frame_pending, ack_request, pan_id_compress)
+    template = _templates.get(key)
+    if template is None:
+        template = _templates[key] = FrameTemplate(frame_type, dest_pan_id, dest_addr, src_pan_id, src_addr, security_enabled, frame_pending, ack_request, pan_id_compress)
+    return template
+
+def _address_length(addr):
+    if isinstance(addr, int):
+        return 2 if addr <= 0xFFFF else 8
+    return len(addr)
+
+def _put_address(buf, offset, addr, length):
+    """Write an address into buf little-endian without allocating"""
+    if isinstance(addr, int):
+        for i in range(length):
+            buf[offset + i] = (addr >> (8 * i)) & 0xFF
+    else:
+        buf[offset:offset + length] = addr
+
 def format_message_mac(frame_type, seq_num, dest_pan_id, dest_addr, src_pan_id, src_addr, payload, security_enabled=False, frame_pending=False, ack_request=False, pan_id_compress=False):
     """
-    Format a message according to IEEE 802.15.4 standard.
+    Format a message according to IEEE 802.15.4 standard and load it into the TX buffer.
     
     :param frame_type: 0 for Beacon, 1 for Data, 2 for Acknowledgment, 3 for MAC Command
     :param seq_num: Sequence number (0-255)
@@ -322,78 +713,69 @@ def format_message_mac(frame_type, seq_num, dest_pan_id, dest_addr, src_pan_id,
     :param frame_pending: Boolean, set True if more data is pending
     :param ack_request: Boolean, set True if acknowledgment is required
     :param pan_id_compress: Boolean, set True to use PAN ID compression
-    :return: Formatted message as bytes
+    :return: FrameTemplate the message was built from
 
     """
+    template = frame_template(frame_type, dest_pan_id, dest_addr, src_pan_id, src_addr, security_enabled, frame_pending, ack_request, pan_id_compress)
+    if isinstance(payload, str):
+        payload = payload.encode()
+    template.load(seq_num, payload, dest_addr)
+    return template
 
-    fc = (frame_type & 0x07)  
-    fc |= (security_enabled << 3)
-    fc |= (frame_pending << 4)
-    fc |= (ack_request << 5)
-    fc |= (pan_id_compress << 6)
-
-    # Destination Addressing Mode
-    dest_addr_bytes, dest_addr_len = address_to_bytes(dest_addr)
-    if dest_addr_len == 2:
-        fc |= (0x02 << 10)  # Short Address
-    elif dest_addr_len == 8:
-        fc |= (0x03 << 10)  # Extended Address
-    
-    # Source Addressing Mode
-    src_addr_bytes, src_addr_len = address_to_bytes(src_addr)
-    if src_addr_len == 2:
-        fc |= (0x02 << 14)  # Short Address
-    elif src_addr_len == 8:
-        fc |= (0x03 << 14)  # Extended Address
+def transmit():
+    """
+    Function to transmit a message in the DWM1000
 
-    
-    # Assemble the frame
-    frame = bytearray()
-    frame.extend(fc.to_bytes(2, 'little'))  # Frame Control
+    """
+    # Set TXSTRT in SYS_CTRL register (0x0D)
+    _spi_write(0x0D, 0, _TXSTRT)
 
-    frame.append(seq_num)  # Sequence Number
-    
-    frame.extend(dest_pan_id.to_bytes(2, 'little'))  # Destination PAN ID
+def transmit_and_wait():
+    """
+    Function to transmit a message and automatically enter reception mode in the DWM1000
 
-    frame.extend(dest_addr_bytes)  # Destination Address
-    
-    if not pan_id_compress:
-        frame.extend(src_pan_id.to_bytes(2, 'little'))  # Source PAN ID
-    frame.extend(src_addr_bytes)  # Source Address
-    
-    # Add payload
-    frame.extend(payload)
+    """
+    # Set TXSTRT and WAIT4RESP in SYS_CTRL register (0x0D)
+    _spi_write(0x0D, 0, _TXSTRT_WAIT4RESP)
 
-    # Calculate total frame length (including 2 bytes for FCS)
-    frame_length = len(frame) + 2
+def schedule_tx(device_time):
+    """
+    Function to set the delayed transmit time (DX_TIME) of the next transmit_delayed()
 
-    # Write frame length to register 0x08 (TX_FCTRL)
-    write_subregister(0x08, 0x00, frame_length, 5, 1)
-    # Write message to TX buffer (0x09)
-    write_register(0x09, frame)
-    #print(read_register_intuitive(0x09,frame_length).hex())
-    
-    return frame
+    :param device_time: 40 bit device time to send the frame at, rounded down to 512 units (8 ns) by the DWM1000
+    :return: The TX timestamp the frame will carry (send time plus TX antenna delay), known before it is sent
 
-def transmit():
     """
-    Function to transmit a message in the DWM1000
+    tx_time = device_time & _DX_TIME_MASK
+    for i in range(5):
+        _dx_time_buf[i] = (tx_time >> (8 * i)) & 0xFF
+    _spi_write(0x0A, 0, _dx_time_buf)
+    antenna_delay = int.from_bytes(read_subregister(0x18, 0, 2, 2), 'little')
+    return (tx_time + antenna_delay) & _DEVICE_TIME_MASK
+
+def transmit_delayed(wait_for_response=False):
+    """
+    Function to transmit a message at the time set by schedule_tx() in the DWM1000
+    If that time has already passed the DWM1000 raises HPDWARN (SYS_STATUS bit 27)
+
+    :param wait_for_response: Enter reception mode once the message is sent (WAIT4RESP)
 
     """
-    # Set TXSTRT in SYS_CTRL register (0x0D)
-    sys_ctrl = read_register(0x0D, 4)
-    sys_ctrl_new = write_bit(sys_ctrl,1,1)
-    write_register(0x0D, sys_ctrl_new)
+    # Set TXSTRT and TXDLYS, and optionally WAIT4RESP, in SYS_CTRL register (0x0D)
+    _spi_write(0x0D, 0, _TXSTRT_TXDLYS_WAIT4RESP if wait_for_response else _TXSTRT_TXDLYS)
 
-def transmit_and_wait():
+def get_clock_offset():
     """
-    Function to transmit a message and automatically enter reception mode in the DWM1000
+    Function to get the clock offset of the sender of the last received frame from the carrier integrator (DRX_CAR_INT)
+
+    :return: Remote clock rate over local clock rate minus one, positive when the remote clock runs fast.
+             A reply time measured by the remote device is multiplied by (1 - offset) to convert it to local time
 
     """
-    sys_ctrl = read_register(0x0D,4)
-    sys_ctrl_new = write_bit(sys_ctrl,7,1)
-    sys_ctrl_new = write_bit(sys_ctrl_new,1,1)
-    write_register(0x0D,sys_ctrl_new)
+    value = int.from_bytes(read_view(0x27, 0x28, 3), 'little') & 0x1FFFFF
+    if value & 0x100000:
+        value -= 0x200000
+    return value * _CAR_INT_TO_RATIO
 
 def get_rx_status():
     """
@@ -424,6 +806,80 @@ def get_rx_status():
         'RXPTO': (status_int >> 21) & 1,   # Bit 21: Preamble Detection Timeout
     }
     
+# Radio profile for channel 5, 6.8 Mbps data rate, standard SFD, 16 MHz PRF, 64 symbol preamble,
+# PAC size of 8 and preamble code 4. Entries are (register, offset, value, length in bytes).
+RADIO_PROFILE = (
+    # digital receiver configuration
+    (0x27, 0x02, 0x0001, 2),
+    (0x27, 0x04, 0x0087, 2),
+    (0x27, 0x06, 0x0010, 2),
+    (0x27, 0x08, 0x311A002D, 4),
+    (0x27, 0x26, 0x0010, 2),
+    # AGC tuning for 6.8 Mbps and 16 MHz PRF
+    (0x23, 0x04, 0x8870, 2),
+    (0x23, 0x0C, 0x2502A907, 4),
+    (0x23, 0x12, 0x0055, 2),
+    # analog RX control
+    (0x28, 0x0B, 0xD8, 1),
+    # RF_TXCTRL for channel 5
+    (0x28, 0x0C, 0x001E3FE0, 4),
+    # CHAN_CTRL
+    (0x1F, 0x00, 0x21040055, 4),
+    # FS_PLLCFG and FS_PLLTUNE for channel 5
+    (0x2B, 0x07, 0x0800041D, 4),
+    (0x2B, 0x0B, 0xA6, 1),
+    # TC_PGDELAY for channel 5
+    (0x2A, 0x0B, 0xC0, 1),
+    # TX_POWER, smart transmit power for channel 5
+    (0x1E, 0x00, 0x0E082848, 4),
+    # TX_FCTRL bits 8-23: 6.8 Mbps, ranging frame, 16 MHz PRF, 64 symbol preamble
+    (0x08, 0x01, 0x05C0, 2),
+)
+
+# LDE configuration and replica coefficient for preamble code 4
+LDE_PROFILE = (
+    (0x2E, 0x1806, 0x1607, 2),
+    (0x2E, 0x2804, 0x428E, 2),
+)
+
+def compile_profile(profile):
+    """
+    Compile a register profile into records that can be streamed to the DWM1000
+
+    :param profile: Sequence of (register, offset, value, length) entries
+    :return: List of (register, offset, data, frame) records where data is the little endian
+             value and frame is the complete SPI write transaction (header and data)
+
+    """
+    records = []
+    for register, offset, value, length in profile:
+        data = value.to_bytes(length, 'little')
+        frame = bytes(_hdr_views[_header(register, offset, True)]) + data
+        records.append((register, offset, data, frame))
+    return records
+
+def apply_profile(records):
+    """
+    Stream compiled profile records to the DWM1000, one SPI transaction per record
+    Records already held by mirrored registers are skipped
+
+    :param records: Records produced by compile_profile
+
+    """
+    for register, offset, data, frame in records:
+        if _shadow_get(register, offset, len(data)) == data:
+            continue
+        cs.value(0)
+        spi.write(frame)
+        cs.value(1)
+        _shadow_put(register, offset, data)
+
+_RADIO_RECORDS = compile_profile(RADIO_PROFILE)
+_LDE_RECORDS = compile_profile(LDE_PROFILE)
+# PMSC clock and OTP_CTRL LDELOAD sequence that loads the LDE microcode
+_LDE_LOAD_START = compile_profile(((0x36, 0x00, 0x0301, 2), (0x2D, 0x06, 0x8000, 2)))
+_LDE_LOAD_END = compile_profile(((0x36, 0x00, 0x0200, 2),))
+
 def setup_radio():
     """
     Sets up radio for transmission and reception
@@ -434,77 +890,26 @@ def setup_radio():
     -Sets up transmission frame control
 
     """
-    #initialize digital receiver configuration for 6.8 Mbps data rate, standard SFD configuration, 16 MHz PRF, 64 symbol preamble, PAC size of 8, P code of 4
-    write_subregister(0x27,0x02,0x0001,45,2)
-    write_subregister(0x27,0x04,0x0087,45,2)
-    write_subregister(0x27,0x06, 0x0010,45,2)
-    write_subregister(0x27, 0x08, 0x311A002D, 45, 4)
-    write_subregister(0x27,0x26,0x0010,45,2)
-
-    #tune agc for 6.8 mbps and 16 MHz
-    write_subregister(0x23,0x04,0x8870,32,2)
-    write_subregister(0x23,0x0C,0x2502A907,32,4)
-    write_subregister(0x23,0x12,0x0055,32,2)
-    #set analog RX control register
-    write_subregister(0x28,0x0B,0xD8,51,1)
-    #set RF_TXCTRL to chanel 5
-    write_subregister(0x28,0x0C,0x001E3FE0,51,4)
-
-    # The desired configuration
-    desired_config = 0x21040055  # 00100001 00000100 00000000 01010101 in binary
-
-    # Write the configuration to the CHAN_CTRL register (0x1F)
-    write_register(0x1F, desired_config.to_bytes(4, 'little'))
-
-    #set FS_PLLCFG value for chanel 5
-    write_subregister(0x2B, 0x07, 0x0800041D, 21,4)
-    #set FS_PLLTUNE value for chanel 5
-    write_subregister(0x2B, 0x0B, 0xA6, 21, 1)
-
-    #set TC_PGCDELAY for chanel 5
-    write_subregister(0x2A, 0x0B, 0xC0, 12, 1)
-     #set transmission power control for chanel 5, smart transmit power
-    config = 0x0e082848
-    write_register(0x1E,config.to_bytes(4,'little'))
-
-    #setup transmission frame control
-    tfc = read_register(0x08,5)
-
-    bits = {
-        'index': [13,14,15,16,17,18,19,20,21],
-        'val': [0,1,1,1,0,1,0,0,0]
-    }
-    for i in range(len(bits['index'])):
-        tfc = write_bit(tfc, bits['index'][i], bits['val'][i])
-    write_register(0x08,tfc)
+    apply_profile(_RADIO_RECORDS)
 
 def lde_load():
     """
     Set LDE interface and load LDE microcode for leading edge detection and RX timestamping
     
     """
-    #LDE configuration
-    write_subregister(0x2E,0x1806,0x1607,10246,2)
-
-    #LDE replica coefficient configuration
-    write_subregister(0x2E,0x2804,0x428E,10246,2)
-
-    write_subregister(0x36,0x00,0x0301,43,2)
-    write_subregister(0x2D,0x06,0x8000,18,2)
+    apply_profile(_LDE_RECORDS)
+    apply_profile(_LDE_LOAD_START)
     time.sleep_us(150)
-    write_subregister(0x36,0x00,0x0200,43,2)
+    apply_profile(_LDE_LOAD_END)
 
 def search():
     """
     Search for compatible UWB signals
     
     """
-    # Set RX_enab in SYS_CTRL register (0x0D)
-    sys_ctrl = read_register(0x0D, 4)
-    sys_ctrl = int.from_bytes(sys_ctrl, 'little')
-    sys_ctrl |= (1 << 8)  # Set bit 8 for receiving mode
-    write_subregister(0x2D,0x06,0x8000,18,2)
-    write_register(0x0D, sys_ctrl.to_bytes(4, 'little'))
+    _spi_write(0x2D, 0x06, _LDELOAD)
+    # Set RX_enab (bit 8) in SYS_CTRL register (0x0D)
+    _spi_write(0x0D, 0x01, _RXENAB)
 
 def get_rx_timestamp():
     """
@@ -512,8 +917,15 @@ def get_rx_timestamp():
     :return: timestamp (int)
     
     """
-    rx_ts = read_subregister(0x15,0x00,14,5)
-    return int.from_bytes(rx_ts,'little')
+    return int.from_bytes(read_view(0x15, 0x00, 5), 'little')
+
+def get_rx_frame_length():
+    """
+    Retrieve the length of the received frame (RX_FINFO RXFLEN)
+    :return: frame length in bytes, FCS included (int)
+
+    """
+    return read_view(0x10, 0x00, 4)[0] & 0x7F
 
 def get_rx_quality():
     """
@@ -521,11 +933,9 @@ def get_rx_quality():
     :return: point 2 amplitude (m) and signal noise (dB)
     
     """
-    fp_amp2_bytes = read_subregister(0x12,0x02,8,2)
-    fp_amp2 = int.from_bytes(fp_amp2_bytes,'little')
-
-    std_noise_bytes = read_subregister(0x12,0x00,8,1)
-    std_noise = int.from_bytes(std_noise_bytes,'little')
+    rx_fqual = read_view(0x12, 0x00, 4)
+    fp_amp2 = rx_fqual[2] | (rx_fqual[3] << 8)
+    std_noise = rx_fqual[0]
 
     return fp_amp2/std_noise
 
@@ -535,8 +945,7 @@ def get_tx_timestamp():
     :return: timestamp (int)
     
     """
-    tx_ts = read_subregister(0x17,0x00,14,5)
-    return int.from_bytes(tx_ts,'little')
+    return int.from_bytes(read_view(0x17, 0x00, 5), 'little')
 
 def init_ack_timing(w4r_time=None, ack_time=None):
     if w4r_time:
@@ -546,12 +955,23 @@ def init_ack_timing(w4r_time=None, ack_time=None):
 
 def init_rx_timeout(wait_time):
     """
-    Function to set the receive frame wait timeout period in the DWM1000
+    Function to set the receive frame wait timeout period in the DWM1000 and enable it (SYS_CFG RXWTOE)
 
-    :param wait_time: time in microseconds to wait for a response
+    :param wait_time: time in microseconds (1.026 us units, at most 65535) to wait for a frame, 0 disables the timeout
 
     """
     write_subregister(0x0C,0,wait_time,4,2)
+    sys_cfg = read_subregister(0x04,0,4,4)
+    write_register(0x04, write_bit(sys_cfg, 28, 1 if wait_time else 0))
+
+def init_preamble_timeout(pacs):
+    """
+    Function to set the preamble detection timeout (DRX_PRETOC) in the DWM1000
+
+    :param pacs: time in PAC sized units (8 symbols, about 8 us) to wait for a preamble after enabling the receiver, 0 disables the timeout
+
+    """
+    write_subregister(0x27,0x24,pacs,45,2)
 
 def bytes_to_int(b, byteorder='big'):
     n = 0
@@ -601,24 +1021,65 @@ def set_receive_interrupt():
     """
     write_register(0x0E, b'\x00\x40\x10\x00')
 
+def set_event_mask(mask):
+    """
+    Select the SYS_STATUS events that assert the IRQ line
+
+    :param mask: SYS_MASK value, using the SYS_STATUS bit positions
+
+    """
+    _write(0x0E, 0, mask.to_bytes(4, 'little'))
+
+def read_status():
+    """
+    Read the low 32 bits of SYS_STATUS
+
+    :return: status bits (int)
+
+    """
+    status = read_view(0x0F, 0, 4)
+    return status[0] | (status[1] << 8) | (status[2] << 16) | (status[3] << 24)
+
+def clear_status(bits):
+    """
+    Clear SYS_STATUS events (write 1 to clear) without allocating
+
+    :param bits: status bits to clear, within the low 32 bits
+
+    """
+    _status_buf[0] = bits & 0xFF
+    _status_buf[1] = (bits >> 8) & 0xFF
+    _status_buf[2] = (bits >> 16) & 0xFF
+    _status_buf[3] = (bits >> 24) & 0xFF
+    _spi_write(0x0F, 0, _status_buf)
+
 def toggle_buffer():
-    status_register = read_register(0x0F,5)
-    hsrbp = read_bit(status_register,30)
-    icrbp = read_bit(status_register,31)
-    rxovrr = read_bit(status_register,20)
+    status_register = read_view(0x0F, 0, 4)
+    hsrbp = (status_register[3] >> 6) & 1  # Bit 30
+    icrbp = (status_register[3] >> 7) & 1  # Bit 31
+    rxovrr = (status_register[2] >> 4) & 1  # Bit 20
 
     if rxovrr == 1:
         print("receiver overrun")
     if hsrbp != icrbp:
-        system_control = read_register(0x0D,4)
-        system_control = write_bit(system_control,24,1)
-        write_register(0x0D,system_control)
+        _spi_write(0x0D, 0x03, _HRBPT)
     elif hsrbp == icrbp:
-        clear_status_bits(0x0F,[15,14,13,10] )
+        _spi_write(0x0F, 0, _CLEAR_RX_GOOD)
 
 def enable_double_buffering():
-    system_config = read_register(0x04,4)
+    system_config = read_subregister(0x04, 0, 4, 4)
     system_config = write_bit(system_config,29,1) #init rxautr (re-enables radio if RX error or received message)
     system_config = write_bit(system_config,12,0)# init double buffer
     write_register(0x04,system_config)
 
+# Allocate the buffers read from IRQ handlers up front so the hot path never allocates
+for _address, _length in ((0x0F, 4), (0x10, 4), (0x11, 5), (0x11, 11), (0x11, 12), (0x12, 4), (0x15, 5), (0x17, 5), (0x27, 3)):
+    _rx_views[(_address << 11) | _length] = memoryview(bytearray(_length))
+
+if SPI is not None:
+    # SPI configuration 
+    attach(SPI(0, baudrate=1000000, polarity=0, phase=0, sck=Pin(18), mosi=Pin(19), miso=Pin(16)),
+           Pin(17, Pin.OUT),  # Chip Select (CS) for the DWM1000
+           Pin(14, Pin.IN),  # Interrupt (IRQ) pin for receiving events
+           Pin(15, Pin.OUT))
+    led = Pin("LED", Pin.OUT)  # Onboard LED on the Pico W
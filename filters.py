@@ -0,0 +1,418 @@
+import random
+import time
+
+# Skiplist node fields, nodes are lists so they can be reused without allocating
+_VALUE = 0
+_NEXT = 1
+_WIDTH = 2
+
+
+class SortedWindow:
+    def __init__(self, size):
+        """
+        Sorted multiset of up to about size values, as an indexable skiplist.
+
+        insert(), remove() and the k-th smallest value each take O(log n) expected time.
+        Every node links forward on one or more levels and records how many values each
+        link skips, so a lookup by rank walks down the levels like a search by value.
+        remove() returns its node for the next insert() to reuse, so a full window that
+        replaces its oldest value does not allocate.
+
+        Args:
+            size (int): Expected number of values, sets the number of levels
+        """
+        levels = 1
+        while (1 << levels) < size:
+            levels += 1
+        self.levels = levels
+        self._tail = [float('inf'), None, None]
+        self.head = [None, [self._tail] * levels, [1] * levels]
+        self.count = 0
+        self._chain = [None] * levels  # last node before the position, per level
+        self._steps = [0] * levels  # values skipped reaching it, per level
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        """The i-th smallest value, 0-based"""
+        node = self.head
+        i += 1
+        for level in range(self.levels - 1, -1, -1):
+            while node[_WIDTH][level] <= i:
+                i -= node[_WIDTH][level]
+                node = node[_NEXT][level]
+        return node[_VALUE]
+
+    def insert(self, value, node=None):
+        """
+        Args:
+            value (float): Value to add, after any equal ones
+            node (list, optional): Node returned by remove() to reuse
+        """
+        chain = self._chain
+        steps = self._steps
+        x = self.head
+        for level in range(self.levels - 1, -1, -1):
+            steps[level] = 0
+            while x[_NEXT][level][_VALUE] <= value:
+                steps[level] += x[_WIDTH][level]
+                x = x[_NEXT][level]
+            chain[level] = x
+        if node is None:
+            height = 1
+            while height < self.levels and random.getrandbits(1):
+                height += 1
+            node = [value, [None] * height, [0] * height]
+        else:
+            node[_VALUE] = value
+            height = len(node[_NEXT])
+        skipped = 0
+        for level in range(height):
+            prev = chain[level]
+            node[_NEXT][level] = prev[_NEXT][level]
+            prev[_NEXT][level] = node
+            node[_WIDTH][level] = prev[_WIDTH][level] - skipped
+            prev[_WIDTH][level] = skipped + 1
+            skipped += steps[level]
+        for level in range(height, self.levels):
+            chain[level][_WIDTH][level] += 1
+        self.count += 1
+
+    def remove(self, value):
+        """
+        Args:
+            value (float): Value to remove, one of the values in the window
+
+        Returns:
+            list: The removed node, for insert() to reuse
+        """
+        chain = self._chain
+        x = self.head
+        for level in range(self.levels - 1, -1, -1):
+            while x[_NEXT][level][_VALUE] < value:
+                x = x[_NEXT][level]
+            chain[level] = x
+        node = x[_NEXT][0]
+        if node[_VALUE] != value:
+            raise KeyError(value)
+        height = len(node[_NEXT])
+        for level in range(height):
+            prev = chain[level]
+            prev[_WIDTH][level] += node[_WIDTH][level] - 1
+            prev[_NEXT][level] = node[_NEXT][level]
+        for level in range(height, self.levels):
+            chain[level][_WIDTH][level] -= 1
+        self.count -= 1
+        return node
+
+
+class RangeWindow:
+    def __init__(self, size=15, threshold=3.0, min_samples=5):
+        """
+        Sliding window of range samples with a median/IQR outlier test.
+
+        Samples live in a fixed-size ring buffer and, in parallel, in a SortedWindow, so each
+        update and the median and interquartile range each cost O(log n). Running sums give
+        the window's mean and variance without re-scanning it.
+
+        A sample is rejected when it lies more than threshold robust standard deviations
+        from the window median, estimated as IQR / 1.349 rather than from the median
+        absolute deviation of a Hampel filter, which cannot be updated in O(log n).
+        Rejected samples still enter the window, so a real step in range is accepted once
+        it makes up half the window.
+
+        Args:
+            size (int): Number of samples in the window
+            threshold (float): Rejection threshold in robust standard deviations
+            min_samples (int): Samples needed before any sample is rejected
+        """
+        self.size = size
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.ring = [0.0] * size
+        self.sorted = SortedWindow(size)
+        self.index = 0  # next ring slot to write
+        self.count = 0  # samples in the window
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.accepted = 0
+        self.rejected = 0
+
+    def median(self):
+        n = self.count
+        if not n:
+            return None
+        mid = n >> 1
+        if n & 1:
+            return self.sorted[mid]
+        return (self.sorted[mid - 1] + self.sorted[mid]) / 2
+
+    def iqr(self):
+        n = self.count
+        if n < 4:
+            return 0.0
+        return self.sorted[(3 * n) >> 2] - self.sorted[n >> 2]
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def variance(self):
+        if self.count < 2:
+            return 0.0
+        mean = self.total / self.count
+        return max(self.total_sq / self.count - mean * mean, 0.0)
+
+    def is_outlier(self, x):
+        """
+        Args:
+            x (float): Sample to test against the current window
+
+        Returns:
+            bool: True if x is an outlier of the window
+        """
+        if self.count < self.min_samples:
+            return False
+        scale = self.iqr() / 1.349
+        deviation = abs(x - self.median())
+        if scale == 0.0:
+            return False
+        return deviation > self.threshold * scale
+
+    def push(self, x):
+        """
+        Add a sample to the window, dropping the oldest one once the window is full.
+
+        Args:
+            x (float): Sample
+        """
+        node = None
+        if self.count == self.size:
+            old = self.ring[self.index]
+            node = self.sorted.remove(old)
+            self.total -= old
+            self.total_sq -= old * old
+        else:
+            self.count += 1
+        self.ring[self.index] = x
+        self.index = (self.index + 1) % self.size
+        self.sorted.insert(x, node)
+        self.total += x
+        self.total_sq += x * x
+
+    def update(self, x):
+        """
+        Test a sample and add it to the window.
+
+        Args:
+            x (float): Sample
+
+        Returns:
+            float: x, or None if it was rejected as an outlier
+        """
+        outlier = self.is_outlier(x)
+        self.push(x)
+        if outlier:
+            self.rejected += 1
+            return None
+        self.accepted += 1
+        return x
+
+
+class RangeFilter:
+    def __init__(self, size=15, threshold=3.0, min_samples=5):
+        """
+        Per-tag outlier filtering of range measurements, one RangeWindow per tag address.
+
+        Args:
+            size (int): Number of samples in each tag's window
+            threshold (float): Rejection threshold in robust standard deviations
+            min_samples (int): Samples needed before any sample is rejected
+        """
+        self.size = size
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.windows = {}  # tag address -> RangeWindow
+
+    def window(self, addr):
+        window = self.windows.get(addr)
+        if window is None:
+            window = self.windows[addr] = RangeWindow(self.size, self.threshold, self.min_samples)
+        return window
+
+    def update(self, addr, distance):
+        """
+        Args:
+            addr (int): Tag address
+            distance (float): Measured range in meters
+
+        Returns:
+            float: distance, or None if it was rejected as an outlier
+        """
+        return self.window(addr).update(distance)
+
+    def forget(self, addr):
+        self.windows.pop(addr, None)
+
+
+class RangeTrack:
+    def __init__(self, process_noise=1.0, measurement_noise=0.05, gate=None, max_misses=3):
+        """
+        Constant-velocity Kalman filter of one tag's range.
+
+        The state is range and range-rate with a 2x2 covariance, all held in float attributes,
+        so a step allocates no containers. Between measurements the track can be extrapolated
+        with estimate(), which lets the ranging rate drop without a choppy output.
+
+        With a gate, a measurement whose innovation exceeds gate standard deviations of its
+        predicted spread is rejected before it touches the state. After max_misses rejections
+        in a row the track restarts from the next measurement, so a real jump is not locked out.
+
+        Args:
+            process_noise (float): Acceleration noise spectral density in m^2/s^3
+            measurement_noise (float): Standard deviation of a range measurement in meters
+            gate (float, optional): Gate in standard deviations, None accepts every measurement
+            max_misses (int): Consecutive gated measurements before the track restarts
+        """
+        self.q = process_noise
+        self.r = measurement_noise * measurement_noise
+        self.gate_sq = gate * gate if gate is not None else None
+        self.max_misses = max_misses
+        self.valid = False
+        self.time = 0  # ticks_ms() of the state
+        self.range = 0.0
+        self.rate = 0.0  # m/s, positive when the tag moves away
+        self.p00 = 0.0
+        self.p01 = 0.0
+        self.p11 = 0.0
+        self.misses = 0
+        self.updates = 0
+        self.rejected = 0
+
+    def reset(self, distance, now):
+        self.valid = True
+        self.time = now
+        self.range = distance
+        self.rate = 0.0
+        self.p00 = self.r
+        self.p01 = 0.0
+        self.p11 = 1.0  # a tag walking at about 1 m/s
+        self.misses = 0
+
+    def predict(self, now):
+        """
+        Advance the state to now.
+
+        Args:
+            now (int): ticks_ms()
+        """
+        dt = time.ticks_diff(now, self.time) / 1000
+        if dt <= 0:
+            return
+        q = self.q
+        self.range += self.rate * dt
+        self.p00 += dt * (2 * self.p01 + dt * self.p11) + q * dt * dt * dt / 3
+        self.p01 += dt * self.p11 + q * dt * dt / 2
+        self.p11 += q * dt
+        self.time = now
+
+    def estimate(self, now=None):
+        """
+        Extrapolate the range to now without changing the state.
+
+        Args:
+            now (int, optional): ticks_ms(), read if not given
+
+        Returns:
+            float: Predicted range in meters, None before the first measurement
+        """
+        if not self.valid:
+            return None
+        if now is None:
+            now = time.ticks_ms()
+        return self.range + self.rate * time.ticks_diff(now, self.time) / 1000
+
+    def update(self, distance, now=None):
+        """
+        Fold a measurement into the track.
+
+        Args:
+            distance (float): Measured range in meters
+            now (int, optional): ticks_ms() of the measurement, read if not given
+
+        Returns:
+            float: Filtered range in meters, None if the gate rejected distance
+        """
+        if now is None:
+            now = time.ticks_ms()
+        if not self.valid:
+            self.reset(distance, now)
+            self.updates += 1
+            return self.range
+        self.predict(now)
+        innovation = distance - self.range
+        s = self.p00 + self.r
+        if self.gate_sq is not None and innovation * innovation > self.gate_sq * s:
+            self.rejected += 1
+            self.misses += 1
+            if self.misses >= self.max_misses:
+                self.valid = False
+            return None
+        k0 = self.p00 / s
+        k1 = self.p01 / s
+        self.range += k0 * innovation
+        self.rate += k1 * innovation
+        self.p11 -= k1 * self.p01
+        self.p01 -= k0 * self.p01
+        self.p00 -= k0 * self.p00
+        self.misses = 0
+        self.updates += 1
+        return self.range
+
+
+class RangeTracker:
+    def __init__(self, process_noise=1.0, measurement_noise=0.05, gate=None, max_misses=3):
+        """
+        Per-tag range tracking, one RangeTrack per tag address.
+
+        Args:
+            process_noise (float): Acceleration noise spectral density in m^2/s^3
+            measurement_noise (float): Standard deviation of a range measurement in meters
+            gate (float, optional): Prediction gate in standard deviations, None to disable
+            max_misses (int): Consecutive gated measurements before a track restarts
+        """
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.gate = gate
+        self.max_misses = max_misses
+        self.tracks = {}  # tag address -> RangeTrack
+
+    def track(self, addr):
+        track = self.tracks.get(addr)
+        if track is None:
+            track = self.tracks[addr] = RangeTrack(
+                self.process_noise, self.measurement_noise, self.gate, self.max_misses)
+        return track
+
+    def update(self, addr, distance, now=None):
+        """
+        Args:
+            addr (int): Tag address
+            distance (float): Measured range in meters
+            now (int, optional): ticks_ms() of the measurement, read if not given
+
+        Returns:
+            float: Filtered range in meters, None if the gate rejected distance
+        """
+        return self.track(addr).update(distance, now)
+
+    def estimate(self, addr, now=None):
+        """
+        Returns:
+            float: Predicted range of the tag in meters, None if it has no track
+        """
+        track = self.tracks.get(addr)
+        return track.estimate(now) if track is not None else None
+
+    def forget(self, addr):
+        self.tracks.pop(addr, None)
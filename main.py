@@ -1,4 +1,5 @@
 from node import UWBNode
+from scheduler import SuperframeScheduler
 from random import randint
 import uasyncio
 
@@ -8,6 +9,9 @@ irq_pin = Pin(14, Pin.IN) ''' # Assuming the IRQ pin is connected to GPIO 14
 # Example usage
 PAN_ID = 0xB34A  # Example PAN ID
 SRC_ADDR = 0x5678 #update for src
+SLOT_MS = 20  # one ranging exchange per slot
+SUPERFRAMES_PER_HANDSHAKE = 50  # ranging rounds between discoveries of new tags
+ONE_TO_MANY = False  # range all tags from one broadcast poll per superframe
 
 async def main():
     # Example parameters
@@ -21,24 +25,30 @@ async def main():
     await node.init()
 
     def distance_callback(distance, dest_addr):
-        print(f"Device: {hex(dest_addr)} Distance: {distance:.3f} m ({distance/.0254:.2f} in)")
+        rate = node.tracker.track(dest_addr).rate
+        print(f"Device: {hex(dest_addr)} Distance: {distance:.3f} m ({distance/.0254:.2f} in) Rate: {rate:+.2f} m/s")
     
     # Main loop
     #make ranging faster and more reliable
     #reset dwm1000 if device overrun
-    #handle distance outliers
     #make handshake more reliable
     #work out multiple nodes, multiple tags logic for ranging
     #hook up MQTT backend
 
+    scheduler = SuperframeScheduler(node, slot_ms=SLOT_MS, one_to_many=ONE_TO_MANY)
+
     while True:
-        result = await node.handshake()
-        if result is not None:
-            for device in result:
-                await node.init()
-                await node.start_ranging(int(device), callback=distance_callback)
-                await uasyncio.sleep_ms(50)
-        await node.init()
-        await uasyncio.sleep(2)
+        # Fresh tags in the neighbor table stay silent, only new tags answer the beacons
+        await node.handshake()
+        # Aged-out and evicted tags give up their slot, filter window and track
+        for addr in node.neighbors.expire():
+            scheduler.remove(addr)
+        for addr in node.neighbors.addresses():
+            scheduler.assign(addr)
+        await scheduler.run(distance_callback, count=SUPERFRAMES_PER_HANDSHAKE)
+        scheduler.report()
+        for addr, window in node.range_filter.windows.items():
+            print(f"{hex(addr)}: mean {window.mean():.3f} m, std {window.variance() ** 0.5:.3f} m, "
+                  f"{window.rejected} outliers rejected")
 
 uasyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,144 @@
+import time
+
+
+class Neighbor:
+    def __init__(self, addr, now):
+        """
+        What a node knows about one tag.
+
+        Args:
+            addr (int): Tag address
+            now (int): ticks_ms() when the tag was first heard
+        """
+        self.addr = addr
+        self.first_seen = now
+        self.last_seen = now  # last discovery answer or successful range
+        self.attempts = 0
+        self.successes = 0
+        self.success_rate = 1.0  # exponential moving average over ranging attempts
+        self.last_range = None  # meters
+        self.link_quality = None  # first path amplitude over noise of the last response
+
+    def record(self, success, now, quality=None):
+        self.attempts += 1
+        self.success_rate += NeighborTable.RATE_WEIGHT * ((1.0 if success else 0.0) - self.success_rate)
+        if success:
+            self.successes += 1
+            self.last_seen = now
+            if quality is not None:
+                self.link_quality = quality
+
+
+class NeighborTable:
+    RATE_WEIGHT = 0.2  # weight of the newest attempt in the success rate
+
+    def __init__(self, max_size=32, max_age_ms=10000, fresh_ms=2000):
+        """
+        Tags known to a node, keyed by integer address.
+
+        Entries age out max_age_ms after the tag was last heard. When the table is full the
+        least recently heard tag makes room for a new one, and is reported by the next
+        expire() like an aged-out tag. Tags heard within fresh_ms do not
+        need rediscovering, discovery beacons list them so they stay silent.
+
+        Args:
+            max_size (int): Maximum number of tags
+            max_age_ms (int): Time without hearing a tag before it is dropped
+            fresh_ms (int): Time after hearing a tag during which it counts as fresh
+        """
+        self.max_size = max_size
+        self.max_age_ms = max_age_ms
+        self.fresh_ms = fresh_ms
+        self.entries = {}  # address -> Neighbor
+        self.evicted = []  # addresses evicted to make room, until the next expire()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, addr):
+        return addr in self.entries
+
+    def get(self, addr):
+        return self.entries.get(addr)
+
+    def addresses(self):
+        return list(self.entries)
+
+    def seen(self, addr, now=None):
+        """
+        Record that a tag answered, adding it to the table if needed.
+
+        Args:
+            addr (int): Tag address
+            now (int, optional): ticks_ms(), read if not given
+
+        Returns:
+            Neighbor: The tag's entry
+        """
+        if now is None:
+            now = time.ticks_ms()
+        entry = self.entries.get(addr)
+        if entry is None:
+            if len(self.entries) >= self.max_size:
+                self._evict()
+            entry = self.entries[addr] = Neighbor(addr, now)
+        else:
+            entry.last_seen = now
+        return entry
+
+    def record(self, addr, success, quality=None, now=None):
+        """
+        Record the outcome of a ranging attempt with a known tag.
+
+        Args:
+            addr (int): Tag address
+            success (bool): Whether the tag answered
+            quality (float, optional): Link quality of the answer
+            now (int, optional): ticks_ms(), read if not given
+        """
+        entry = self.entries.get(addr)
+        if entry is not None:
+            entry.record(success, time.ticks_ms() if now is None else now, quality)
+
+    def set_range(self, addr, distance):
+        entry = self.entries.get(addr)
+        if entry is not None:
+            entry.last_range = distance
+
+    def fresh(self, now=None):
+        """
+        Returns:
+            list: Addresses of the tags heard within fresh_ms
+        """
+        if now is None:
+            now = time.ticks_ms()
+        return [addr for addr, entry in self.entries.items()
+                if time.ticks_diff(now, entry.last_seen) < self.fresh_ms]
+
+    def expire(self, now=None):
+        """
+        Drop the tags not heard within max_age_ms.
+
+        Returns:
+            list: Addresses of the dropped tags and of the tags evicted since the last call
+                  that have not come back
+        """
+        if now is None:
+            now = time.ticks_ms()
+        expired = [addr for addr, entry in self.entries.items()
+                   if time.ticks_diff(now, entry.last_seen) >= self.max_age_ms]
+        for addr in expired:
+            del self.entries[addr]
+        for addr in self.evicted:
+            if addr not in self.entries and addr not in expired:
+                expired.append(addr)
+        self.evicted = []
+        return expired
+
+    def _evict(self):
+        oldest = None
+        for entry in self.entries.values():
+            if oldest is None or time.ticks_diff(entry.last_seen, oldest.last_seen) < 0:
+                oldest = entry
+        del self.entries[oldest.addr]
+        self.evicted.append(oldest.addr)
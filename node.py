@@ -3,6 +3,9 @@ import time
 from machine import Pin
 import uasyncio
 from random import randint
+from dispatcher import StatusDispatcher, RX_OK, RX_EVENTS
+from neighbors import NeighborTable
+from filters import RangeFilter, RangeTracker
 
 class UWBNode:
     def __init__(self, pan, src, led_pin="LED", irq_pin_num=14):
@@ -15,24 +18,49 @@ class UWBNode:
         """
         self.led = Pin(led_pin, Pin.OUT)
         self.irq_pin = Pin(irq_pin_num, Pin.IN)
+        self.events = StatusDispatcher(self.irq_pin)
         
         # Constants
         self.SPEED_OF_LIGHT = 299702547  # m/s
         self.UNIT_CONVERSION = 1.565e-11  # s
         self.DELAY = 65897.62
+        self.REPLY_DELAY_US = 3000  # tag response delay after the poll, matches UWBTag.REPLY_DELAY_US
+        self.RESPONSE_TIMEOUT_MS = 5  # response to a poll
+        # Slotted discovery: tags answer a beacon in a slot derived from their address
+        self.DISCOVERY = 0x64  # first payload byte ('d') of a discovery beacon
+        self.DISCOVERY_SLOTS = 8  # slots of the first beacon, doubled after collisions
+        self.MAX_DISCOVERY_SLOTS = 32
+        self.MAX_BEACONS = 8  # beacons per handshake
+        # Hardware receive timeouts, from the expected reply time (also bounds the report)
+        self.RESPONSE_WAIT_US = self.REPLY_DELAY_US + 1000
+        self.RESPONSE_PREAMBLE_PACS = (self.REPLY_DELAY_US + 500) // 8  # PACs of 8 symbols (~8 us)
+        self.TIMESTAMP_MASK = 0xFFFFFFFFFF  # 40 bit device time
+        self.double_sided = True  # follow each response with the final/report frames of DS-TWR
+        # One-to-many ranging
+        self.MULTI_POLL = 0x6D  # first payload byte ('m') of a broadcast poll carrying a slot map
+        self.RESPONSE_SLOT_US = 1500  # spacing of the tags' responses to a broadcast poll
+        self.MAX_SLOTS = 40  # slot map entries that fit in a frame and in one RX_FWTO window
         
         # Instance variables for timestamps and messages
         self.r_2 = 0  # Reception timestamp 2
         self.t_3 = 0  # Transmission timestamp 3
         self.t_1 = 0  # Transmission timestamp 1
         self.r_4 = 0  # Reception timestamp 4
+        self.t_5 = 0  # Transmission timestamp 5 (final)
+        self.r_6 = 0  # Reception timestamp 6 (final, reported by the tag)
+        self.clock_offset = 0.0  # tag clock rate over node clock rate minus one
+        self.ds_success = False  # last exchange completed the double-sided frames
         self.success_tr = False
-        self.success_times = False
         self.sequence = None
-        self.times_message = bytearray([])
+        self.times_message = bytearray(23)
+        self.report_message = bytearray(18)
+        self.many_responses = []  # (tag address, r_4, t_3, r_2, clock offset) per response
         self.pan = pan
         self.id = src
-        self.handshake_results = []
+        self.neighbors = NeighborTable()
+        self.range_filter = RangeFilter()  # None passes every measurement through
+        self.tracker = RangeTracker()  # None publishes raw ranges
+        self.dest_addr = None  # tag of the last twr()
 
     async def init(self):
         """
@@ -55,69 +83,27 @@ class UWBNode:
             is_coordinator=False,
             enable_reserved=False
         )
+        dwmCom.mark_baseline()
 
-    def _handle_twr_interrupt(self, pin):
-        """Handle interrupt for TWR transmission."""
-        self.t_1 = dwmCom.get_tx_timestamp()
-        self.r_4 = dwmCom.get_rx_timestamp()
-        message = bytearray(dwmCom.read_register_intuitive(0x11, 5))
-        sequence = message[2]
-        if sequence == self.sequence:
-            self.range_success = True
-            self.led.toggle()
-
-    def _handle_handshake_interrupt(self, pin):
-        """Handle interrupt for handshake."""
-        message = dwmCom.read_register(0x11, 18)
-        dwmCom.toggle_buffer()
-        dwmCom.search()
-        message = bytearray(reversed(message))
-        sequence = message[15]
-        target_addr = int.from_bytes(message[7:9], 'big')
-        if sequence == self.sequence and target_addr not in self.handshake_results:
-            self.handshake_results.append(hex(target_addr))
-            #self.led.toggle()
-
-    def _handle_interrupt_times(self, pin):
-        """Handle interrupt for timestamp reception."""
-        self.times_message = bytearray(dwmCom.read_register_intuitive(0x11, 23))
-        sequence_received = self.times_message[20]
-
-        if sequence_received == self.sequence:
-            self.success_times = True
-            self.led.toggle()
-
-    async def receive_times(self):
+    async def rearm(self):
         """
-        Receive timing data for a specific sequence number.
-        
-        Args:
-            sequence (int): Sequence number to match
-        
-        Returns:
-            bool: Success status
+        Return the radio to idle between ranging phases without reconfiguring it.
+        Falls back to a full init() when the radio fails its health check.
         """
-        self.success_times = False
-        
-        self.irq_pin.irq(trigger=Pin.IRQ_RISING, handler=self._handle_interrupt_times)
+        if dwmCom.is_configured():
+            dwmCom.rearm()
+        else:
+            await self.init()
 
-        count = 0
-        while not self.success_times and count <= 200:
-            dwmCom.search()
-            await uasyncio.sleep_ms(5)
-            count += 1
-
-        return self.success_times
-    
     async def twr(self, dest_addr):
         """
-        Perform Two-Way Ranging (TWR).
-        
+        Perform single round-trip Two-Way Ranging (TWR).
+
+        The tag answers the poll with a delayed transmission whose payload carries its own
+        predicted TX timestamp (t_3) and the poll reception timestamp (r_2).
+
         Args:
-            pan_id (int): PAN identifier
-            src_addr (int): Source address
             dest_addr (int): Destination address
-            sequence_num (int): Sequence number
         
         Returns:
             bool: Success status
@@ -133,38 +119,131 @@ class UWBNode:
             payload='hello',
             security_enabled=False,
             frame_pending=False,
-            ack_request=True,
+            ack_request=False,
             pan_id_compress=False
         )
 
-        dwmCom.init_auto_ack(auto_ack=True, rx_auth=True)
-        dwmCom.set_receive_interrupt()
+        self.events.start(RX_EVENTS)
 
+        self.dest_addr = dest_addr
         self.range_success = False
-        self.irq_pin.irq(trigger=Pin.IRQ_RISING, handler=self._handle_twr_interrupt)
-        
+        self.ds_success = False
+        self.events.set_rx_timeouts(self.RESPONSE_WAIT_US, self.RESPONSE_PREAMBLE_PACS)
         dwmCom.transmit_and_wait()
-        time.sleep_ms(1)
+
+        if await self.events.receive(self.RESPONSE_TIMEOUT_MS, enable=False) is RX_OK:
+            dwmCom.readinto(0x11, 0, self.times_message)
+            src_addr = self.times_message[9] | (self.times_message[10] << 8)
+            if self.times_message[2] == self.sequence and src_addr == dest_addr:
+                self.t_1 = dwmCom.get_tx_timestamp()
+                self.r_4 = dwmCom.get_rx_timestamp()
+                self.clock_offset = dwmCom.get_clock_offset()
+                self.range_success = True
+                self.led.toggle()
 
         if self.range_success:
-            time.sleep_ms(5)
-            time_received = await self.receive_times()
+            self.neighbors.record(dest_addr, True, dwmCom.get_rx_quality())
+            if self.double_sided:
+                self.ds_success = await self.final(dest_addr)
+        else:
+            self.neighbors.record(dest_addr, False)
+
+        return self.range_success
 
-            return time_received
-        return False
+    async def final(self, dest_addr):
+        """
+        Send the final frame of a double-sided exchange and receive the tag's report of
+        when it arrived.
+
+        Args:
+            dest_addr (int): Destination address
+
+        Returns:
+            bool: Success status, t_5 and r_6 are valid when True
+        """
+        dwmCom.format_message_mac(
+            frame_type=1,
+            seq_num=self.sequence,
+            dest_pan_id=self.pan,
+            dest_addr=dest_addr,
+            src_pan_id=self.pan,
+            src_addr=self.id,
+            payload='final',
+            security_enabled=False,
+            frame_pending=False,
+            ack_request=False,
+            pan_id_compress=False
+        )
+
+        self.events.start(RX_EVENTS)
+        self.events.set_rx_timeouts(self.RESPONSE_WAIT_US, self.RESPONSE_PREAMBLE_PACS)
+        dwmCom.transmit_and_wait()
+
+        if await self.events.receive(self.RESPONSE_TIMEOUT_MS, enable=False) is not RX_OK:
+            return False
+        dwmCom.readinto(0x11, 0, self.report_message)
+        src_addr = self.report_message[9] | (self.report_message[10] << 8)
+        if self.report_message[2] != self.sequence or src_addr != dest_addr:
+            return False
+        self.t_5 = dwmCom.get_tx_timestamp()
+        self.r_6 = int.from_bytes(self.report_message[11:16], 'little')
+        return True
     
     async def handshake(self):
         """
-        handshake to determine what node to range with.
+        Slotted discovery to determine what tags to range with.
+
+        Each beacon announces a number of response slots and lists the tags already
+        discovered, which stay silent. Every other tag answers in a slot derived from its
+        address and the beacon number, so tags that collided pick different slots in the
+        next beacon. Collisions show as receive errors and double the slots of the next
+        beacon. Discovery ends after a beacon without responses or collisions.
+
+        Tags that are fresh in the neighbor table are listed from the first beacon, so
+        with no new tags around discovery costs a single quiet beacon.
         
+        Returns:
+            list: Addresses (int) of the newly discovered tags, or None
+        """
+        found = self.neighbors.fresh()
+        known = len(found)
+        slots = self.DISCOVERY_SLOTS
+        self.beacons = 0
+        for beacon in range(self.MAX_BEACONS):
+            self.beacons += 1
+            heard, collisions = await self.beacon(beacon, slots, found)
+            if not heard and not collisions:
+                break
+            if collisions:
+                slots = min(slots * 2, self.MAX_DISCOVERY_SLOTS)
+        await self.rearm()
+
+        if len(found) > known:
+            return found[known:]
+        return None
+
+    async def beacon(self, number, slots, found):
+        """
+        Send one discovery beacon and collect the answers in its response slots.
+
         Args:
-            pan_id (int): PAN identifier
-            src_addr (int): Source address
-            sequence_num (int): Sequence number
-        
+            number (int): Beacon number within the discovery, varies the tags' slots
+            slots (int): Response slots
+            found (list): Addresses already discovered, announced and extended in place
+
         Returns:
-            bool: Success status
+            tuple: (tags heard, receive errors seen) during the response window
         """
+        acked = found[:self.MAX_SLOTS]
+        payload = bytearray(5 + 2 * len(acked))
+        payload[0] = self.DISCOVERY
+        payload[1] = slots
+        payload[2] = self.RESPONSE_SLOT_US & 0xFF
+        payload[3] = self.RESPONSE_SLOT_US >> 8
+        payload[4] = number
+        for i, addr in enumerate(acked):
+            payload[5 + 2 * i] = addr & 0xFF
+            payload[6 + 2 * i] = addr >> 8
         self.sequence = randint(0,255)
         dwmCom.format_message_mac(
             frame_type=1,
@@ -173,52 +252,198 @@ class UWBNode:
             dest_addr=0XFFFF,
             src_pan_id=self.pan,
             src_addr=self.id,
-            payload='hello',
+            payload=payload,
             security_enabled=False,
             frame_pending=False,
             ack_request=False,
             pan_id_compress=False
         )
 
-        self.handshake_success = False
-
-        dwmCom.transmit()
-        time.sleep_ms(5)
-
-        await self.init()
-        dwmCom.set_receive_interrupt()
+        window_us = self.REPLY_DELAY_US + slots * self.RESPONSE_SLOT_US + 500
         dwmCom.enable_double_buffering()
-        self.irq_pin.irq(trigger=Pin.IRQ_RISING, handler=self._handle_handshake_interrupt)
-        count = 0
-        while count <= 150:
-            dwmCom.search()
-            await uasyncio.sleep_ms(5)
-            count += 1
+        self.events.start(RX_EVENTS)
+        self.events.set_rx_timeouts(window_us, 0)
+        errors = self.events.rx_errors
+        dwmCom.transmit_and_wait()
+        window_end = time.ticks_add(time.ticks_us(), window_us)
 
-        if len(self.handshake_results) > 0:
-            print(self.handshake_results)
-            ranging_targets = self.handshake_results
-            self.handshake_results = []
-            return ranging_targets
-        return None
+        heard = 0
+        enable = False
+        while await self.receive_in_window(window_end, enable):
+            enable = True
+            message = dwmCom.read_view(0x11, 0, 11)
+            sequence = message[2]
+            target_addr = message[9] | (message[10] << 8)
+            dwmCom.toggle_buffer()
+            if sequence == self.sequence:
+                heard += 1
+                self.neighbors.seen(target_addr)
+                if target_addr not in found:
+                    found.append(target_addr)
+        return heard, self.events.rx_errors - errors
 
     async def get_distance(self):
         """
         Calculate distance based on timestamps.
+
+        Uses asymmetric double-sided TWR when the last exchange completed the final and
+        report frames, which cancels the crystal offset between node and tag. Otherwise
+        falls back to single-sided TWR with the tag's reply time corrected by the clock
+        offset measured on its response.
         
         Returns:
             float: Calculated distance in meters
         """
-        self.r_2 = int(self.times_message[2:7].hex(), 16)
-        self.t_3 = int(self.times_message[7:12].hex(), 16)
+        self.t_3 = int.from_bytes(self.times_message[11:16], 'little')
+        self.r_2 = int.from_bytes(self.times_message[16:21], 'little')
 
-        t1 = self.r_4 - self.t_1
-        t2 = self.t_3 - self.r_2
+        t1 = (self.r_4 - self.t_1) & self.TIMESTAMP_MASK  # node round trip
+        t2 = (self.t_3 - self.r_2) & self.TIMESTAMP_MASK  # tag reply
 
-        tof = (t1 - t2 - self.DELAY) / 2
-        distance = tof * self.UNIT_CONVERSION * self.SPEED_OF_LIGHT
+        if self.ds_success:
+            t3 = (self.r_6 - self.t_3) & self.TIMESTAMP_MASK  # tag round trip
+            t4 = (self.t_5 - self.r_4) & self.TIMESTAMP_MASK  # node reply
+            tof = (t1 * t3 - t2 * t4) / (t1 + t2 + t3 + t4) - self.DELAY / 2
+            distance = tof * self.UNIT_CONVERSION * self.SPEED_OF_LIGHT
+        else:
+            distance = self.ss_distance(t1, t2, self.clock_offset)
+        self.neighbors.set_range(self.dest_addr, distance)
         return distance
 
+    def ss_distance(self, round_trip, reply, clock_offset):
+        """
+        Single-sided TWR distance with the tag's reply time converted to node time.
+
+        Args:
+            round_trip (int): Poll transmission to response reception, node time
+            reply (int): Poll reception to response transmission, tag time
+            clock_offset (float): Tag clock rate over node clock rate minus one
+
+        Returns:
+            float: Calculated distance in meters
+        """
+        tof = (round_trip - reply * (1 - clock_offset) - self.DELAY) / 2
+        return tof * self.UNIT_CONVERSION * self.SPEED_OF_LIGHT
+
+    async def twr_many(self, tags, callback=None):
+        """
+        One-to-many ranging: one broadcast poll whose payload maps each tag to a response
+        slot, answered by every tag with a delayed transmission in its slot.
+
+        Args:
+            tags (list): Tag addresses (int) in slot order, at most MAX_SLOTS
+            callback (callable, optional): Function to call with each distance measurement
+
+        Returns:
+            dict: Distance in meters by address of the tags that answered
+        """
+        tags = tags[:self.MAX_SLOTS]
+        self.sequence = randint(0,255)
+        payload = bytearray(3 + 2 * len(tags))
+        payload[0] = self.MULTI_POLL
+        payload[1] = self.RESPONSE_SLOT_US & 0xFF
+        payload[2] = self.RESPONSE_SLOT_US >> 8
+        for i, addr in enumerate(tags):
+            payload[3 + 2 * i] = addr & 0xFF
+            payload[4 + 2 * i] = addr >> 8
+        dwmCom.format_message_mac(
+            frame_type=1,
+            seq_num=self.sequence,
+            dest_pan_id=self.pan,
+            dest_addr=0xFFFF,
+            src_pan_id=self.pan,
+            src_addr=self.id,
+            payload=payload,
+            security_enabled=False,
+            frame_pending=False,
+            ack_request=False,
+            pan_id_compress=False
+        )
+
+        window_us = self.REPLY_DELAY_US + len(tags) * self.RESPONSE_SLOT_US + 500
+        self.events.start(RX_EVENTS)
+        # No preamble timeout, it would end the window at the first empty slot
+        self.events.set_rx_timeouts(window_us, 0)
+        dwmCom.transmit_and_wait()
+        window_end = time.ticks_add(time.ticks_us(), window_us)
+
+        self.many_responses.clear()
+        enable = False
+        while len(self.many_responses) < len(tags):
+            if not await self.receive_in_window(window_end, enable):
+                break
+            enable = True
+            dwmCom.readinto(0x11, 0, self.times_message)
+            src_addr = self.times_message[9] | (self.times_message[10] << 8)
+            if self.times_message[2] == self.sequence and src_addr in tags:
+                self.many_responses.append((
+                    src_addr,
+                    dwmCom.get_rx_timestamp(),
+                    int.from_bytes(self.times_message[11:16], 'little'),
+                    int.from_bytes(self.times_message[16:21], 'little'),
+                    dwmCom.get_clock_offset(),
+                ))
+
+        distances = {}
+        if self.many_responses:
+            self.t_1 = dwmCom.get_tx_timestamp()
+            for addr, r_4, t_3, r_2, clock_offset in self.many_responses:
+                distance = self.ss_distance(
+                    (r_4 - self.t_1) & self.TIMESTAMP_MASK,
+                    (t_3 - r_2) & self.TIMESTAMP_MASK,
+                    clock_offset)
+                distances[addr] = distance
+                self.neighbors.record(addr, True)
+                self.neighbors.set_range(addr, distance)
+                self.publish(distance, addr, callback)
+            self.led.toggle()
+        for addr in tags:
+            if addr not in distances:
+                self.neighbors.record(addr, False)
+        return distances
+
+    def publish(self, distance, addr, callback):
+        """
+        Pass a measurement through the range filter and the range tracker on to the callback.
+
+        Args:
+            distance (float): Measured range in meters
+            addr (int): Tag address
+            callback (callable): Called with (distance, addr), distance being the tracked range,
+                unless the filter or the tracker's gate rejects the measurement
+        """
+        if self.range_filter is not None:
+            distance = self.range_filter.update(addr, distance)
+        if distance is not None and self.tracker is not None:
+            distance = self.tracker.update(addr, distance)
+        if distance is not None and callback:
+            callback(distance, addr)
+
+    async def receive_in_window(self, window_end, enable=True):
+        """
+        Receive the next good frame of a multi-slot response window.
+
+        Args:
+            window_end (int): ticks_us() at which the window closes
+            enable (bool): False for the first frame after a transmit with WAIT4RESP
+
+        Returns:
+            bool: True if a frame was received before the window closed
+        """
+        remaining = time.ticks_diff(window_end, time.ticks_us())
+        if remaining <= 0:
+            return False
+        return await self.events.receive(remaining // 1000 + 1, remaining, enable=enable) is RX_OK
+
+    def get_clock_drift(self):
+        """
+        Clock offset of the last ranged tag relative to this node.
+
+        Returns:
+            float: Offset in parts per million, positive when the tag's clock runs fast
+        """
+        return self.clock_offset * 1e6
+
     async def get_calibration_data(self):
         """
         Get calibration data from timestamps.
@@ -226,8 +451,8 @@ class UWBNode:
         Returns:
             tuple: (t1, t2) timing values for calibration
         """
-        self.r_4 = int(self.times_message[2:7].hex(), 16)
-        self.t_1 = int(self.times_message[7:12].hex(), 16)
+        self.t_1 = int.from_bytes(self.times_message[11:16], 'little')
+        self.r_4 = int.from_bytes(self.times_message[16:21], 'little')
 
         t1 = self.r_4 - self.t_1
         t2 = self.t_3 - self.r_2
@@ -246,10 +471,8 @@ class UWBNode:
         while not is_response and count < 5:
             is_response = await self.twr(dest_addr)
             if is_response:
-                distance = await self.get_distance()
-                if callback:
-                    callback(distance, dest_addr)
-            else: await self.init()
+                self.publish(await self.get_distance(), dest_addr, callback)
+            else: await self.rearm()
             count += 1
 
     async def start_calibration(self, num_samples=100):
@@ -0,0 +1,78 @@
+"""
+Binary ranging record format shared by the anchors and the backend.
+
+A record is a fixed 16-byte little-endian struct:
+
+    offset  size  field
+    0       1     version (RECORD_VERSION)
+    1       2     tag address
+    3       4     distance in millimeters, signed
+    7       8     timestamp in microseconds
+    15      1     link quality, 0 when unknown
+
+A payload carries one or more records back to back. The version byte is below 0x20, so a
+binary payload never starts like a JSON one ('{').
+"""
+import struct
+
+RECORD_VERSION = 1
+RECORD_FORMAT = '<BHiQB'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+
+def encode_into(buf, offset, tag_id, distance, timestamp_us, quality=0):
+    """
+    Pack one record into a buffer without allocating.
+
+    Args:
+        buf (bytearray): Destination buffer
+        offset (int): Offset of the record in buf
+        tag_id (int): Tag address
+        distance (float): Distance in meters
+        timestamp_us (int): Measurement time in microseconds
+        quality (int): Link quality, clamped to 0-255
+
+    Returns:
+        int: Offset just past the record
+    """
+    struct.pack_into(RECORD_FORMAT, buf, offset, RECORD_VERSION, tag_id & 0xFFFF,
+                     int(distance * 1000), timestamp_us, min(max(int(quality), 0), 255))
+    return offset + RECORD_SIZE
+
+
+def encode(tag_id, distance, timestamp_us, quality=0):
+    """
+    Returns:
+        bytearray: One record, see encode_into for the arguments
+    """
+    buf = bytearray(RECORD_SIZE)
+    encode_into(buf, 0, tag_id, distance, timestamp_us, quality)
+    return buf
+
+
+def is_binary(payload):
+    return len(payload) > 0 and payload[0] == RECORD_VERSION
+
+
+def decode(payload):
+    """
+    Unpack the records of a payload.
+
+    Args:
+        payload (bytes): One or more records
+
+    Returns:
+        list: (tag_id, distance in meters, timestamp_us, quality) per record
+
+    Raises:
+        ValueError: If the payload is not a whole number of records of a known version
+    """
+    if len(payload) % RECORD_SIZE:
+        raise ValueError('payload is not a whole number of records')
+    records = []
+    for offset in range(0, len(payload), RECORD_SIZE):
+        version, tag_id, distance_mm, timestamp_us, quality = struct.unpack_from(RECORD_FORMAT, payload, offset)
+        if version != RECORD_VERSION:
+            raise ValueError(f'unknown record version {version}')
+        records.append((tag_id, distance_mm / 1000, timestamp_us, quality))
+    return records
@@ -0,0 +1,168 @@
+"""
+Store-and-forward ring log of ranging records on the flash filesystem.
+
+While the anchor is offline AnchorNode appends its binary ranging records (see records.py)
+here, and replays them once the broker is back. The log is one fixed-size file, opened once
+and written in place:
+
+    offset  size             field
+    0       16               header: magic, capacity, oldest slot, record count
+    16      capacity * 16    record slots, used as a ring
+
+Appends fill a page buffer in RAM that is written to its slots once full. sync() also writes
+a partial page and the header and flushes the file, which commits it on LittleFS, so records
+are only durable once synced: after a power cut the log comes back as it was at the last
+sync, records appended since are lost and records consumed since are replayed again. When
+the ring is full the oldest records are overwritten.
+
+Memory use is the page buffer and the header, whatever the capacity.
+"""
+import struct
+
+import records
+
+MAGIC = b'RLG1'
+HEADER_FORMAT = '<4sIII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+class RingLog:
+    def __init__(self, path='/ranges.log', capacity=4096, page_records=16):
+        """
+        Open the log, creating it when it is missing or was made with another capacity.
+
+        Args:
+            path (str): Log file
+            capacity (int): Records the log holds, a multiple of page_records
+            page_records (int): Records buffered in RAM between writes, 16 fill a 256-byte flash page
+        """
+        assert capacity % page_records == 0
+        self.path = path
+        self.capacity = capacity
+        self.page_records = page_records
+        self._page = bytearray(page_records * records.RECORD_SIZE)
+        self._page_view = memoryview(self._page)
+        self._header = bytearray(HEADER_SIZE)
+        self.tail = 0  # slot of the oldest record
+        self.count = 0  # records in the log, including the page buffer
+        self._page_slot = 0  # slot of the page buffer's first record
+        self._page_fill = 0  # records in the page buffer
+        self._page_written = 0  # of those, records already written to the file
+        self._dirty = False
+        self.overwritten = 0  # oldest records lost to a full ring
+        self.bytes_written = 0
+        self.syncs = 0
+        self.file = None
+        self._open()
+
+    def _open(self):
+        try:
+            f = open(self.path, 'r+b')
+        except OSError:
+            f = None
+        if f is not None:
+            f.readinto(self._header)
+            magic, capacity, tail, count = struct.unpack(HEADER_FORMAT, self._header)
+            if magic == MAGIC and capacity == self.capacity and tail < capacity and count <= capacity:
+                self.file = f
+                self.tail = tail
+                self.count = count
+                head = (tail + count) % capacity
+                self._page_fill = head % self.page_records
+                self._page_slot = head - self._page_fill
+                if self._page_fill:  # the partial page synced last
+                    f.seek(self._offset(self._page_slot))
+                    f.readinto(self._page_view[:self._page_fill * records.RECORD_SIZE])
+                self._page_written = self._page_fill
+                return
+            f.close()
+        self.file = open(self.path, 'w+b')
+        self._write_header()
+        for _ in range(self.capacity // self.page_records):  # allocate every slot up front
+            self.file.write(self._page)
+        self.file.flush()
+
+    def _offset(self, slot):
+        return HEADER_SIZE + slot * records.RECORD_SIZE
+
+    def _write_header(self):
+        struct.pack_into(HEADER_FORMAT, self._header, 0, MAGIC, self.capacity, self.tail, self.count)
+        self.file.seek(0)
+        self.bytes_written += self.file.write(self._header)
+
+    def _write_page(self):
+        if self._page_written < self._page_fill:
+            self.file.seek(self._offset(self._page_slot + self._page_written))
+            self.bytes_written += self.file.write(
+                self._page_view[self._page_written * records.RECORD_SIZE:self._page_fill * records.RECORD_SIZE])
+            self._page_written = self._page_fill
+
+    def append(self, data):
+        """
+        Append records, overwriting the oldest ones when the log is full.
+
+        Args:
+            data (bytes): One or more records back to back
+        """
+        size = records.RECORD_SIZE
+        n = len(data) // size
+        start = 0
+        while start < n:
+            chunk = min(n - start, self.page_records - self._page_fill)
+            self._page[self._page_fill * size:(self._page_fill + chunk) * size] = data[start * size:(start + chunk) * size]
+            self._page_fill += chunk
+            start += chunk
+            if self._page_fill == self.page_records:
+                self._write_page()
+                self._page_slot = (self._page_slot + self.page_records) % self.capacity
+                self._page_fill = self._page_written = 0
+        self.count += n
+        if self.count > self.capacity:
+            lost = self.count - self.capacity
+            self.tail = (self.tail + lost) % self.capacity
+            self.count = self.capacity
+            self.overwritten += lost
+        self._dirty = True
+
+    def read_into(self, buf):
+        """
+        Copy the oldest records without consuming them, see consume().
+
+        Args:
+            buf (bytearray): Destination, as many whole records as fit are copied
+
+        Returns:
+            int: Records copied, fewer than fit when they wrap around the ring
+        """
+        size = records.RECORD_SIZE
+        n = min(len(buf) // size, self.count)
+        if not n:
+            return 0
+        if self.count <= self._page_fill:  # all of them are still in the page buffer
+            start = self._page_fill - self.count
+            buf[:n * size] = self._page_view[start * size:(start + n) * size]
+            return n
+        n = min(n, self.count - self._page_fill, self.capacity - self.tail)
+        self.file.seek(self._offset(self.tail))
+        return self.file.readinto(memoryview(buf)[:n * size]) // size
+
+    def consume(self, n):
+        """Drop the n oldest records, once they were published"""
+        n = min(n, self.count)
+        self.tail = (self.tail + n) % self.capacity
+        self.count -= n
+        self._dirty = True
+
+    def sync(self):
+        """Write the buffered records and the header and flush the file, a no-op when nothing changed"""
+        if not self._dirty:
+            return
+        self._write_page()
+        self._write_header()
+        self.file.flush()
+        self._dirty = False
+        self.syncs += 1
+
+    def close(self):
+        self.sync()
+        self.file.close()
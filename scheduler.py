@@ -0,0 +1,175 @@
+import time
+import uasyncio
+
+
+class SlotStats:
+    def __init__(self, addr):
+        """
+        Ranging statistics of one superframe slot.
+
+        Args:
+            addr (int): Address of the tag ranged in the slot
+        """
+        self.addr = addr
+        self.attempts = 0
+        self.successes = 0
+        self.overruns = 0  # exchanges that did not fit in the slot
+        self.last_latency_us = 0
+        self.max_latency_us = 0
+        self.total_latency_us = 0
+
+    def record(self, success, latency_us, slot_us):
+        self.attempts += 1
+        if success:
+            self.successes += 1
+        if latency_us > slot_us:
+            self.overruns += 1
+        self.last_latency_us = latency_us
+        self.total_latency_us += latency_us
+        if latency_us > self.max_latency_us:
+            self.max_latency_us = latency_us
+
+    def success_rate(self):
+        return self.successes / self.attempts if self.attempts else 0.0
+
+    def mean_latency_us(self):
+        return self.total_latency_us / self.attempts if self.attempts else 0
+
+
+class SuperframeScheduler:
+    def __init__(self, node, slot_ms=20, one_to_many=False):
+        """
+        TDMA superframe scheduler for ranging many tags from one UWBNode.
+
+        Every known tag owns a fixed slot and the slots run back to back, so each tag is
+        ranged once per superframe of slot_ms * tag count milliseconds. The radio is only
+        re-armed after a failed exchange, never re-initialised between slots.
+
+        In one-to-many mode the superframe is a single broadcast poll and the slots are the
+        tags' staggered responses to it (UWBNode.twr_many), slot_ms is then the length of
+        the whole exchange.
+
+        Args:
+            node (UWBNode): Initialised node doing the ranging
+            slot_ms (int): Slot length in milliseconds, must cover one ranging exchange
+            one_to_many (bool): Range all tags from one broadcast poll
+        """
+        self.node = node
+        self.slot_ms = slot_ms
+        self.one_to_many = one_to_many
+        self.slots = []  # tag address per slot
+        self.stats = {}  # tag address -> SlotStats
+        self.superframes = 0
+
+    def assign(self, addr):
+        """
+        Give a tag a slot at the end of the superframe, if it has none yet.
+
+        Args:
+            addr (int): Tag address
+
+        Returns:
+            int: The tag's slot index
+        """
+        if addr not in self.stats:
+            self.slots.append(addr)
+            self.stats[addr] = SlotStats(addr)
+        return self.slots.index(addr)
+
+    def remove(self, addr):
+        """
+        Free a tag's slot, later slots move up by one, and drop its filter window and track.
+
+        Args:
+            addr (int): Tag address
+        """
+        if addr in self.stats:
+            self.slots.remove(addr)
+            del self.stats[addr]
+        if self.node.range_filter is not None:
+            self.node.range_filter.forget(addr)
+        if self.node.tracker is not None:
+            self.node.tracker.forget(addr)
+
+    def superframe_ms(self):
+        if self.one_to_many:
+            return self.slot_ms if self.slots else 0
+        return self.slot_ms * len(self.slots)
+
+    def update_rate(self):
+        """
+        Returns:
+            float: Ranges per second achievable for each tag
+        """
+        return 1000 / self.superframe_ms() if self.slots else 0.0
+
+    async def run_superframe(self, callback=None):
+        """
+        Range every tag in its slot once.
+
+        Args:
+            callback (callable, optional): Called with (distance, addr) for each measurement
+                the node's range filter accepts
+        """
+        if not self.slots:
+            await uasyncio.sleep_ms(self.slot_ms)
+            return
+        start = time.ticks_ms()
+        if self.one_to_many:
+            await self._range_broadcast(callback)
+        else:
+            await self._range_slots(start, callback)
+        delay = time.ticks_diff(time.ticks_add(start, self.superframe_ms()), time.ticks_ms())
+        if delay > 0:
+            await uasyncio.sleep_ms(delay)
+        self.superframes += 1
+
+    async def _range_slots(self, start, callback):
+        node = self.node
+        slot_us = self.slot_ms * 1000
+        for i, addr in enumerate(self.slots):
+            delay = time.ticks_diff(time.ticks_add(start, i * self.slot_ms), time.ticks_ms())
+            if delay > 0:
+                await uasyncio.sleep_ms(delay)
+            began = time.ticks_us()
+            success = await node.twr(addr)
+            latency = time.ticks_diff(time.ticks_us(), began)
+            self.stats[addr].record(success, latency, slot_us)
+            if success:
+                node.publish(await node.get_distance(), addr, callback)
+            else:
+                await node.rearm()
+
+    async def _range_broadcast(self, callback):
+        node = self.node
+        began = time.ticks_us()
+        distances = await node.twr_many(self.slots, callback)
+        latency = time.ticks_diff(time.ticks_us(), began)
+        for addr in self.slots:
+            self.stats[addr].record(addr in distances, latency, self.slot_ms * 1000)
+        if len(distances) < len(self.slots):
+            await node.rearm()
+
+    async def run(self, callback=None, count=None):
+        """
+        Run superframes back to back.
+
+        Args:
+            callback (callable, optional): Called with (distance, addr) for each measurement
+            count (int, optional): Number of superframes to run, forever if None
+        """
+        while count is None or count > 0:
+            await self.run_superframe(callback)
+            if count is not None:
+                count -= 1
+
+    def report(self):
+        """
+        Print per-slot success rate and exchange latency.
+        """
+        print(f"superframe {self.superframe_ms()} ms, {self.update_rate():.1f} Hz per tag")
+        for i, addr in enumerate(self.slots):
+            stats = self.stats[addr]
+            print(f"slot {i} {hex(addr)}: {stats.successes}/{stats.attempts} ok, "
+                  f"latency mean {stats.mean_latency_us() / 1000:.2f} ms max {stats.max_latency_us / 1000:.2f} ms, "
+                  f"{stats.overruns} overruns")
@@ -0,0 +1,3 @@
+"""
+Host-side (CPython) emulation of the DWM1000 for running and benchmarking the firmware off-device
+"""
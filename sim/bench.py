@@ -0,0 +1,278 @@
+"""
+Benchmarks of the node/tag protocols on emulated DW1000s
+
+Run from the repository root:
+
+    python -m sim.bench [ranges]
+
+Reports ranges per second and SPI bytes per range for a UWBNode ranging a UWBTag whose
+crystal runs 10 ppm fast, with single-sided and double-sided TWR, then per-slot statistics
+and airtime of several tags ranged in TDMA slots and from one-to-many broadcast polls, and
+discovery latency against the size of the tag population, and the cost and hit rate of the
+per-tag range outlier filter and the accuracy of the per-tag range tracker.
+"""
+import asyncio
+import random
+import sys
+import time
+
+from sim.dw1000 import Air, DW1000
+from sim.host import load_firmware
+
+PAN_ID = 0xB34A
+NODE_ADDR = 0x5678
+TAG_ADDR = 0x1234
+
+
+def make_pair(distance=5.0, tag_ppm=10.0):
+    """
+    :param distance: Distance between node and tag in meters
+    :param tag_ppm: Crystal offset of the tag relative to the node in parts per million
+    :return: (air, node device, tag device, UWBNode, UWBTag) emulated a given distance apart
+    """
+    air, node_dev, firmware, tags = make_network(1, distance, tag_ppm)
+    tag_dev, tag = tags[0]
+    return air, node_dev, tag_dev, firmware.node.UWBNode(PAN_ID, NODE_ADDR), tag
+
+
+def make_network(tag_count, distance=5.0, tag_ppm=10.0):
+    """
+    :param tag_count: Number of tags, addressed TAG_ADDR, TAG_ADDR + 1, ...
+    :param tag_ppm: Crystal offset of the tags, alternately fast and slow, in parts per million
+    :return: (air, node device, node firmware modules, [(tag device, UWBTag)])
+    """
+    air = Air(distance)
+    node_dev = DW1000(air)
+    firmware = load_firmware(node_dev, 'dwmCom', 'dispatcher', 'neighbors', 'filters', 'scheduler', 'node')
+    tags = []
+    for i in range(tag_count):
+        tag_dev = DW1000(air, clock_ppm=tag_ppm * (1 - 2 * (i % 2)))
+        tag = load_firmware(tag_dev, 'dwmCom', 'dispatcher', 'tag').tag.UWBTag(PAN_ID, TAG_ADDR + i)
+        tags.append((tag_dev, tag))
+    return air, node_dev, firmware, tags
+
+
+async def ranging(count=10, distance=5.0, tag_ppm=10.0, double_sided=True):
+    """
+    Range a tag until count distances have been measured
+
+    :return: dict of ranges, elapsed seconds, ranges per second, SPI bytes per range, mean distance and measured clock drift
+    """
+    air, node_dev, tag_dev, node, tag = make_pair(distance, tag_ppm)
+    node.double_sided = double_sided
+    await node.init()
+    await tag.init()
+    tasks = [asyncio.create_task(air.run()), asyncio.create_task(tag.start_handshake())]
+    distances = []
+
+    def distance_callback(distance, dest_addr):
+        distances.append(distance)
+
+    spi_start = node_dev.spi_bytes + tag_dev.spi_bytes
+    start = time.perf_counter()
+    try:
+        while len(distances) < count:
+            await node.handshake()
+            for device in node.neighbors.addresses():
+                await node.rearm()
+                await node.start_ranging(device, callback=distance_callback)
+            await node.rearm()
+    finally:
+        for task in tasks:
+            task.cancel()
+    elapsed = time.perf_counter() - start
+    spi_bytes = node_dev.spi_bytes + tag_dev.spi_bytes - spi_start
+    return {
+        'ranges': len(distances),
+        'elapsed': elapsed,
+        'ranges_per_second': len(distances) / elapsed,
+        'spi_bytes_per_range': spi_bytes / len(distances),
+        'mean_distance': sum(distances) / len(distances),
+        'clock_drift_ppm': node.get_clock_drift(),
+    }
+
+
+async def superframes(tag_count=4, count=20, slot_ms=20, one_to_many=False):
+    """
+    Range tag_count tags in TDMA slots, or from broadcast polls, for count superframes
+
+    :return: dict of the SuperframeScheduler (holding per-slot statistics), elapsed seconds,
+             ranges per second, frames on the air per range and mean distance
+    """
+    air, node_dev, firmware, tags = make_network(tag_count)
+    node = firmware.node.UWBNode(PAN_ID, NODE_ADDR)
+    node.double_sided = False
+    await node.init()
+    tasks = [asyncio.create_task(air.run())]
+    for tag_dev, tag in tags:
+        await tag.init()
+        tasks.append(asyncio.create_task(tag.start_handshake()))
+    scheduler = firmware.scheduler.SuperframeScheduler(node, slot_ms, one_to_many)
+    for i in range(tag_count):
+        scheduler.assign(TAG_ADDR + i)
+    distances = []
+
+    def distance_callback(distance, dest_addr):
+        distances.append(distance)
+
+    await asyncio.sleep(0.01)  # let the tags start listening
+    frames_start = air.frames
+    start = time.perf_counter()
+    try:
+        await scheduler.run(distance_callback, count=count)
+    finally:
+        for task in tasks:
+            task.cancel()
+    elapsed = time.perf_counter() - start
+    return {
+        'scheduler': scheduler,
+        'elapsed': elapsed,
+        'ranges_per_second': len(distances) / elapsed,
+        'frames_per_range': (air.frames - frames_start) / max(len(distances), 1),
+        'mean_distance': sum(distances) / max(len(distances), 1),
+    }
+
+
+async def discovery(tag_count):
+    """
+    Discover a population of tags with the node's slotted handshake
+
+    :return: dict of tags found, beacons sent, collisions on the air and elapsed seconds, then
+             the elapsed seconds of a repeated discovery while all tags are fresh neighbors
+    """
+    air, node_dev, firmware, tags = make_network(tag_count)
+    node = firmware.node.UWBNode(PAN_ID, NODE_ADDR)
+    await node.init()
+    tasks = [asyncio.create_task(air.run())]
+    for tag_dev, tag in tags:
+        await tag.init()
+        tasks.append(asyncio.create_task(tag.start_handshake()))
+    await asyncio.sleep(0.01)  # let the tags start listening
+    start = time.perf_counter()
+    try:
+        found = await node.handshake()
+        elapsed = time.perf_counter() - start
+        beacons = node.beacons
+        start = time.perf_counter()
+        await node.handshake()
+        repeat_elapsed = time.perf_counter() - start
+    finally:
+        for task in tasks:
+            task.cancel()
+    return {
+        'found': len(found or ()),
+        'beacons': beacons,
+        'collisions': air.collisions,
+        'elapsed': elapsed,
+        'repeat_elapsed': repeat_elapsed,
+    }
+
+
+def filtering(samples=10000, noise=0.05, outlier_rate=0.05, window=15):
+    """
+    Filter noisy ranges of a static tag with injected multipath outliers of 1-5 m
+
+    :return: dict of outliers injected, outliers rejected, good samples rejected and
+             microseconds per filtered sample
+    """
+    RangeFilter = load_firmware(DW1000(Air()), 'filters').filters.RangeFilter
+    rng = random.Random(1)
+    values = []
+    for _ in range(samples):
+        outlier = rng.random() < outlier_rate
+        distance = 5.0 + rng.gauss(0, noise)
+        if outlier:
+            distance += rng.choice((-1, 1)) * rng.uniform(1, 5)
+        values.append((distance, outlier))
+    range_filter = RangeFilter(size=window)
+    rejected = []
+    start = time.perf_counter()
+    for distance, outlier in values:
+        rejected.append(range_filter.update(TAG_ADDR, distance) is None)
+    elapsed = time.perf_counter() - start
+    return {
+        'outliers': sum(outlier for _, outlier in values),
+        'caught': sum(r and o for r, (_, o) in zip(rejected, values)),
+        'false_rejects': sum(r and not o for r, (_, o) in zip(rejected, values)),
+        'us_per_sample': elapsed / samples * 1e6,
+    }
+
+
+def tracking(rate_hz=10, output_hz=50, seconds=20, noise=0.05, speed=1.0, outlier_rate=0.05, gate=None):
+    """
+    Track a tag walking to and fro at speed m/s, ranged at rate_hz, and read the predicted
+    range at output_hz
+
+    :return: dict of RMS errors in meters of the raw ranges, the tracked ranges and the
+             predicted ranges between measurements, and the measurements the gate rejected
+    """
+    tracker = load_firmware(DW1000(Air()), 'filters').filters.RangeTrack(gate=gate)
+    rng = random.Random(2)
+
+    def true_range(ms):
+        phase = (ms * speed / 1000) % 8  # 4 m out and back
+        return 3.0 + (phase if phase < 4 else 8 - phase)
+
+    raw = tracked = predicted = 0.0
+    measured = outputs = 0
+    for ms in range(0, seconds * 1000, 1000 // output_hz):
+        if ms % (1000 // rate_hz) == 0:
+            distance = true_range(ms) + rng.gauss(0, noise)
+            if rng.random() < outlier_rate:
+                distance += rng.uniform(1, 5)
+            filtered = tracker.update(distance, ms)
+            raw += (distance - true_range(ms)) ** 2
+            if filtered is not None:
+                tracked += (filtered - true_range(ms)) ** 2
+            measured += 1
+        predicted += (tracker.estimate(ms) - true_range(ms)) ** 2
+        outputs += 1
+    return {
+        'raw_rms': (raw / measured) ** 0.5,
+        'tracked_rms': (tracked / max(tracker.updates, 1)) ** 0.5,
+        'predicted_rms': (predicted / outputs) ** 0.5,
+        'rejected': tracker.rejected,
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for double_sided in (False, True):
+        result = asyncio.run(ranging(count, double_sided=double_sided))
+        print('double-sided TWR' if double_sided else 'single-sided TWR')
+        print(f"  ranges: {result['ranges']} in {result['elapsed']:.2f} s")
+        print(f"  ranges/second: {result['ranges_per_second']:.2f}")
+        print(f"  SPI bytes/range: {result['spi_bytes_per_range']:.0f}")
+        print(f"  mean distance: {result['mean_distance']:.3f} m (true 5.000 m)")
+        print(f"  clock drift: {result['clock_drift_ppm']:.2f} ppm")
+    for title, slot_ms, one_to_many in (('TDMA slots', 20, False), ('one-to-many polls', 15, True)):
+        result = asyncio.run(superframes(slot_ms=slot_ms, one_to_many=one_to_many))
+        scheduler = result['scheduler']
+        print(f'{title}, {len(scheduler.slots)} tags, single-sided TWR')
+        print(f"  {scheduler.superframes} superframes in {result['elapsed']:.2f} s, "
+              f"{result['ranges_per_second']:.1f} ranges/second")
+        print(f"  frames/range: {result['frames_per_range']:.2f}")
+        print(f"  mean distance: {result['mean_distance']:.3f} m (true 5.000 m)")
+        scheduler.report()
+    print('slotted discovery')
+    for tag_count in (1, 4, 8, 16):
+        result = asyncio.run(discovery(tag_count))
+        print(f"  {tag_count:2} tags: {result['found']} found in {result['elapsed'] * 1000:.0f} ms, "
+              f"{result['beacons']} beacons, {result['collisions']} collisions, "
+              f"{result['repeat_elapsed'] * 1000:.0f} ms once known")
+    print('range outlier filter')
+    for window in (15, 63):
+        result = filtering(window=window)
+        print(f"  window {window}: {result['caught']}/{result['outliers']} outliers rejected, "
+              f"{result['false_rejects']} good samples rejected, {result['us_per_sample']:.1f} us/sample")
+    print('range tracker, tag walking at 1 m/s, 5% outliers, output at 50 Hz')
+    for rate_hz in (50, 10):
+        for gate in (None, 4.0):
+            result = tracking(rate_hz, gate=gate)
+            print(f"  ranged at {rate_hz} Hz, gate {gate}: RMS error raw {result['raw_rms']:.3f} m, "
+                  f"tracked {result['tracked_rms']:.3f} m, predicted {result['predicted_rms']:.3f} m, "
+                  f"{result['rejected']} gated")
+
+
+if __name__ == '__main__':
+    main()
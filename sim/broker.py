@@ -0,0 +1,157 @@
+"""
+MQTT 3.1.1 broker stand-in on a local TCP port
+
+Enough of a broker to run the anchors' MQTT clients on the host: CONNECT, SUBSCRIBE, QoS 0
+and QoS 1 PUBLISH with routing to subscribers, PINGREQ and DISCONNECT. It can misbehave on
+demand: stall (stop reading, so the clients' TCP send buffers fill up), delay or drop PUBACKs,
+and drop every connection.
+"""
+import asyncio
+import random
+import socket
+import struct
+
+from backend.broker import topic_matches
+
+
+class Broker:
+    def __init__(self, host='127.0.0.1', port=0, ack_delay=0.0, ack_loss=0.0, recv_buffer=None, seed=0):
+        """
+        :param host: Address to listen on
+        :param port: Port to listen on, 0 picks a free one (see .port once started)
+        :param ack_delay: Seconds before a PUBACK is sent
+        :param ack_loss: Probability that a PUBACK is never sent
+        :param recv_buffer: TCP receive buffer size in bytes of the broker's connections
+        """
+        self.host = host
+        self.port = port
+        self.ack_delay = ack_delay
+        self.ack_loss = ack_loss
+        self.recv_buffer = recv_buffer
+        self.rng = random.Random(seed)
+        self.stalled = asyncio.Event()
+        self.stalled.set()  # set means reading, cleared means stalled
+        self.server = None
+        self.sessions = []
+        self.tasks = set()  # session tasks, including those still waiting for CONNECT
+        self.connections = 0
+        self.publishes = 0  # PUBLISH packets received
+        self.duplicates = 0  # PUBLISH packets received with the DUP flag
+        self.payloads = []  # (topic, payload) of every publish received, when recording
+        self.record = False
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._session, self.host, self.port)
+        if self.recv_buffer:
+            for sock in self.server.sockets:  # accepted connections inherit it
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.drop_connections()
+        self.server.close()
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def stall(self, stalled=True):
+        if stalled:
+            self.stalled.clear()
+        else:
+            self.stalled.set()
+        for writer, _ in self.sessions:
+            if stalled:
+                writer.transport.pause_reading()
+            else:
+                writer.transport.resume_reading()
+
+    def drop_connections(self):
+        for writer, _ in self.sessions:
+            writer.close()
+        self.sessions = []
+
+    async def _read_packet(self, reader):
+        await self.stalled.wait()
+        op = (await reader.readexactly(1))[0]
+        sz = sh = 0
+        while True:
+            b = (await reader.readexactly(1))[0]
+            sz |= (b & 0x7F) << sh
+            if not b & 0x80:
+                break
+            sh += 7
+        return op, await reader.readexactly(sz)
+
+    async def _ack(self, writer, pid):
+        if self.ack_delay:
+            await asyncio.sleep(self.ack_delay)
+        if not writer.is_closing():
+            writer.write(b'\x40\x02' + pid)
+
+    async def _session(self, reader, writer):
+        session = (writer, [])
+        self.connections += 1
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            op, data = await self._read_packet(reader)
+            if op != 0x10:
+                return
+            writer.write(b'\x20\x02\x00\x00')
+            self.sessions.append(session)
+            while True:
+                op, data = await self._read_packet(reader)
+                kind = op & 0xF0
+                if kind == 0x30:
+                    self._publish(writer, op, data)
+                elif kind == 0x80:
+                    pid = data[:2]
+                    length = struct.unpack_from('!H', data, 2)[0]
+                    session[1].append(data[4:4 + length].decode())
+                    writer.write(b'\x90\x03' + pid + b'\x00')
+                elif kind == 0xC0:
+                    writer.write(b'\xd0\x00')
+                elif kind == 0xE0:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # Stopped by stop(). Ending normally keeps asyncio's stream callback, which asks
+            # the finished task for its exception, from logging the cancellation
+            pass
+        finally:
+            self.tasks.discard(task)
+            if session in self.sessions:
+                self.sessions.remove(session)
+            writer.close()
+
+    def _publish(self, writer, op, data):
+        self.publishes += 1
+        if op & 0x08:
+            self.duplicates += 1
+        length = struct.unpack_from('!H', data)[0]
+        topic = data[2:2 + length].decode()
+        start = 2 + length
+        if op & 0x06:
+            pid = data[start:start + 2]
+            start += 2
+            if self.rng.random() >= self.ack_loss:
+                asyncio.create_task(self._ack(writer, pid))
+        payload = data[start:]
+        if self.record:
+            self.payloads.append((topic, payload))
+        for subscriber, filters in self.sessions:
+            if subscriber is not writer and any(topic_matches(f, topic) for f in filters):
+                body = struct.pack('!H', length) + data[2:2 + length] + payload
+                subscriber.write(bytes((0x30,)) + _remaining_length(len(body)) + body)
+
+
+def _remaining_length(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
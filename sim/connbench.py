@@ -0,0 +1,304 @@
+"""
+Recovery of the anchor's connection manager from network faults
+
+Run from the repository root:
+
+    python -m sim.connbench
+
+Runs wifi.AnchorNode on the host against a stand-in for the network module (one access point
+that can fail an association or disappear), a stand-in DNS server answering for the broker's
+hostname and the sim.broker stand-in, with getaddrinfo() disabled so a blocking lookup would
+fail loudly. A stand-in for the ranging loop queues a range every 5 ms throughout, recording
+how late it wakes up and how long send_ranging_data() takes.
+
+Faults are injected one after the other: a failed first association, the broker dropping the
+connection, the broker down, WiFi down and the broker down while the DNS server is silent.
+For each it reports the connection states passed through, the time to recover the anchor
+measures (from noticing the fault until up again), the time from repair until up, connect
+failures and DNS lookups, and the ranging loop's lateness. Lateness on the host includes its
+own scheduling jitter, the time send_ranging_data() takes is the anchor's share of it.
+
+At the end it counts the ranges that reached the broker, live or replayed from the ring log.
+The rest were QoS 0 publishes already written to a connection that then died, the ring log
+only takes ranges while the anchor knows it is offline.
+"""
+import asyncio
+import contextlib
+import functools
+import io
+import os
+import struct
+import tempfile
+import time
+import types
+
+import records
+from sim.broker import Broker
+from sim.dw1000 import Air, DW1000
+from sim.host import load_firmware
+
+BROKER_HOST = 'broker.local'
+RANGE_MS = 5
+STAT_IDLE, STAT_CONNECTING, STAT_CONNECT_FAIL, STAT_NO_AP_FOUND, STAT_GOT_IP = 0, 1, -1, -2, 3
+
+
+class AccessPoint:
+    """The network the anchor joins, faults are set on it"""
+
+    def __init__(self, dns_server, associate_s=0.3):
+        self.up = True
+        self.fail_next = 0  # associations to fail with STAT_CONNECT_FAIL
+        self.dns_server = dns_server
+        self.associate_s = associate_s
+
+
+class WLAN:
+    """network.WLAN in station mode on an AccessPoint"""
+
+    def __init__(self, ap):
+        self.ap = ap
+        self.joining = None  # time.monotonic() of the last connect()
+        self.joined = False
+
+    def active(self, *args):
+        return True
+
+    def config(self, name):
+        return b'\x28\xcd\xc1\x00\x00\x01'
+
+    def connect(self, ssid, password):
+        self.joining = time.monotonic()
+        self.joined = False
+
+    def disconnect(self):
+        self.joining = None
+        self.joined = False
+
+    def status(self):
+        if self.joined and not self.ap.up:
+            self.disconnect()
+            return STAT_NO_AP_FOUND
+        if self.joined:
+            return STAT_GOT_IP
+        if self.joining is None:
+            return STAT_IDLE
+        if self.ap.fail_next:
+            self.ap.fail_next -= 1
+            self.disconnect()
+            return STAT_CONNECT_FAIL
+        if self.ap.up and time.monotonic() - self.joining >= self.ap.associate_s:
+            self.joined = True
+            return STAT_GOT_IP
+        return STAT_CONNECTING
+
+    def isconnected(self):
+        return self.status() == STAT_GOT_IP
+
+    def ifconfig(self):
+        return ('10.0.0.2', '255.255.255.0', '10.0.0.1', self.ap.dns_server)
+
+
+def make_network(ap):
+    mod = types.ModuleType('network')
+    wlan = WLAN(ap)
+    mod.STA_IF = 0
+    mod.WLAN = lambda interface: wlan
+    return mod
+
+
+class DNSServer(asyncio.DatagramProtocol):
+    """Answers every A query with address, unless silent"""
+
+    def __init__(self, address='127.0.0.1'):
+        self.address = bytes(int(part) for part in address.split('.'))
+        self.silent = False
+        self.queries = 0
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.queries += 1
+        if self.silent:
+            return
+        end = data.index(0, 12) + 5  # question: name, type, class
+        answer = b'\xc0\x0c' + struct.pack('!HHIH', 1, 1, 60, 4) + self.address
+        self.transport.sendto(data[:2] + b'\x81\x80' + struct.pack('!HHHH', 1, 1, 0, 0) + data[12:end] + answer,
+                              addr)
+
+
+class Ranging:
+    """Stand-in for the ranging loop, queues a range every RANGE_MS"""
+
+    def __init__(self, anchor):
+        self.anchor = anchor
+        self.queued = 0
+        self.reset()
+
+    def reset(self):
+        self.max_late_ms = 0.0
+        self.max_call_ms = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(RANGE_MS / 1000)
+            self.max_late_ms = max(self.max_late_ms, (loop.time() - start) * 1000 - RANGE_MS)
+            start = time.perf_counter()
+            await self.anchor.send_ranging_data(self.queued & 0xFFFF, 1.0)
+            self.max_call_ms = max(self.max_call_ms, (time.perf_counter() - start) * 1000)
+            self.queued += 1
+
+
+async def run(log_path):
+    dns = DNSServer()
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(lambda: dns, local_addr=('127.0.0.1', 0))
+    ap = AccessPoint('127.0.0.1')
+    broker = Broker()
+    broker.record = True
+    await broker.start()
+    port = broker.port
+
+    firmware = load_firmware(DW1000(Air()), 'umqtt.simple', 'umqtt.aio', 'ringlog', 'wifi',
+                             modules={'network': make_network(ap), 'ubinascii': __import__('binascii')})
+    aio = getattr(firmware, 'umqtt.aio')
+    # The firmware asks port 53 of the DNS server, this one listens on a free port
+    aio.dns_lookup = functools.partial(aio.dns_lookup, port=transport.get_extra_info('sockname')[1])
+    aio.socket = types.SimpleNamespace(**{name: getattr(aio.socket, name) for name in dir(aio.socket)
+                                          if not name.startswith('_')})
+    aio.socket.getaddrinfo = None
+
+    with contextlib.redirect_stdout(io.StringIO()):  # the firmware's progress messages
+        anchor = firmware.wifi.AnchorNode('ssid', 'password', BROKER_HOST, port, threshold=100,
+                                          log_path=log_path, replay_rate=800, associate_ms=1000,
+                                          backoff_ms=100, max_backoff_ms=1600, poll_ms=50)
+    states = []
+    set_state = anchor._set_state
+
+    def record_state(state):
+        states.append(firmware.wifi.STATE_NAMES[state])
+        set_state(state)
+
+    anchor._set_state = record_state
+    ranging = Ranging(anchor)
+
+    async def restart_broker():
+        nonlocal broker
+        payloads = broker.payloads
+        broker = Broker(port=port)
+        broker.record = True
+        broker.payloads = payloads
+        await broker.start()
+
+    async def stop_broker():
+        await broker.stop()
+
+    def drop_wifi():
+        ap.up = False
+        broker.drop_connections()  # the TCP connection goes with the link
+
+    def restore_wifi():
+        ap.up = True
+
+    def silence_dns():
+        dns.silent = True
+
+    def answer_dns():
+        dns.silent = False
+
+    phases = (
+        ('cold start, first association fails', lambda: setattr(ap, 'fail_next', 1), 0, None),
+        ('broker drops the connection', lambda: broker.drop_connections(), 0, None),
+        ('broker down for 2 s', stop_broker, 2, restart_broker),
+        ('WiFi down for 2 s', drop_wifi, 2, restore_wifi),
+        ('broker down 2 s, DNS silent 4 s', stop_broker, 2, restart_broker, silence_dns, answer_dns),
+    )
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        tasks = [asyncio.create_task(ranging.run())]
+        for name, fault, seconds, repair, *dns_fault in phases:
+            del states[:]
+            ranging.reset()
+            failures = anchor.connect_failures
+            lookups = anchor.dns_lookups
+            outages = anchor.outages
+            if dns_fault:
+                dns_fault[0]()
+            result = fault()
+            if asyncio.iscoroutine(result):
+                await result
+            if not tasks[1:]:  # the anchor starts its tasks after the first fault is set
+                tasks += [asyncio.create_task(coro) for coro in (
+                    anchor.connection_manager(), anchor.batch_flusher(), anchor.log_syncer(), anchor.replay())]
+            repaired = time.monotonic()
+            await asyncio.sleep(seconds)
+            if repair is not None:
+                repaired = time.monotonic()
+                result = repair()
+                if asyncio.iscoroutine(result):
+                    await result
+            if dns_fault:
+                await asyncio.sleep(2)
+                dns_fault[1]()
+            while not (anchor.online() and (anchor.outages > outages or name.startswith('cold'))):
+                await asyncio.sleep(0.01)
+            results.append({
+                'name': name,
+                'states': ' > '.join(states),
+                'recover_ms': anchor.last_recover_ms if anchor.outages > outages else None,
+                'after_repair_ms': (time.monotonic() - repaired) * 1000,
+                'connect_failures': anchor.connect_failures - failures,
+                'dns_lookups': anchor.dns_lookups - lookups,
+                'max_late_ms': ranging.max_late_ms,
+                'max_call_ms': ranging.max_call_ms,
+            })
+            await asyncio.sleep(0.5)
+        tasks[0].cancel()
+        await anchor.flush()
+        deadline = time.monotonic() + 10
+        while anchor.log.count and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.2)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await anchor.mqtt_client.disconnect()
+        await broker.stop()
+        transport.close()
+    received = set()
+    for _, payload in broker.payloads:
+        if records.is_binary(payload):
+            received.update(tag for tag, _, _, _ in records.decode(payload))
+    totals = {
+        'queued': ranging.queued,
+        'received': len(received),  # tag field counts ranges, it wraps only after 65536
+        'logged': anchor.ranges_logged,
+        'replayed': anchor.ranges_replayed,
+        'overwritten': anchor.log.overwritten,
+        'dns_queries': dns.queries,
+    }
+    return results, totals
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        results, totals = asyncio.run(run(os.path.join(tmp, 'ranges.log')))
+    print(f'connection manager recovery, ranging every {RANGE_MS} ms throughout')
+    for result in results:
+        recover = f"{result['recover_ms']} ms" if result['recover_ms'] is not None else 'n/a'
+        print(f"  {result['name']}:")
+        print(f"    {result['states']}")
+        print(f"    time to recover {recover}, up {result['after_repair_ms']:.0f} ms after repair; "
+              f"{result['connect_failures']} connect failures, {result['dns_lookups']} DNS lookups; "
+              f"ranging late by at most {result['max_late_ms']:.2f} ms, "
+              f"send_ranging_data at most {result['max_call_ms']:.2f} ms")
+    print(f"{totals['queued']} ranges queued, {totals['received']} received by the broker, "
+          f"{totals['queued'] - totals['received']} lost in flight; {totals['logged']} logged and "
+          f"{totals['replayed']} replayed, {totals['overwritten']} overwritten; {totals['dns_queries']} DNS queries")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,625 @@
+"""
+Register-level emulator of the DW1000
+
+Models the register file behind the SPI interface closely enough for dwmCom and the node/tag
+protocols to run unmodified: SYS_CTRL strobes, write-1-to-clear SYS_STATUS, TX/RX buffers,
+40-bit TX/RX timestamps, frame filtering, auto-acknowledge, delayed transmission, receive
+timeouts and IRQ assertion. Frames travel between emulated devices through an Air instance
+with a configurable propagation delay.
+"""
+import asyncio
+import time
+
+SPEED_OF_LIGHT = 299702547  # m/s, matches UWBNode
+TICK = 1 / (128 * 499.2e6)  # s, DW1000 time unit (~15.65 ps)
+MASK40 = (1 << 40) - 1
+SYMBOL = 1.0256e-6  # s, preamble symbol length at 16 MHz PRF
+PAC_SIZE = 8  # symbols
+# DRX_CAR_INT units to clock offset ratio at 6.8 Mbps on channel 5, matches dwmCom
+CAR_INT_TO_RATIO = 998.4e6 / 2 / 1024 / 131072 / -6489.6e6
+
+# Register IDs
+DEV_ID = 0x00
+EUI = 0x01
+PANADR = 0x03
+SYS_CFG = 0x04
+SYS_TIME = 0x06
+TX_FCTRL = 0x08
+TX_BUFFER = 0x09
+DX_TIME = 0x0A
+RX_FWTO = 0x0C
+SYS_CTRL = 0x0D
+SYS_MASK = 0x0E
+SYS_STATUS = 0x0F
+RX_FINFO = 0x10
+RX_BUFFER = 0x11
+RX_FQUAL = 0x12
+RX_TIME = 0x15
+TX_TIME = 0x17
+TX_ANTD = 0x18
+ACK_RESP_T = 0x1A
+DRX_CONF = 0x27
+OTP_IF = 0x2D
+LDE_IF = 0x2E
+PMSC = 0x36
+
+# Register lengths in bytes, registers not listed are 64 bytes
+REGISTER_LENGTHS = {
+    DEV_ID: 4, EUI: 8, PANADR: 4, SYS_CFG: 4, SYS_TIME: 5, TX_FCTRL: 5, TX_BUFFER: 1024,
+    DX_TIME: 5, RX_FWTO: 2, SYS_CTRL: 4, SYS_MASK: 4, SYS_STATUS: 5, RX_FINFO: 4,
+    RX_BUFFER: 1024, RX_FQUAL: 8, RX_TIME: 14, TX_TIME: 10, TX_ANTD: 2, ACK_RESP_T: 4,
+    0x1E: 4, 0x1F: 4, 0x23: 33, DRX_CONF: 46, 0x28: 58, 0x2A: 52, 0x2B: 21, OTP_IF: 18,
+    LDE_IF: 0x2806, PMSC: 48,
+}
+
+# Register reset values (little endian)
+RESET_VALUES = {
+    DEV_ID: 0xDECA0130,
+    SYS_CFG: 0x00001200,
+    TX_FCTRL: 0x0015400C,
+    PMSC: 0xF0300200,
+}
+
+# SYS_CFG bits
+FFEN = 1 << 0
+DIS_DRXB = 1 << 12
+RXWTOE = 1 << 28
+RXAUTR = 1 << 29
+AUTOACK = 1 << 30
+
+# SYS_CTRL bits
+TXSTRT = 1 << 1
+TXDLYS = 1 << 2
+TRXOFF = 1 << 6
+WAIT4RESP = 1 << 7
+RXENAB = 1 << 8
+
+# SYS_STATUS bits
+TXFRB = 1 << 4
+TXPRS = 1 << 5
+TXPHS = 1 << 6
+TXFRS = 1 << 7
+RXPRD = 1 << 8
+RXSFDD = 1 << 9
+LDEDONE = 1 << 10
+RXPHD = 1 << 11
+RXDFR = 1 << 13
+RXFCG = 1 << 14
+RXFCE = 1 << 15
+RXRFTO = 1 << 17
+RXPTO = 1 << 21
+HPDWARN = 1 << 27
+TX_DONE = TXFRB | TXPRS | TXPHS | TXFRS
+RX_GOOD = RXPRD | RXSFDD | LDEDONE | RXPHD | RXDFR | RXFCG
+RX_CORRUPT = RXPRD | RXSFDD | RXPHD | RXDFR | RXFCE
+# Bits that cannot be cleared by writing 1 (IRQS, HSRBP, ICRBP)
+STATUS_READ_ONLY = (1 << 0) | (1 << 30) | (1 << 31)
+
+# Turnaround before an automatic acknowledgement, on top of ACK_TIM
+ACK_TURNAROUND = 100e-6  # s
+
+
+def airtime(frame):
+    """:return: Time on air of a frame (FCS added) in DW1000 time units, for the profile's
+    64 symbol preamble, 8 symbol SFD, 850 kbps PHR and 6.8 Mbps Reed-Solomon coded data"""
+    return (72 * SYMBOL + 21 / 850e3 + (len(frame) + 2) * 8 * 1.2 / 6.81e6) / TICK
+
+
+class Air:
+    """
+    Radio medium shared by emulated DW1000s
+
+    Time is taken from the host's monotonic clock so the firmware's real sleeps and the
+    emulated device clocks stay consistent.
+    """
+
+    def __init__(self, distance=1.0):
+        """
+        :param distance: Default distance between devices in meters
+        """
+        self.devices = []
+        self.distance = distance
+        self._distances = {}
+        self._irq_queue = []
+        self._dispatching = False
+        self._epoch = time.perf_counter_ns()
+        self.frames = 0
+        self.collisions = 0
+        # Frames whose airtime may still overlap another: [sender, frame, start, end, collided, delivered]
+        self._in_flight = []
+
+    def now(self):
+        """:return: Global time in DW1000 time units"""
+        return (time.perf_counter_ns() - self._epoch) * 1e-9 / TICK
+
+    def set_distance(self, a, b, meters):
+        """Set the distance between two devices in meters"""
+        self._distances[(a, b)] = meters
+        self._distances[(b, a)] = meters
+
+    def propagation(self, a, b):
+        """:return: Time of flight between two devices in DW1000 time units"""
+        meters = self._distances.get((a, b), self.distance)
+        return meters / SPEED_OF_LIGHT / TICK
+
+    def transmit(self, sender, frame, tx_time):
+        """
+        Deliver a frame to every other device
+
+        Frames whose airtime overlaps are lost to each other, receivers see a frame with a bad
+        FCS instead. Delivery waits for the end of the frame while another device has a
+        delayed transmission due before then, so both sides of a collision are lost.
+
+        :param sender: Transmitting DW1000
+        :param frame: Frame bytes without FCS
+        :param tx_time: Global time the frame leaves the antenna
+        """
+        self.frames += 1
+        end = tx_time + airtime(frame)
+        entry = [sender, frame, tx_time, end, False, False]
+        for other in self._in_flight:
+            if other[0] is not sender and other[2] < end and tx_time < other[3]:
+                if not entry[4]:
+                    self.collisions += 1
+                other[4] = entry[4] = True
+        self._in_flight = [other for other in self._in_flight if other[3] > tx_time - 1e-3 / TICK]
+        self._in_flight.append(entry)
+        if not entry[4] and not any(
+                device is not sender and device.delayed_tx is not None and device.delayed_tx[0] < end
+                for device in self.devices):
+            self.deliver(entry)
+
+    def deliver(self, entry):
+        sender, frame, tx_time, end, collided, delivered = entry
+        entry[5] = True
+        for device in self.devices:
+            if device is not sender:
+                arrival = tx_time + self.propagation(sender, device)
+                if collided:
+                    device.corrupt(arrival)
+                else:
+                    device.receive(frame, arrival, sender)
+
+    def pending(self):
+        """:return: True while a frame waits for the end of its airtime to be delivered"""
+        return any(not entry[5] for entry in self._in_flight)
+
+    def queue_irq(self, pin):
+        self._irq_queue.append(pin)
+
+    def dispatch(self):
+        """Run queued IRQ handlers, outside of any SPI transaction"""
+        if self._dispatching:
+            return
+        self._dispatching = True
+        try:
+            while self._irq_queue:
+                pin = self._irq_queue.pop(0)
+                if pin.handler is not None:
+                    pin.handler(pin)
+        finally:
+            self._dispatching = False
+
+    def poll(self):
+        """Fire due delayed transmissions, deliver frames held back, then fire expired timers"""
+        for device in self.devices:
+            device.poll_tx()
+        now = self.now()
+        for entry in self._in_flight:
+            if not entry[5] and entry[3] <= now:
+                self.deliver(entry)
+        for device in self.devices:
+            device.poll()
+        self.dispatch()
+
+    async def run(self, interval_ms=1):
+        """Background task that keeps timers running while the firmware awaits"""
+        while True:
+            self.poll()
+            await asyncio.sleep(0 if self.pending() else interval_ms / 1000)
+
+
+class Pin:
+    """machine.Pin stand-in for plain GPIOs such as the LED"""
+    IN = 0
+    OUT = 1
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, *args, **kwargs):
+        self._value = 0
+        self.handler = None
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = 1 if v else 0
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def toggle(self):
+        self.value(not self._value)
+
+    def irq(self, handler=None, trigger=IRQ_RISING, **kwargs):
+        self.handler = handler
+
+
+class IrqPin(Pin):
+    """IRQ output of an emulated DW1000"""
+
+    def __init__(self, device):
+        super().__init__()
+        self.device = device
+
+    def value(self, v=None):
+        return 1 if self.device.status() & self.device.mask() else 0
+
+
+class ChipSelect(Pin):
+    """SPI chip select of an emulated DW1000, active low"""
+
+    def __init__(self, device):
+        super().__init__()
+        self.device = device
+        self._value = 1
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        v = 1 if v else 0
+        if v != self._value:
+            self._value = v
+            if v:
+                self.device.end_transaction()
+            else:
+                self.device.begin_transaction()
+
+
+class ResetPin(Pin):
+    """RSTn input of an emulated DW1000, active low"""
+
+    def __init__(self, device):
+        super().__init__()
+        self.device = device
+        self._value = 1
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        v = 1 if v else 0
+        if v and not self._value:
+            self.device.reset()
+        self._value = v
+
+
+class SPI:
+    """machine.SPI stand-in wired to an emulated DW1000"""
+
+    def __init__(self, device):
+        self.device = device
+
+    def write(self, buf):
+        self.device.spi_write(buf)
+
+    def readinto(self, buf, write=0x00):
+        self.device.spi_readinto(buf)
+
+    def read(self, nbytes, write=0x00):
+        buf = bytearray(nbytes)
+        self.readinto(buf)
+        return bytes(buf)
+
+
+class Transaction:
+    """State of one SPI transaction (CS low to CS high)"""
+
+    def __init__(self):
+        self.header = bytearray()
+        self.register = None
+        self.offset = 0
+        self.write = False
+        self.data = bytearray()
+        self.read_pos = 0
+
+    def feed(self, buf):
+        """Consume header bytes, the remainder is write data"""
+        i = 0
+        while self.register is None and i < len(buf):
+            self.header.append(buf[i])
+            i += 1
+            self._parse()
+        self.data.extend(buf[i:])
+
+    def _parse(self):
+        b0 = self.header[0]
+        self.write = bool(b0 & 0x80)
+        if not b0 & 0x40:
+            self.register = b0 & 0x3F
+        elif len(self.header) == 2 and not self.header[1] & 0x80:
+            self.register, self.offset = b0 & 0x3F, self.header[1]
+        elif len(self.header) == 3:
+            self.register, self.offset = b0 & 0x3F, (self.header[1] & 0x7F) | (self.header[2] << 7)
+
+
+class DW1000:
+    """
+    Emulated DW1000 register file
+
+    Every newly raised SYS_STATUS event that is enabled in SYS_MASK is delivered to the IRQ
+    handler as a rising edge. Handlers run once the SPI transaction that caused the event has
+    finished, like a scheduled soft IRQ on the Pico.
+    """
+
+    def __init__(self, air, clock_ppm=0.0, clock_offset=0, antenna_delay=32949):
+        """
+        :param air: Shared Air medium
+        :param clock_ppm: Crystal offset of this device in parts per million
+        :param clock_offset: Offset of this device's clock in DW1000 time units
+        :param antenna_delay: Receive antenna delay added to RX timestamps, in DW1000 time units
+        """
+        self.air = air
+        air.devices.append(self)
+        self.clock_ppm = clock_ppm
+        self.clock_offset = clock_offset
+        self.antenna_delay = antenna_delay
+        self.spi = SPI(self)
+        self.cs = ChipSelect(self)
+        self.irq = IrqPin(self)
+        self.rst = ResetPin(self)
+        # SPI bus statistics
+        self.spi_bytes = 0
+        self.spi_transactions = 0
+        self.reset()
+
+    # Clock
+
+    def device_time(self, global_time=None):
+        """:return: Device time (40-bit) at a global time, default now"""
+        if global_time is None:
+            global_time = self.air.now()
+        return int(global_time * (1 + self.clock_ppm * 1e-6) + self.clock_offset) & MASK40
+
+    def global_time(self, device_time):
+        """:return: The first global time from now at which the device clock reads device_time"""
+        now = self.air.now()
+        ahead = (device_time - self.device_time(now)) & MASK40
+        return now + ahead / (1 + self.clock_ppm * 1e-6)
+
+    # Register file
+
+    def reset(self):
+        self.regs = {}
+        for register, value in RESET_VALUES.items():
+            self.put(register, 0, value, REGISTER_LENGTHS[register])
+        self.rx_on = False
+        self.rx_deadline = None
+        self.preamble_deadline = None
+        self.delayed_tx = None
+        self._txn = None
+
+    def reg(self, register):
+        data = self.regs.get(register)
+        if data is None:
+            data = self.regs[register] = bytearray(REGISTER_LENGTHS.get(register, 64))
+        return data
+
+    def get(self, register, offset, length):
+        return int.from_bytes(self.reg(register)[offset:offset + length], 'little')
+
+    def put(self, register, offset, value, length):
+        self.reg(register)[offset:offset + length] = value.to_bytes(length, 'little')
+
+    def status(self):
+        return self.get(SYS_STATUS, 0, 5)
+
+    def mask(self):
+        return self.get(SYS_MASK, 0, 4)
+
+    def raise_events(self, bits):
+        """Set SYS_STATUS bits and assert the IRQ for any that are enabled in SYS_MASK"""
+        self.put(SYS_STATUS, 0, self.status() | bits, 5)
+        if bits & self.mask():
+            self.air.queue_irq(self.irq)
+
+    # SPI
+
+    def begin_transaction(self):
+        self.poll()
+        self.spi_transactions += 1
+        self._txn = Transaction()
+
+    def spi_write(self, buf):
+        self.spi_bytes += len(buf)
+        self._txn.feed(bytes(buf))
+
+    def spi_readinto(self, buf):
+        self.spi_bytes += len(buf)
+        txn = self._txn
+        buf[:] = self.read(txn.register, txn.offset + txn.read_pos, len(buf))
+        txn.read_pos += len(buf)
+
+    def end_transaction(self):
+        txn = self._txn
+        self._txn = None
+        if txn.write and txn.data:
+            self.write(txn.register, txn.offset, bytes(txn.data))
+        self.air.dispatch()
+
+    def read(self, register, offset, length):
+        if register == SYS_TIME:
+            self.put(SYS_TIME, 0, self.device_time() & ~0x1FF, 5)
+        return bytes(self.reg(register)[offset:offset + length])
+
+    def write(self, register, offset, data):
+        value = int.from_bytes(data, 'little') << (8 * offset)
+        if register == SYS_STATUS:
+            self.put(SYS_STATUS, 0, self.status() & ~(value & ~STATUS_READ_ONLY), 5)
+        elif register == SYS_CTRL:
+            self.control(value)
+        elif register == OTP_IF and offset == 0x06:
+            pass  # LDELOAD is self clearing
+        else:
+            self.reg(register)[offset:offset + len(data)] = data
+            if register == PMSC and not self.get(PMSC, 0, 4) & (1 << 28):
+                self.rx_off()
+
+    def control(self, value):
+        """Act on a SYS_CTRL write, all strobes are self clearing"""
+        if value & TRXOFF:
+            self.rx_off()
+            self.delayed_tx = None
+        if value & TXSTRT:
+            self.start_tx(value & TXDLYS, value & WAIT4RESP)
+        if value & RXENAB:
+            self.rx_enable()
+
+    # Transceiver
+
+    def rx_enable(self):
+        now = self.air.now()
+        self.rx_on = True
+        self.rx_deadline = None
+        self.preamble_deadline = None
+        fwto = self.get(RX_FWTO, 0, 2)
+        if self.get(SYS_CFG, 0, 4) & RXWTOE and fwto:
+            self.rx_deadline = now + fwto * 1.0256e-6 / TICK
+        pretoc = self.get(DRX_CONF, 0x24, 2)
+        if pretoc:
+            self.preamble_deadline = now + pretoc * PAC_SIZE * SYMBOL / TICK
+
+    def rx_off(self):
+        self.rx_on = False
+        self.rx_deadline = None
+        self.preamble_deadline = None
+
+    def poll_tx(self):
+        """Send a due delayed transmission, whose frame may arrive before a receiver times out"""
+        if self.delayed_tx is not None and self.air.now() >= self.delayed_tx[0]:
+            tx_global, frame, wait = self.delayed_tx
+            self.delayed_tx = None
+            self.send(frame, tx_global, wait)
+
+    def poll(self, now=None):
+        """
+        Fire expired receive timeouts and due delayed transmissions
+
+        :param now: Global time to check the timeouts against, defaults to the current time
+        """
+        if now is None:
+            now = self.air.now()
+        if self.rx_on and self.preamble_deadline is not None and now >= self.preamble_deadline:
+            self.rx_off()
+            self.raise_events(RXPTO)
+        if self.rx_on and self.rx_deadline is not None and now >= self.rx_deadline:
+            self.rx_off()
+            self.raise_events(RXRFTO)
+        self.poll_tx()
+
+    def start_tx(self, delayed, wait):
+        length = self.get(TX_FCTRL, 0, 2) & 0x3FF
+        frame = bytes(self.reg(TX_BUFFER)[:max(length - 2, 0)])
+        if not delayed:
+            self.send(frame, self.air.now(), wait)
+            return
+        tx_time = self.get(DX_TIME, 0, 5) & ~0x1FF
+        if (tx_time - self.device_time()) & MASK40 > (1 << 39):
+            # Scheduled time already passed
+            self.raise_events(HPDWARN)
+            return
+        self.rx_off()
+        self.delayed_tx = (self.global_time(tx_time), frame, wait)
+
+    def send(self, frame, tx_global, wait):
+        """
+        Put a frame on the air
+
+        :param frame: Frame bytes without FCS
+        :param tx_global: Global time of transmission
+        :param wait: Enable the receiver once sent (WAIT4RESP)
+        """
+        tx_time = self.device_time(tx_global)
+        self.put(TX_TIME, 0, (tx_time + self.get(TX_ANTD, 0, 2)) & MASK40, 5)
+        if wait:
+            self.rx_enable()
+        else:
+            self.rx_off()
+        self.raise_events(TX_DONE)
+        self.air.transmit(self, frame, tx_global)
+
+    def accepts(self, frame):
+        """Apply frame filtering as configured in SYS_CFG"""
+        sys_cfg = self.get(SYS_CFG, 0, 4)
+        if not sys_cfg & FFEN:
+            return True
+        if len(frame) < 3:
+            return False
+        fc = frame[0] | (frame[1] << 8)
+        frame_type = fc & 0x07
+        if frame_type > 3 or not sys_cfg & (1 << (2 + frame_type)):
+            return False
+        if frame_type == 2:
+            return True
+        dest_mode = (fc >> 10) & 0x03
+        dest_pan = frame[3] | (frame[4] << 8)
+        if dest_pan not in (0xFFFF, self.get(PANADR, 2, 2)):
+            return False
+        if dest_mode == 2:
+            dest = frame[5] | (frame[6] << 8)
+            return dest in (0xFFFF, self.get(PANADR, 0, 2))
+        if dest_mode == 3:
+            return bytes(frame[5:13]) == bytes(self.reg(EUI))
+        return False
+
+    def corrupt(self, arrival):
+        """
+        Colliding frames reach the antenna
+
+        :param arrival: Global time of arrival of the first of them
+        """
+        self.poll(arrival)
+        if not self.rx_on:
+            return
+        self.preamble_deadline = None
+        if not self.get(SYS_CFG, 0, 4) & RXAUTR:
+            self.rx_off()
+        self.raise_events(RX_CORRUPT)
+
+    def receive(self, frame, arrival, sender=None):
+        """
+        A frame reaches the antenna
+
+        :param frame: Frame bytes without FCS
+        :param arrival: Global time of arrival
+        :param sender: Transmitting DW1000, its clock offset sets the carrier integrator
+        """
+        self.poll(arrival)  # timeouts that expired before the arrival fire first
+        if self.rx_on:
+            self.preamble_deadline = None  # any frame's preamble satisfies PRETOC
+        if not self.rx_on or not self.accepts(frame):
+            return
+        rx_time = self.device_time(arrival)
+        self.reg(RX_BUFFER)[:len(frame) + 2] = bytes(frame) + b'\x00\x00'
+        self.put(RX_FINFO, 0, len(frame) + 2, 4)
+        self.put(RX_TIME, 0, (rx_time + self.antenna_delay) & MASK40, 5)
+        self.put(RX_FQUAL, 0, 40, 2)  # STD_NOISE
+        self.put(RX_FQUAL, 2, 8000, 2)  # FP_AMPL2
+        if sender is not None:
+            ratio = (1 + sender.clock_ppm * 1e-6) / (1 + self.clock_ppm * 1e-6) - 1
+            self.put(DRX_CONF, 0x28, round(ratio / CAR_INT_TO_RATIO) & 0x1FFFFF, 3)  # DRX_CAR_INT
+        sys_cfg = self.get(SYS_CFG, 0, 4)
+        if sys_cfg & DIS_DRXB:
+            self.rx_off()
+        else:
+            self.rx_deadline = None
+            self.preamble_deadline = None
+        self.raise_events(RX_GOOD)
+        fc = frame[0] | (frame[1] << 8)
+        if sys_cfg & AUTOACK and sys_cfg & FFEN and fc & (1 << 5) and (fc & 0x07) != 2:
+            dest = frame[5] | (frame[6] << 8)
+            if dest != 0xFFFF:
+                turnaround = (self.get(ACK_RESP_T, 3, 1) * SYMBOL + ACK_TURNAROUND) / TICK
+                self.send(bytes([0x02, 0x00, frame[2]]), arrival + turnaround, False)
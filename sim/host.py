@@ -0,0 +1,113 @@
+"""
+Run the MicroPython firmware modules on CPython against emulated DW1000s
+
+The firmware imports machine, time (with the MicroPython ticks/sleep_ms API) and uasyncio.
+load_firmware() imports private copies of the firmware modules for one emulated device with
+host versions of those modules in place, so several devices can run in one process.
+"""
+import asyncio
+import importlib
+import sys
+import time as _time
+import types
+
+from sim.dw1000 import Pin
+
+_TICKS_PERIOD = 1 << 30
+
+
+def make_time(air):
+    """MicroPython flavoured time module, blocking sleeps keep the emulated devices serviced"""
+    mod = types.ModuleType('time')
+    mod.time = _time.time
+    mod.time_ns = _time.time_ns
+    mod.gmtime = _time.gmtime
+    mod.localtime = _time.localtime
+
+    def sleep(seconds):
+        _time.sleep(seconds)
+        air.poll()
+
+    mod.sleep = sleep
+    mod.sleep_ms = lambda ms: sleep(ms / 1000)
+    mod.sleep_us = lambda us: sleep(us / 1000000)
+    mod.ticks_ms = lambda: (_time.monotonic_ns() // 1000000) % _TICKS_PERIOD
+    mod.ticks_us = lambda: (_time.monotonic_ns() // 1000) % _TICKS_PERIOD
+    mod.ticks_add = lambda ticks, delta: (ticks + delta) % _TICKS_PERIOD
+    mod.ticks_diff = lambda new, old: ((new - old + _TICKS_PERIOD // 2) % _TICKS_PERIOD) - _TICKS_PERIOD // 2
+    return mod
+
+
+class ThreadSafeFlag:
+    """uasyncio.ThreadSafeFlag: set() from an IRQ handler wakes a single waiting task"""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+def make_uasyncio():
+    """uasyncio on top of asyncio"""
+    mod = types.ModuleType('uasyncio')
+    for name in dir(asyncio):
+        if not name.startswith('_'):
+            setattr(mod, name, getattr(asyncio, name))
+    mod.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+    mod.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000)
+    mod.ThreadSafeFlag = ThreadSafeFlag
+    return mod
+
+
+def make_machine(device):
+    """machine module whose SPI bus and DWM1000 pins (CS 17, IRQ 14, RST 15) belong to device"""
+    mod = types.ModuleType('machine')
+    pins = {17: device.cs, 14: device.irq, 15: device.rst}
+
+    def pin(id, *args, **kwargs):
+        return pins.get(id) or Pin(id)
+
+    mod.Pin = type('Pin', (Pin,), {'__new__': lambda cls, id, *args, **kwargs: pin(id)})
+    mod.SPI = lambda *args, **kwargs: device.spi
+    return mod
+
+
+def load_firmware(device, *names, modules=None):
+    """
+    Import private copies of firmware modules bound to an emulated DW1000
+
+    :param device: sim.dw1000.DW1000 the firmware talks to
+    :param names: Module names in dependency order, e.g. 'dwmCom', 'node'
+    :param modules: dict of further host modules by name, e.g. a 'network' stand-in
+    :return: Namespace of the loaded modules
+    """
+    hosted = {
+        'machine': make_machine(device),
+        'time': make_time(device.air),
+        'uasyncio': make_uasyncio(),
+    }
+    hosted.update(modules or {})
+    saved = {name: sys.modules.get(name) for name in list(hosted) + list(names)}
+    loaded = types.SimpleNamespace()
+    try:
+        sys.modules.update(hosted)
+        for name in names:
+            sys.modules.pop(name, None)
+            setattr(loaded, name, importlib.import_module(name))
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+    if hasattr(loaded, 'dwmCom'):
+        loaded.dwmCom.attach(device.spi, device.cs, device.irq, device.rst)
+    return loaded
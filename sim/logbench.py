@@ -0,0 +1,175 @@
+"""
+Write amplification of the anchor's store-and-forward ring log on a file-backed flash stand-in
+
+Run from the repository root:
+
+    python -m sim.logbench [outage seconds]
+
+An anchor offline for an outage logs 16-record batches every 100 ms at several range rates
+to ringlog.RingLog over FlashFile, a real temporary file that counts what reaches it and
+models the flash under LittleFS: a file commit (flush or close) programs every 4 KB erase
+block written since the last one, as LittleFS copies modified blocks on write. Write
+amplification is flash bytes programmed per record byte logged, against syncing every 1 s,
+every 100 ms and appending each batch by reopening the file, the approach the ring log
+avoids. Then the log is reopened without a close, as after a power cut, and replayed.
+"""
+import os
+import sys
+import tempfile
+
+import records
+import ringlog
+
+BLOCK = 4096  # RP2040 flash erase block
+BATCH = 16
+BATCH_MS = 100
+
+
+class Flash:
+    """Counts the bytes programmed into flash by the files opened through it"""
+
+    def __init__(self):
+        self.programmed = 0
+        self.commits = 0
+        self.bytes_written = 0
+
+    def open(self, path, mode='r'):
+        return FlashFile(self, open(path, mode))
+
+
+class FlashFile:
+    """A file whose writes and commits are counted by its Flash"""
+
+    def __init__(self, flash, file):
+        self.flash = flash
+        self.file = file
+        self.dirty = set()  # erase blocks written since the last commit
+
+    def write(self, data):
+        start = self.file.tell()
+        n = self.file.write(data)
+        self.flash.bytes_written += n
+        self.dirty.update(range(start // BLOCK, (start + n - 1) // BLOCK + 1))
+        return n
+
+    def flush(self):
+        self.file.flush()
+        self.flash.programmed += len(self.dirty) * BLOCK
+        self.flash.commits += 1
+        self.dirty = set()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def seek(self, offset, whence=0):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def readinto(self, buf):
+        return self.file.readinto(buf)
+
+
+def batches(rate, seconds):
+    """
+    :param rate: Ranges per second
+    :return: Generator of (ms, batch of records), a batch whenever BATCH ranges are queued or BATCH_MS passed
+    """
+    buf = bytearray(BATCH * records.RECORD_SIZE)
+    seq = 0
+    for ms in range(0, seconds * 1000, BATCH_MS):
+        queued = rate * BATCH_MS // 1000
+        while queued:
+            n = min(queued, BATCH)
+            for i in range(n):
+                records.encode_into(buf, i * records.RECORD_SIZE, seq & 0xFFFF, 1.0, seq)
+                seq += 1
+            queued -= n
+            yield ms, memoryview(buf)[:n * records.RECORD_SIZE]
+
+
+def ring_log(path, rate, seconds, sync_ms, capacity=4096):
+    """
+    :return: dict of write amplification, flash commits, RAM used and the records a reopened log holds
+    """
+    flash = Flash()
+    ringlog.open = flash.open  # the module's open(), the firmware gets the builtin
+    try:
+        log = ringlog.RingLog(path, capacity)
+        flash.programmed = flash.commits = flash.bytes_written = 0  # leave out creating the file
+        logged = 0
+        last_sync = 0
+        for ms, batch in batches(rate, seconds):
+            log.append(batch)
+            logged += len(batch)
+            if ms - last_sync >= sync_ms:
+                log.sync()
+                last_sync = ms
+        log.sync()
+        synced = log.count
+        # A power cut: the file is dropped without closing, then reopened
+        log.file.file.close()
+        reopened = ringlog.RingLog(path, capacity)
+        replayed = expected = 0
+        buf = bytearray(BATCH * records.RECORD_SIZE)
+        first = logged // records.RECORD_SIZE - synced
+        while reopened.count:
+            n = reopened.read_into(buf)
+            for i, (_, _, timestamp_us, _) in enumerate(records.decode(memoryview(buf)[:n * records.RECORD_SIZE])):
+                expected += timestamp_us == first + replayed + i
+            reopened.consume(n)
+            replayed += n
+        reopened.close()
+    finally:
+        del ringlog.open
+    return {
+        'amplification': flash.programmed / logged,
+        'file_amplification': flash.bytes_written / logged,
+        'commits': flash.commits,
+        'replayed': replayed,
+        'in_order': expected,
+        'overwritten': log.overwritten,
+        'ram': len(log._page) + len(log._header),
+    }
+
+
+def reopen_per_batch(path, rate, seconds):
+    """
+    :return: dict of write amplification and flash commits appending each batch with open/write/close
+    """
+    flash = Flash()
+    logged = 0
+    for _, batch in batches(rate, seconds):
+        f = flash.open(path, 'ab')
+        f.write(batch)
+        f.close()
+        logged += len(batch)
+    return {'amplification': flash.programmed / logged, 'file_amplification': flash.bytes_written / logged,
+            'commits': flash.commits}
+
+
+def main():
+    seconds = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    print(f'ring log of 4096 records, {seconds} s outage; write amplification is flash bytes programmed '
+          f'per record byte, file is bytes written to the file per record byte')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ranges.log')
+        for rate in (20, 160, 1600):
+            for name, run in (('sync every 1 s', lambda: ring_log(path, rate, seconds, 1000)),
+                              ('sync every 100 ms', lambda: ring_log(path, rate, seconds, 100)),
+                              ('reopen per batch', lambda: reopen_per_batch(path, rate, seconds))):
+                if os.path.exists(path):
+                    os.remove(path)
+                result = run()
+                line = (f"  {rate:4} ranges/s, {name:17}: amplification {result['amplification']:6.1f}x "
+                        f"(file {result['file_amplification']:.2f}x), {result['commits']:5} commits")
+                if 'replayed' in result:
+                    line += (f"; after a power cut {result['replayed']} replayed, {result['in_order']} in order, "
+                             f"{result['overwritten']} overwritten, {result['ram']} bytes of RAM")
+                print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Benchmarks of the anchor's MQTT publishing against the sim.broker stand-in
+
+Run from the repository root:
+
+    python -m sim.mqttbench [seconds]
+
+A ticker task standing in for the UWB ranging loop wakes every 2 ms and records how late it
+runs, while batches of ranging records are published to the sim.broker stand-in, first with
+blocking socket writes as umqtt.simple does them, then with umqtt.aio. Socket buffers are cut
+to 4 KB on both ends, about what lwIP gives the Pico W, so a stalled broker pushes back within
+a few publishes.
+
+Then QoS 1 throughput of umqtt.aio against the broker's PUBACK delay, standing in for the
+round trip time, for several in-flight windows (a window of 1 is umqtt.simple's stop-and-wait),
+and delivery through a broker that loses PUBACKs.
+"""
+import asyncio
+import socket
+import struct
+import sys
+import time
+
+from sim.broker import Broker
+from sim.dw1000 import Air, DW1000
+from sim.host import load_firmware
+
+TICK_MS = 2
+PUBLISH_MS = 20
+PAYLOAD = bytes(256)  # a batch of 16 ranging records
+TOPIC = 'ranging/data/28cdc1000001'
+SOCKET_BUFFER = 4096
+BLOCKING_TIMEOUT = 0.5  # s, a stalled umqtt.simple write would otherwise block forever
+
+
+def shrink_buffers(sock):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+
+
+async def ticker(lags, stop):
+    """Stand-in for the ranging loop, records how late each 2 ms wake-up is in milliseconds"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK_MS / 1000)
+        lags.append((loop.time() - start) * 1000 - TICK_MS)
+
+
+class BlockingPublisher:
+    """Publishes with blocking socket writes, as umqtt.simple.MQTTClient does"""
+
+    def __init__(self, port):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        shrink_buffers(self.sock)
+        self.sock.settimeout(BLOCKING_TIMEOUT)
+        body = struct.pack('!H', 4) + b'MQTT' + b'\x04\x02\x00\x00' + struct.pack('!H', 5) + b'bench'
+        self.sock.sendall(bytes((0x10, len(body))) + body)
+        self.sock.recv(4)
+        self.sent = self.dropped = 0
+
+    def publish(self, topic, msg):
+        body = struct.pack('!H', len(topic)) + topic.encode() + msg
+        header = bytes((0x30, (len(body) & 0x7F) | 0x80, len(body) >> 7))
+        try:
+            self.sock.sendall(header + body)
+            self.sent += 1
+        except OSError:
+            self.dropped += 1
+
+    async def disconnect(self):
+        self.sock.close()
+
+
+async def aio_publisher(aio, port):
+    client = aio.MQTTClient('bench', '127.0.0.1', port, keepalive=2)
+    await client.connect()
+    shrink_buffers(client.writer.get_extra_info('socket'))
+    # MicroPython's Stream.drain() waits until everything written has left, match that
+    client.writer.transport.set_write_buffer_limits(0)
+    return client
+
+
+async def scenario(make_client, fault, seconds):
+    """
+    :param make_client: Coroutine function of the broker port returning a connected client
+    :param fault: None, 'stall' or 'drop', applied to the broker a third of the way in
+    :return: dict of ticker lag percentiles in milliseconds and publishes sent and dropped
+    """
+    broker = Broker(recv_buffer=SOCKET_BUFFER)
+    await broker.start()
+    client = await make_client(broker.port)
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    loop = asyncio.get_running_loop()
+    end = loop.time() + seconds
+    faulted = fault is None
+    published = 0
+    while loop.time() < end:
+        if not faulted and loop.time() > end - seconds * 2 / 3:
+            faulted = True
+            if fault == 'stall':
+                broker.stall()
+            else:
+                broker.drop_connections()
+        client.publish(TOPIC, PAYLOAD)
+        published += 1
+        await asyncio.sleep(PUBLISH_MS / 1000)
+    stop.set()
+    await tick
+    broker.stall(False)
+    await client.disconnect()
+    await broker.stop()
+    lags.sort()
+    return {
+        'p50': lags[len(lags) // 2],
+        'p99': lags[len(lags) * 99 // 100],
+        'max': lags[-1],
+        'published': published,
+        'sent': client.sent,
+        'dropped': client.dropped,
+    }
+
+
+async def qos1(aio, rtt_ms, window, count=200, ack_loss=0.0, retry_ms=2000):
+    """
+    Publish count QoS 1 messages as fast as the client takes them
+
+    :return: dict of messages per second until all were acknowledged, retransmissions,
+             messages given up and distinct messages the broker received
+    """
+    broker = Broker(ack_delay=rtt_ms / 1000, ack_loss=ack_loss)
+    broker.record = True
+    await broker.start()
+    client = aio.MQTTClient('bench', '127.0.0.1', broker.port, keepalive=0, window=window,
+                            retry_ms=retry_ms, max_queue=64, max_queue_bytes=64 * 512)
+    await client.connect()
+    start = time.perf_counter()
+    for i in range(count):
+        while client.pending() >= client.max_queue:
+            await asyncio.sleep(0.0005)
+        client.publish(TOPIC, i.to_bytes(4, 'little') + PAYLOAD, qos=1)
+    await client.wait_idle()
+    elapsed = time.perf_counter() - start
+    await client.disconnect()
+    await broker.stop()
+    return {
+        'messages_per_second': count / elapsed,
+        'retransmits': client.retransmits,
+        'expired': client.expired,
+        'delivered': len({payload[:4] for _, payload in broker.payloads}),
+    }
+
+
+async def run(seconds):
+    aio = getattr(load_firmware(DW1000(Air()), 'umqtt.simple', 'umqtt.aio'), 'umqtt.aio')
+    results = []
+    for name, make_client in (('blocking writes', lambda port: asyncio.to_thread(BlockingPublisher, port)),
+                              ('umqtt.aio', lambda port: aio_publisher(aio, port))):
+        for fault in (None, 'stall', 'drop'):
+            results.append((name, fault, await scenario(make_client, fault, seconds)))
+    throughput = []
+    for rtt_ms in (2, 10, 50):
+        for window in (1, 4, 16):
+            throughput.append((rtt_ms, window, await qos1(aio, rtt_ms, window)))
+    lossy = await qos1(aio, 10, 8, ack_loss=0.1, retry_ms=200)
+    return results, throughput, lossy
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(f'ranging loop lateness while publishing {len(PAYLOAD)} bytes every {PUBLISH_MS} ms')
+    results, throughput, lossy = asyncio.run(run(seconds))
+    for name, fault, result in results:
+        print(f"  {name:15} broker {fault or 'healthy':7}: lateness p50 {result['p50']:.2f} ms, "
+              f"p99 {result['p99']:.2f} ms, max {result['max']:.1f} ms; "
+              f"{result['published']} publishes, {result['sent']} sent, {result['dropped']} dropped")
+    print('QoS 1 publishing with umqtt.aio')
+    for rtt_ms, window, result in throughput:
+        print(f"  RTT {rtt_ms:2} ms, window {window:2}: {result['messages_per_second']:6.0f} messages/second")
+    print(f"  RTT 10 ms, window 8, 10% of PUBACKs lost: {lossy['delivered']}/200 delivered, "
+          f"{lossy['retransmits']} retransmitted with DUP, {lossy['expired']} given up, "
+          f"{lossy['messages_per_second']:.0f} messages/second")
+
+
+if __name__ == '__main__':
+    main()
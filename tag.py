@@ -1,8 +1,8 @@
 import dwmCom
 from machine import Pin
 import time
-from random import randint
 import uasyncio
+from dispatcher import StatusDispatcher, RX_OK, TXFRS, RX_EVENTS, TX_EVENTS
 
 class UWBTag:
     def __init__(self, pan, id, led_pin="LED", irq_pin_num=14):
@@ -15,9 +15,24 @@ class UWBTag:
         """
         self.led = Pin(led_pin, Pin.OUT)
         self.irq_pin = Pin(irq_pin_num, Pin.IN)
+        self.events = StatusDispatcher(self.irq_pin)
+        self.TX_TIMEOUT_MS = 5  # frame transmission
+        self.REPLY_DELAY_US = 3000  # response sent this long after the poll was received
+        # Hardware receive timeouts for the node's final frame of a double-sided exchange,
+        # single-sided nodes send none and the wait ends within a few milliseconds
+        self.FINAL_WAIT_US = self.REPLY_DELAY_US + 1000
+        self.FINAL_PREAMBLE_PACS = (self.REPLY_DELAY_US + 500) // 8  # PACs of 8 symbols (~8 us)
+        self.FINAL_TIMEOUT_MS = 5
+        self.FINAL = 0x66  # first payload byte ('f') of the node's final frame
+        self.MULTI_POLL = 0x6D  # first payload byte ('m') of a broadcast poll carrying a slot map
+        self.DISCOVERY = 0x64  # first payload byte ('d') of a discovery beacon
+        self.RESPONSE_TIMEOUT_MS = 1000  # poll or handshake from the node
         self.t_3 = None
         self.r_2 = None
         self.times_success = False
+        self.times_payload = bytearray(10)  # t_3 and r_2, 5 bytes little endian each
+        self.r_6 = None
+        self.report_payload = bytearray(5)  # r_6, 5 bytes little endian
         self.handshake_init = False
         self.handshake_complete = False
         self.target_addr = None
@@ -45,37 +60,40 @@ class UWBTag:
             is_coordinator=False,
             enable_reserved=False
         )
+        dwmCom.mark_baseline()
 
-    def _handle_interrupt_tr(self, pin):
-        """Handle interrupt for two-way ranging response."""
-        self.r_2 = dwmCom.get_rx_timestamp()
-        self.t_3 = dwmCom.get_tx_timestamp()
-
-        message = bytearray(dwmCom.read_register_intuitive(0x11, 18))
-        self.sequence = message[15]
-        self.target_addr = int.from_bytes(message[7:9], 'big')
-        self.success_tr = True
-
-    def _handle_interrupt_handshake(self, pin):
-        """Handle interrupt for two-way handshake response."""
-
-        message = bytearray(dwmCom.read_register_intuitive(0x11, 18))
-
-        self.sequence = message[15]
+    async def rearm(self):
+        """
+        Return the radio to idle between ranging phases without reconfiguring it.
+        Falls back to a full init() when the radio fails its health check.
+        """
+        if dwmCom.is_configured():
+            dwmCom.rearm()
+        else:
+            await self.init()
 
-        self.target_addr = int.from_bytes(message[7:9], 'big')
+    def discovery_slot(self, number, slots):
+        """
+        Response slot to a discovery beacon, derived from this tag's address and the beacon
+        number so that tags colliding in one beacon are spread apart in the next.
 
-        self.handshake_init = True
+        Args:
+            number (int): Beacon number within the discovery
+            slots (int): Response slots of the beacon
 
-    def _send_handshake_interrupt(self, pin):
-        self.handshake_complete = True
+        Returns:
+            int: Slot index
+        """
+        h = ((self.id ^ (number * 0x7F4A7C15)) * 0x9E3779B1) & 0xFFFFFFFF
+        return (h >> 16) % slots
 
-    def _handle_times_interrupt(self, pin):
-        """Handle interrupt for time data transmission."""
-        self.times_success = True
-        self.led.toggle()
+    async def send_handshake(self, delay_us):
+        """
+        Answer a discovery beacon delay_us after its reception.
 
-    async def send_handshake(self):
+        Args:
+            delay_us (int): Response delay after the beacon
+        """
         dwmCom.format_message_mac(
             frame_type=1,
             seq_num=self.sequence,
@@ -89,12 +107,14 @@ class UWBTag:
             ack_request=False,
             pan_id_compress=False
         )
-        rand = randint(0,50)
-        delay = 0.01*rand
-        await uasyncio.sleep(delay)
-        dwmCom.transmit()
-        await uasyncio.sleep_ms(5)
-        self.led.toggle()
+        dwmCom.schedule_tx(self.r_2 + delay_us * dwmCom.TICKS_PER_US)
+        self.events.start(TX_EVENTS)
+        dwmCom.transmit_delayed()
+        self.handshake_complete = await self.events.wait(TX_EVENTS, delay_us // 1000 + self.TX_TIMEOUT_MS) == TXFRS
+        if self.handshake_complete:
+            self.led.toggle()
+        else:
+            await self.rearm()
 
     async def twr_response(self):
         """
@@ -103,18 +123,22 @@ class UWBTag:
         Returns:
             bool: Success status
         """
-        dwmCom.init_ack_timing(ack_time=6)
-        dwmCom.init_auto_ack(auto_ack=True, rx_auth=True)
-        dwmCom.set_send_interrupt()
+        dwmCom.init_auto_ack(auto_ack=False, rx_auth=True)
+        self.events.start(RX_EVENTS)
 
         self.success_tr = False
-        self.irq_pin.irq(trigger=Pin.IRQ_RISING, handler=self._handle_interrupt_tr)
 
-        count = 0
-        while not self.success_tr and count <= 200:
-            dwmCom.search()
-            await uasyncio.sleep_ms(5)
-            count += 1
+        deadline = time.ticks_add(time.ticks_ms(), self.RESPONSE_TIMEOUT_MS)
+        while not self.success_tr:
+            remaining = time.ticks_diff(deadline, time.ticks_ms())
+            if await self.events.receive(remaining) is not RX_OK:
+                break
+            self.r_2 = dwmCom.get_rx_timestamp()
+
+            message = dwmCom.read_view(0x11, 0, 11)
+            self.sequence = message[2]
+            self.target_addr = message[9] | (message[10] << 8)
+            self.success_tr = True
 
         if self.success_tr:
             result = await self.send_times()
@@ -122,35 +146,26 @@ class UWBTag:
         
         return False
 
-    async def send_times(self):
+    async def send_times(self, delay_us=None, wait_for_final=True):
         """
-        Send timestamp data to destination.
-        
+        Send the response to a poll REPLY_DELAY_US after its reception.
+
+        The transmission is scheduled with DX_TIME, so its TX timestamp t_3 is known in
+        advance and sent in the same frame as the poll reception timestamp r_2.
+
         Args:
-            tx (int): Transmission timestamp
-            rx (int): Reception timestamp
-            dest_addr (int): Destination address
-            sequence_num (int): Sequence number
-            src_addr (int): Source address
-            pan_id (int): PAN identifier
+            delay_us (int, optional): Response delay after the poll, REPLY_DELAY_US if None
+            wait_for_final (bool): Listen for the final frame of a double-sided exchange
         
         Returns:
             bool: Success status
         """
-        message = bytearray()
-        
-        # Format tx timestamp (5 bytes)
-        tx_bytes = dwmCom.int_to_bytes(self.t_3, byteorder='little')
-        tx_bytes = tx_bytes + (b'\x00' * (5 - len(tx_bytes)))
-        message.extend(tx_bytes)
-        
-        # Format rx timestamp (5 bytes)
-        rx_bytes = dwmCom.int_to_bytes(self.r_2, byteorder='little')
-        rx_bytes = rx_bytes + (b'\x00' * (5 - len(rx_bytes)))
-        message.extend(rx_bytes)
-
-        await self.init()
-        await uasyncio.sleep_ms(50)
+        if delay_us is None:
+            delay_us = self.REPLY_DELAY_US
+        self.t_3 = dwmCom.schedule_tx(self.r_2 + delay_us * dwmCom.TICKS_PER_US)
+        for i in range(5):
+            self.times_payload[i] = (self.t_3 >> (8 * i)) & 0xFF
+            self.times_payload[5 + i] = (self.r_2 >> (8 * i)) & 0xFF
 
         dwmCom.format_message_mac(
             frame_type=1,
@@ -159,66 +174,167 @@ class UWBTag:
             dest_addr=self.target_addr,
             src_pan_id=self.pan,
             src_addr=self.id,
-            payload=message,
+            payload=self.times_payload,
             security_enabled=False,
             frame_pending=False,
-            ack_request=True,
+            ack_request=False,
             pan_id_compress=False
         )
 
         self.times_success = False
-        dwmCom.set_send_interrupt()
-        self.irq_pin.irq(trigger=Pin.IRQ_RISING, handler=self._handle_times_interrupt)
+        self.events.start(RX_EVENTS | TX_EVENTS)
+        if wait_for_final:
+            self.events.set_rx_timeouts(self.FINAL_WAIT_US, self.FINAL_PREAMBLE_PACS)
         
-        dwmCom.transmit()
-        time.sleep_ms(1)
+        dwmCom.transmit_delayed(wait_for_response=wait_for_final)
+        if await self.events.wait(TX_EVENTS, delay_us // 1000 + self.TX_TIMEOUT_MS) == TXFRS:
+            self.times_success = True
+            self.led.toggle()
+            if wait_for_final:
+                await self.send_report()
+        else:
+            # Reply time missed (HPDWARN), drop the pending transmission
+            await self.rearm()
 
         return self.times_success
 
+    async def send_report(self):
+        """
+        Receive the final frame of a double-sided exchange and report when it arrived (r_6).
+        
+        Returns:
+            bool: Success status
+        """
+        if await self.events.receive(self.FINAL_TIMEOUT_MS, enable=False) is not RX_OK:
+            return False
+        message = dwmCom.read_view(0x11, 0, 12)
+        if message[2] != self.sequence or message[11] != self.FINAL:
+            return False
+        self.r_6 = dwmCom.get_rx_timestamp()
+        for i in range(5):
+            self.report_payload[i] = (self.r_6 >> (8 * i)) & 0xFF
+
+        dwmCom.format_message_mac(
+            frame_type=1,
+            seq_num=self.sequence,
+            dest_pan_id=self.pan,
+            dest_addr=self.target_addr,
+            src_pan_id=self.pan,
+            src_addr=self.id,
+            payload=self.report_payload,
+            security_enabled=False,
+            frame_pending=False,
+            ack_request=False,
+            pan_id_compress=False
+        )
+
+        dwmCom.transmit()
+        return await self.events.wait(TXFRS, self.TX_TIMEOUT_MS) != 0
+
+    async def listen(self):
+        """
+        Wait for a frame from a node and answer it. A broadcast is a discovery beacon or a
+        one-to-many poll, a frame addressed to this tag is a ranging poll, so a tag answers
+        every slot a node schedules for it without leaving this loop.
+        
+        Returns:
+            bool: Success status
+        """
+        dwmCom.init_auto_ack(auto_ack=False, rx_auth=True)
+        self.events.start(RX_EVENTS)
+
+        if await self.events.receive(self.RESPONSE_TIMEOUT_MS) is not RX_OK:
+            return False
+        self.r_2 = dwmCom.get_rx_timestamp()
+        message = dwmCom.read_view(0x11, 0, 12)
+        if message[11] == self.FINAL:
+            return False  # final of an exchange that was already given up
+        self.sequence = message[2]
+        self.target_addr = message[9] | (message[10] << 8)
+        if message[5] == 0xFF and message[6] == 0xFF:
+            if message[11] == self.MULTI_POLL:
+                return await self.answer_multi_poll()
+            return await self.answer_handshake()
+        return await self.send_times()
+
+    async def answer_multi_poll(self):
+        """
+        Answer a broadcast poll in the response slot its slot map assigns to this tag.
+        
+        Returns:
+            bool: Success status, False when the poll has no slot for this tag
+        """
+        length = dwmCom.get_rx_frame_length() - 14  # slot spacing and map, FCS excluded
+        if length < 4:
+            return False
+        payload = dwmCom.read_view(0x11, 12, length)
+        slot_us = payload[0] | (payload[1] << 8)
+        for i in range(2, length - 1, 2):
+            if payload[i] | (payload[i + 1] << 8) == self.id:
+                delay_us = self.REPLY_DELAY_US + (i // 2 - 1) * slot_us
+                return await self.send_times(delay_us, wait_for_final=False)
+        return False
+
+    async def answer_handshake(self):
+        """
+        Answer a node's discovery beacon in this tag's slot, unless the beacon lists the
+        tag as already discovered.
+        
+        Returns:
+            bool: Success status
+        """
+        length = dwmCom.get_rx_frame_length() - 13  # payload, FCS excluded
+        if length < 5:
+            return False
+        payload = dwmCom.read_view(0x11, 11, length)
+        if payload[0] != self.DISCOVERY or payload[1] == 0:
+            return False
+        slots = payload[1]
+        slot_us = payload[2] | (payload[3] << 8)
+        number = payload[4]
+        for i in range(5, length - 1, 2):
+            if payload[i] | (payload[i + 1] << 8) == self.id:
+                self.handshake_complete = True
+                return True
+        self.handshake_complete = False
+        await self.send_handshake(self.REPLY_DELAY_US + self.discovery_slot(number, slots) * slot_us)
+        return self.handshake_complete
+
     async def handshake_response(self):
         """
-        Perform two-way ranging response.
+        Wait for a discovery beacon and answer it.
         
         Returns:
             bool: Success status
         """
         dwmCom.init_ack_timing(ack_time=6)
         dwmCom.init_auto_ack(auto_ack=False, rx_auth=True)
-        dwmCom.set_receive_interrupt()
+        self.events.start(RX_EVENTS)
 
         self.handshake_init = False
-        self.irq_pin.irq(trigger=Pin.IRQ_RISING, handler=self._handle_interrupt_handshake)
 
-        count = 0
-        while not self.handshake_init and count <= 200:
-            dwmCom.search()
-            await uasyncio.sleep_ms(5)
-            count += 1
+        if await self.events.receive(self.RESPONSE_TIMEOUT_MS) is RX_OK:
+            self.r_2 = dwmCom.get_rx_timestamp()
+            message = dwmCom.read_view(0x11, 0, 11)
+            self.sequence = message[2]
+            self.target_addr = message[9] | (message[10] << 8)
+            self.handshake_init = True
 
         if self.handshake_init:
-            await self.init()
-            dwmCom.set_send_interrupt()
-            self.irq_pin.irq(trigger=Pin.IRQ_RISING, handler=self._send_handshake_interrupt)
-            self.handshake_complete = False
-            await uasyncio.sleep_ms(50)
-            await self.send_handshake()
-            return self.handshake_complete
+            return await self.answer_handshake()
         
         return False
     
     async def start_handshake(self, callback=None):
         """
-        Start handshake listening
+        Start handshake listening, answering handshakes and ranging polls as they arrive
         
         Args:
             callback (callable, optional): Function to call with distance measurements
         """
+        dwmCom.init_ack_timing(ack_time=6)
         while True:
-            is_response = await self.handshake_response()
-            if is_response == True:
-                await self.twr_response()
-            else: print('handshake not received')
-            await uasyncio.sleep_ms(50)
+            await self.listen()
 
 # Example usage:
 async def main():
@@ -237,7 +353,7 @@ async def main():
         result = await transmitter.twr_response()
         print(result)
         if result == False:
-            await transmitter.init()
+            await transmitter.rearm()
         await uasyncio.sleep(0.5)
 
 if __name__ == "__main__":
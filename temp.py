@@ -23,7 +23,7 @@ async def main():
 
     while True:
         await tag.start_handshake()
-        await tag.init()
+        await tag.rearm()
 
 
 uasyncio.run(main())
\ No newline at end of file
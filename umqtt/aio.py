@@ -0,0 +1,430 @@
+import socket
+import struct
+import time
+from collections import deque
+import uasyncio as asyncio
+
+from umqtt.simple import MQTTException, cached_topic, header_size, put_header
+
+
+def is_ip(host):
+    """True if host is a dotted IPv4 address rather than a name"""
+    parts = host.split(".")
+    return len(parts) == 4 and all(part.isdigit() for part in parts)
+
+
+def _skip_name(buf, i):
+    while True:
+        n = buf[i]
+        if n == 0:
+            return i + 1
+        if n & 0xC0 == 0xC0:  # compression pointer
+            return i + 2
+        i += n + 1
+
+
+async def dns_lookup(name, dns_server, timeout_ms=3000, port=53):
+    """IPv4 address of name from the DNS server at dns_server:port, asked over UDP
+    without blocking other tasks, unlike getaddrinfo(). Raises OSError when the
+    server has no address for name or does not answer within timeout_ms."""
+    qid = time.ticks_ms() & 0xFFFF
+    query = bytearray(struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0))  # recursion desired
+    for label in name.split("."):
+        query.append(len(label))
+        query.extend(label.encode())
+    query.extend(b"\x00\x00\x01\x00\x01")  # end of name, type A, class IN
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        sock.sendto(query, (dns_server, port))
+        start = time.ticks_ms()
+        while True:
+            try:
+                resp = sock.recv(512)
+            except OSError:  # nothing received yet
+                resp = None
+            if resp and len(resp) >= 12 and (resp[0] << 8 | resp[1]) == qid:
+                if resp[3] & 0x0F:
+                    raise OSError("DNS error %d" % (resp[3] & 0x0F))
+                i = _skip_name(resp, 12) + 4
+                for _ in range(resp[6] << 8 | resp[7]):
+                    i = _skip_name(resp, i)
+                    rtype, _, _, rdlen = struct.unpack_from("!HHIH", resp, i)
+                    i += 10
+                    if rtype == 1 and rdlen == 4:
+                        return "%d.%d.%d.%d" % tuple(resp[i : i + 4])
+                    i += rdlen
+                raise OSError("no address for " + name)
+            if time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                raise OSError("DNS timeout")
+            await asyncio.sleep_ms(20)
+    finally:
+        sock.close()
+
+
+# Non-blocking MQTT client for uasyncio, a drop-in for the publish side of
+# umqtt.simple.MQTTClient. publish() and subscribe() only queue packets; a
+# writer task sends them over a uasyncio stream and a reader task handles
+# everything the broker sends, so a slow or dead broker never stalls other
+# tasks. The outbound queue is bounded by packet count and bytes, when it is
+# full the oldest queued publish is dropped.
+#
+# QoS 1 publishes are pipelined: up to `window` of them are in flight at once,
+# PUBACKs are matched by packet id as they arrive, and a publish unacknowledged
+# after retry_ms is sent again with DUP set, at most max_retries times. After a
+# reconnect every in-flight publish is sent again. Publishes keep their order
+# on the wire, a QoS 1 publish waiting for a window slot holds back the ones
+# queued after it.
+#
+# The server name is looked up once and the address cached, connect() opens the
+# connection to the cached address and only looks the name up again after
+# resolve_after failed connects in a row. connect() looks it up with a blocking
+# getaddrinfo(); await lookup() first, when needs_lookup(), to ask the DNS
+# server without blocking, or pass an IP address.
+class MQTTClient:
+    def __init__(
+        self,
+        client_id,
+        server,
+        port=0,
+        user=None,
+        password=None,
+        keepalive=60,
+        ssl=None,
+        max_queue=32,
+        max_queue_bytes=4096,
+        window=8,
+        retry_ms=2000,
+        max_retries=5,
+        resolve_after=3,
+    ):
+        if port == 0:
+            port = 8883 if ssl else 1883
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.addr = server if is_ip(server) else None  # cached address of server
+        self.resolve_after = resolve_after
+        self.failures = 0  # connects in a row that did not get a CONNACK
+        self.ssl = ssl
+        self.pid = 0
+        self.cb = None
+        self.user = user
+        self.pswd = password
+        self.keepalive = keepalive
+        self.lw_topic = None
+        self.lw_msg = None
+        self.lw_qos = 0
+        self.lw_retain = False
+        self.reader = None
+        self.writer = None
+        self.connected = False
+        self.max_queue = max_queue
+        self.max_queue_bytes = max_queue_bytes
+        self.queue = deque((), max_queue + 1)  # queued publish packets
+        self.queued_bytes = 0
+        self.control = deque((), 16)  # PUBACK, SUBSCRIBE and PINGREQ go out first
+        self.window = window
+        self.retry_ms = retry_ms
+        self.max_retries = max_retries
+        self.inflight = {}  # packet id -> [packet, ticks_ms() sent, sends, queued for retry]
+        self.retry = deque((), window + 1)  # packet ids due for retransmission
+        self._held = None  # next publish, held back while the window is full
+        self.sent = 0
+        self.dropped = 0  # publishes dropped by the queue limits
+        self.acked = 0
+        self.retransmits = 0
+        self.expired = 0  # QoS 1 publishes given up after max_retries
+        self.last_rx = 0  # ticks_ms() of the last packet from the broker
+        self.topics = {}
+        self._wake = asyncio.Event()
+        self._tasks = []
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        assert 0 <= qos <= 2
+        assert topic
+        self.lw_topic = topic
+        self.lw_msg = msg
+        self.lw_qos = qos
+        self.lw_retain = retain
+
+    @staticmethod
+    def _header(op, sz):
+        hdr = bytearray(5)
+        hdr[0] = op
+        i = 1
+        while sz > 0x7F:
+            hdr[i] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            i += 1
+        hdr[i] = sz
+        return hdr[: i + 1]
+
+    @staticmethod
+    def _str(s):
+        if isinstance(s, str):
+            s = s.encode()
+        return struct.pack("!H", len(s)) + s
+
+    def resolve(self):
+        """Look the server name up and cache its address, blocks for the DNS lookup"""
+        if is_ip(self.server):
+            self.addr = self.server
+        else:
+            self.addr = socket.getaddrinfo(self.server, self.port)[0][-1][0]
+        self.failures = 0
+
+    def needs_lookup(self):
+        return self.addr is None or self.failures >= self.resolve_after
+
+    async def lookup(self, dns_server, timeout_ms=3000):
+        """Look the server name up with dns_lookup() and cache its address"""
+        if is_ip(self.server):
+            self.addr = self.server
+        else:
+            self.addr = await dns_lookup(self.server, dns_server, timeout_ms)
+        self.failures = 0
+
+    async def connect(self, clean_session=True, timeout_ms=5000):
+        self._close()  # a connection that died without us noticing
+        if self.needs_lookup():
+            self.resolve()
+        self.failures += 1  # until the CONNACK arrives
+        if self.ssl:
+            stream = asyncio.open_connection(self.addr, self.port, ssl=self.ssl)
+        else:
+            stream = asyncio.open_connection(self.addr, self.port)
+        self.reader, self.writer = await asyncio.wait_for_ms(stream, timeout_ms)
+
+        flags = clean_session << 1
+        body = self._str("MQTT") + b"\x04"
+        payload = self._str(self.client_id)
+        if self.lw_topic:
+            flags |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            flags |= self.lw_retain << 5
+            payload += self._str(self.lw_topic) + self._str(self.lw_msg)
+        if self.user:
+            flags |= 0xC0
+            payload += self._str(self.user) + self._str(self.pswd)
+        body += struct.pack("!BH", flags, self.keepalive) + payload
+        self.writer.write(self._header(0x10, len(body)) + body)
+        await self.writer.drain()
+
+        resp = await asyncio.wait_for_ms(self.reader.readexactly(4), timeout_ms)
+        if resp[0] != 0x20 or resp[1] != 0x02:
+            raise MQTTException(resp[0])
+        if resp[3] != 0:
+            raise MQTTException(resp[3])
+        self.connected = True
+        self.failures = 0
+        self.last_rx = time.ticks_ms()
+        for pid in self.inflight:
+            self._resend(pid)
+        self._tasks = [asyncio.create_task(self._run(self._read_loop())),
+                       asyncio.create_task(self._run(self._write_loop())),
+                       asyncio.create_task(self._run(self._retry_loop()))]
+        if self.keepalive:
+            self._tasks.append(asyncio.create_task(self._run(self._ping_loop())))
+        self._wake.set()  # send whatever was queued while disconnected
+        return resp[2] & 1
+
+    async def disconnect(self):
+        if self.connected:
+            self.connected = False
+            try:
+                self.writer.write(b"\xe0\0")
+                await self.writer.drain()
+            except OSError:
+                pass
+        self._close()
+
+    def _close(self):
+        self.connected = False
+        current = asyncio.current_task()
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()
+        self._tasks = []
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+    async def _run(self, coro):
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # OSError or EOFError from the stream, MQTTException
+            print(f"MQTT connection lost: {e}")
+            self._close()
+
+    def _send_control(self, pkt):
+        self.control.append(pkt)
+        self._wake.set()
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        """Queue a publish, returns False if it was dropped"""
+        if qos > 1:
+            raise MQTTException("QoS 2 is not supported")
+        if isinstance(msg, str):
+            msg = msg.encode()
+        t = cached_topic(self.topics, topic)
+        sz = len(t) + len(msg) + (2 if qos else 0)
+        # The one allocation per publish, the packet waits in the queue until it is sent
+        pkt = bytearray(header_size(sz) + sz)
+        i = put_header(pkt, 0x30 | qos << 1 | retain, sz)
+        pkt[i : i + len(t)] = t
+        pkt[len(pkt) - len(msg) :] = msg  # the packet id before it is set when sent
+        if len(pkt) > self.max_queue_bytes:
+            self.dropped += 1
+            return False
+        while len(self.queue) >= self.max_queue or self.queued_bytes + len(pkt) > self.max_queue_bytes:
+            self.queued_bytes -= len(self.queue.popleft())
+            self.dropped += 1
+        self.queue.append(pkt)
+        self.queued_bytes += len(pkt)
+        self._wake.set()
+        return True
+
+    def subscribe(self, topic, qos=0):
+        assert self.cb is not None, "Subscribe callback is not set"
+        pid = self._next_pid()  # never one an in-flight QoS 1 publish holds
+        body = struct.pack("!H", pid) + self._str(topic) + bytes((qos,))
+        self._send_control(self._header(0x82, len(body)) + body)
+
+    def pending(self):
+        return len(self.queue) + len(self.control) + len(self.inflight) + (self._held is not None)
+
+    async def wait_idle(self, timeout_ms=None):
+        """Wait until everything queued has been sent and every QoS 1 publish acknowledged"""
+        start = time.ticks_ms()
+        while self.pending():
+            if timeout_ms is not None and time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                return False
+            await asyncio.sleep_ms(5)
+        return True
+
+    @staticmethod
+    def _pid_offset(pkt):
+        i = 1
+        while pkt[i] & 0x80:
+            i += 1
+        return i + 3 + ((pkt[i + 1] << 8) | pkt[i + 2])
+
+    def _next_pid(self):
+        self.pid = self.pid % 0xFFFF + 1
+        while self.pid in self.inflight:
+            self.pid = self.pid % 0xFFFF + 1
+        return self.pid
+
+    def _resend(self, pid):
+        entry = self.inflight[pid]
+        if not entry[3]:
+            entry[0][0] |= 0x08  # DUP
+            entry[3] = True
+            self.retry.append(pid)
+            self._wake.set()
+
+    # Messages are delivered by the reader task, kept for umqtt.simple callers
+    def check_msg(self):
+        return None
+
+    def _next_packet(self):
+        if len(self.control):
+            return self.control.popleft()
+        while len(self.retry):
+            entry = self.inflight.get(self.retry.popleft())
+            if entry is not None:  # not acknowledged while it waited
+                entry[1] = time.ticks_ms()
+                entry[2] += 1
+                entry[3] = False
+                self.retransmits += 1
+                return entry[0]
+        pkt = self._held
+        if pkt is None:
+            if not len(self.queue):
+                return None
+            pkt = self.queue.popleft()
+            self.queued_bytes -= len(pkt)
+        qos1 = pkt[0] & 0x06
+        if qos1 and len(self.inflight) >= self.window:
+            self._held = pkt  # waits for a window slot
+            return None
+        self._held = None
+        self.sent += 1
+        if qos1:
+            pid = self._next_pid()
+            struct.pack_into("!H", pkt, self._pid_offset(pkt), pid)
+            self.inflight[pid] = [pkt, time.ticks_ms(), 1, False]
+        return pkt
+
+    async def _write_loop(self):
+        while True:
+            pkt = self._next_packet()
+            while pkt is None:
+                self._wake.clear()
+                await self._wake.wait()
+                pkt = self._next_packet()
+            self.writer.write(pkt)
+            await self.writer.drain()
+
+    async def _read_loop(self):
+        reader = self.reader
+        while True:
+            op = (await reader.readexactly(1))[0]
+            sz = 0
+            sh = 0
+            while 1:
+                b = (await reader.readexactly(1))[0]
+                sz |= (b & 0x7F) << sh
+                if not b & 0x80:
+                    break
+                sh += 7
+            data = await reader.readexactly(sz) if sz else b""
+            self.last_rx = time.ticks_ms()
+            if op & 0xF0 == 0x30:
+                self._deliver(op, data)
+            elif op == 0x40:
+                if self.inflight.pop((data[0] << 8) | data[1], None) is not None:
+                    self.acked += 1
+                    self._wake.set()
+            elif op == 0x90 and data[-1] == 0x80:
+                raise MQTTException(0x80)
+
+    def _deliver(self, op, data):
+        topic_len = (data[0] << 8) | data[1]
+        pos = 2 + topic_len
+        if op & 6:
+            pid = data[pos : pos + 2]
+            pos += 2
+            if op & 6 == 2:
+                self._send_control(b"\x40\x02" + pid)
+            else:
+                raise MQTTException("QoS 2 is not supported")
+        if self.cb:
+            self.cb(data[2 : 2 + topic_len], data[pos:])
+
+    async def _retry_loop(self):
+        while True:
+            await asyncio.sleep_ms(self.retry_ms // 4)
+            now = time.ticks_ms()
+            for pid in list(self.inflight):
+                entry = self.inflight[pid]
+                if entry[3] or time.ticks_diff(now, entry[1]) < self.retry_ms:
+                    continue
+                if entry[2] > self.max_retries:
+                    del self.inflight[pid]
+                    self.expired += 1
+                    self._wake.set()
+                else:
+                    self._resend(pid)
+
+    async def _ping_loop(self):
+        while True:
+            await asyncio.sleep_ms(self.keepalive * 500)
+            if time.ticks_diff(time.ticks_ms(), self.last_rx) > self.keepalive * 1500:
+                raise OSError("keepalive timeout")
+            self._send_control(b"\xc0\0")
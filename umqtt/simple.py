@@ -7,6 +7,53 @@ class MQTTException(Exception):
     pass
 
 
+MAX_TOPICS = 8  # encoded topic names kept for reuse
+
+
+def header_size(sz):
+    """Bytes of fixed header for a packet with sz bytes of remaining length"""
+    assert sz < 268435456
+    n = 2
+    while sz > 0x7F:
+        sz >>= 7
+        n += 1
+    return n
+
+
+def put_header(buf, op, sz):
+    """Write a fixed header at the start of buf, returns its length"""
+    buf[0] = op
+    i = 1
+    while sz > 0x7F:
+        buf[i] = (sz & 0x7F) | 0x80
+        sz >>= 7
+        i += 1
+    buf[i] = sz
+    return i + 1
+
+
+def cached_topic(topics, topic):
+    """Length-prefixed encoding of topic, kept in the topics dict for topics published repeatedly"""
+    t = topics.get(topic)
+    if t is None:
+        if len(topics) >= MAX_TOPICS:
+            topics.clear()
+        name = topic.encode() if isinstance(topic, str) else topic
+        t = topics[topic] = struct.pack("!H", len(name)) + name
+    return t
+
+
+def put_str(buf, i, s):
+    """Write a length-prefixed string at buf[i], returns the offset after it"""
+    if isinstance(s, str):
+        s = s.encode()
+    n = len(s)
+    buf[i] = n >> 8
+    buf[i + 1] = n & 0xFF
+    buf[i + 2 : i + 2 + n] = s
+    return i + 2 + n
+
+
 class MQTTClient:
     def __init__(
         self,
@@ -34,10 +81,17 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
-
-    def _send_str(self, s):
-        self.sock.write(struct.pack("!H", len(s)))
-        self.sock.write(s)
+        # Packets are assembled here and sent with a single write
+        self.buf = bytearray(128)
+        self.topics = {}
+
+    def _buffer(self, n):
+        if len(self.buf) < n:
+            size = len(self.buf)
+            while size < n:
+                size <<= 1
+            self.buf = bytearray(size)
+        return self.buf
 
     def _recv_len(self):
         n = 0
@@ -66,40 +120,30 @@ class MQTTClient:
         self.sock.connect(addr)
         if self.ssl:
             self.sock = self.ssl.wrap_socket(self.sock, server_hostname=self.server)
-        premsg = bytearray(b"\x10\0\0\0\0\0")
-        msg = bytearray(b"\x04MQTT\x04\x02\0\0")
-
         sz = 10 + 2 + len(self.client_id)
-        msg[6] = clean_session << 1
+        flags = clean_session << 1
         if self.user:
             sz += 2 + len(self.user) + 2 + len(self.pswd)
-            msg[6] |= 0xC0
+            flags |= 0xC0
         if self.keepalive:
             assert self.keepalive < 65536
-            msg[7] |= self.keepalive >> 8
-            msg[8] |= self.keepalive & 0x00FF
         if self.lw_topic:
             sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-            msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-            msg[6] |= self.lw_retain << 5
-
-        i = 1
-        while sz > 0x7F:
-            premsg[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        premsg[i] = sz
-
-        self.sock.write(premsg, i + 2)
-        self.sock.write(msg)
-        # print(hex(len(msg)), hexlify(msg, ":"))
-        self._send_str(self.client_id)
+            flags |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            flags |= self.lw_retain << 5
+
+        buf = self._buffer(header_size(sz) + sz)
+        i = put_header(buf, 0x10, sz)
+        i = put_str(buf, i, b"MQTT")
+        struct.pack_into("!BBH", buf, i, 4, flags, self.keepalive)
+        i = put_str(buf, i + 4, self.client_id)
         if self.lw_topic:
-            self._send_str(self.lw_topic)
-            self._send_str(self.lw_msg)
+            i = put_str(buf, i, self.lw_topic)
+            i = put_str(buf, i, self.lw_msg)
         if self.user:
-            self._send_str(self.user)
-            self._send_str(self.pswd)
+            i = put_str(buf, i, self.user)
+            i = put_str(buf, i, self.pswd)
+        self.sock.write(buf, i)
         resp = self.sock.read(4)
         assert resp[0] == 0x20 and resp[1] == 0x02
         if resp[3] != 0:
@@ -114,27 +158,24 @@ class MQTTClient:
         self.sock.write(b"\xc0\0")
 
     def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
-        sz = 2 + len(topic) + len(msg)
+        if isinstance(msg, str):
+            msg = msg.encode()
+        t = cached_topic(self.topics, topic)
+        sz = len(t) + len(msg)
         if qos > 0:
             sz += 2
         assert sz < 2097152
-        i = 1
-        while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
+        buf = self._buffer(header_size(sz) + sz)
+        i = put_header(buf, 0x30 | qos << 1 | retain, sz)
+        buf[i : i + len(t)] = t
+        i += len(t)
         if qos > 0:
             self.pid += 1
             pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
+            struct.pack_into("!H", buf, i, pid)
+            i += 2
+        buf[i : i + len(msg)] = msg
+        self.sock.write(buf, i + len(msg))
         if qos == 1:
             while 1:
                 op = self.wait_msg()
@@ -150,19 +191,21 @@ class MQTTClient:
 
     def subscribe(self, topic, qos=0):
         assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
         self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
-        self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
+        sz = 2 + 2 + len(topic) + 1
+        buf = self._buffer(header_size(sz) + sz)
+        i = put_header(buf, 0x82, sz)
+        struct.pack_into("!H", buf, i, self.pid)
+        i = put_str(buf, i + 2, topic)
+        buf[i] = qos
+        self.sock.write(buf, i + 1)
+        pid = self.pid
         while 1:
             op = self.wait_msg()
             if op == 0x90:
                 resp = self.sock.read(4)
                 # print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
+                assert resp[1] << 8 | resp[2] == pid
                 if resp[3] == 0x80:
                     raise MQTTException(resp[3])
                 return
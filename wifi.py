@@ -2,65 +2,108 @@ from machine import Pin
 import network
 import json
 import time
+import random
 import ubinascii
-from umqtt.simple import MQTTClient
+from umqtt.aio import MQTTClient
+import records
+from ringlog import RingLog
 import uasyncio as asyncio
 
+# Connection states, see AnchorNode.connection_manager
+DOWN = 0
+ASSOCIATING = 1
+CONNECTING = 2
+UP = 3
+STATE_NAMES = ('down', 'associating', 'connecting', 'up')
+
+STAT_GOT_IP = 3  # network.STAT_GOT_IP
+
 class AnchorNode:
-    def __init__(self, ssid, password, mqtt_broker, mqtt_port=1883, threshold=5):
-        """Initialize anchor node with network and MQTT broker details"""
+    def __init__(self, ssid, password, mqtt_broker, mqtt_port=1883, threshold=5, batch_size=16, batch_ms=100,
+                 log_path='/ranges.log', log_capacity=4096, log_sync_ms=1000, replay_rate=160,
+                 associate_ms=10000, backoff_ms=500, max_backoff_ms=30000, poll_ms=250):
+        """Initialize anchor node with network and MQTT broker details, ranges are published in batches
+        of up to batch_size records, at most batch_ms after the first one was queued. While the broker is
+        unreachable binary records go to a ring log of log_capacity records on flash (None for no log),
+        synced every log_sync_ms and replayed at up to replay_rate records per second once it is back.
+        Failed connection attempts are retried after a jittered backoff doubling from backoff_ms up to
+        max_backoff_ms, an association gives up after associate_ms"""
         self.ssid = ssid
         self.password = password
         self.mqtt_broker = mqtt_broker
         self.mqtt_port = mqtt_port
         self.wlan = network.WLAN(network.STA_IF)
-        self.connected = False
+        self.state = DOWN
+        self.associate_ms = associate_ms
+        self.min_backoff_ms = backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.backoff_ms = backoff_ms
+        self.poll_ms = poll_ms
+        self._state_since = time.ticks_ms()
+        self._down_since = None  # ticks_ms() the last outage started, None before the first connection
         self.proximity_threshold = threshold
+        self.binary_records = True  # False publishes the JSON reports older backends expect
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        self._batch = bytearray(batch_size * records.RECORD_SIZE)
+        self._batch_view = memoryview(self._batch)
+        self._json_batch = []
+        self._batch_count = 0
+        self._batch_start = 0  # ticks_ms() of the oldest queued range
+        self.log = RingLog(log_path, log_capacity) if log_path else None
+        self.log_sync_ms = log_sync_ms
+        self.replay_rate = replay_rate
+        self._replay = bytearray(batch_size * records.RECORD_SIZE)
+
+        # Counters reported by the heartbeat
+        self.uptime_ms = 0  # accumulated in steps short enough for ticks_diff(), which wraps after ~6 days
+        self._uptime_tick = time.ticks_ms()
+        self.ranges_sent = 0
+        self.ranges_filtered = 0  # out of proximity threshold
+        self.publishes = 0
+        self.send_errors = 0
+        self.ranges_logged = 0
+        self.ranges_replayed = 0
+        self.connect_failures = 0
+        self.dns_lookups = 0
+        self.outages = 0
+        self.last_recover_ms = 0  # time to recover from the last outage
+        self.max_recover_ms = 0
+        self.total_recover_ms = 0
         
         # Get MAC address and format it as the anchor ID
         self.wlan.active(True)
         mac = self.wlan.config('mac')
         self.anchor_id = ubinascii.hexlify(mac).decode('utf-8')
+        self._set_topics()
         print(f"Anchor ID (MAC): {self.anchor_id}")
         
         # Initialize MQTT client
         client_id = f"anchor_{self.anchor_id}"
-        self.mqtt_client = MQTTClient(client_id, mqtt_broker, mqtt_port)
+        self.mqtt_client = MQTTClient(client_id, mqtt_broker, mqtt_port, keepalive=60)
         self.mqtt_client.set_callback(self._on_message)
         
-    async def connect_wifi(self):
-        """Establish WiFi connection with error handling and retry"""
+    def _set_topics(self):
+        """Build the publish topics once, the MQTT client caches their encoding"""
+        self.data_topic = f"ranging/data/{self.anchor_id}"
+        self.status_topic = f"ranging/status/{self.anchor_id}"
+
+    def _associate(self):
+        """Start joining the WiFi network, connection_manager polls for the outcome"""
         print(f"Connecting to WiFi network: {self.ssid}")
         
         if not self.wlan.active():
             self.wlan.active(True)
             mac = self.wlan.config('mac')
             self.anchor_id = ubinascii.hexlify(mac).decode('utf-8')
+            self._set_topics()
             
         self.wlan.connect(self.ssid, self.password)
-        
-        # Wait for connection with timeout
-        max_wait = 10
-        while max_wait > 0:
-            if self.wlan.status() < 0 or self.wlan.status() >= 3:
-                break
-            max_wait -= 1
-            print("Waiting for connection...")
-            await asyncio.sleep(1)
-            
-        if self.wlan.status() != 3:
-            raise RuntimeError('WiFi connection failed')
-        else:
-            print('Connected')
-            status = self.wlan.ifconfig()
-            print(f'IP Address: {status[0]}')
-            print(f'Anchor ID (MAC): {self.anchor_id}')
-            self.connected = True
             
     async def connect_mqtt(self):
-        """Connect to MQTT broker with error handling"""
+        """Connect to MQTT broker with error handling, ranging tasks keep running while it connects"""
         try:
-            self.mqtt_client.connect()
+            await self.mqtt_client.connect()
             print(f"Connected to MQTT broker at {self.mqtt_broker}")
             
             # Subscribe to configuration topics
@@ -71,6 +114,82 @@ class AnchorNode:
             print(f"MQTT connection failed: {e}")
             raise
             
+    def online(self):
+        """True while ranges can be published, cheap enough to call on every publish"""
+        return self.state == UP and self.mqtt_client.connected
+
+    def _set_state(self, state):
+        now = time.ticks_ms()
+        if state == UP:
+            if self._down_since is not None:
+                recover_ms = time.ticks_diff(now, self._down_since)
+                self.outages += 1
+                self.last_recover_ms = recover_ms
+                self.max_recover_ms = max(self.max_recover_ms, recover_ms)
+                self.total_recover_ms += recover_ms
+            self.backoff_ms = self.min_backoff_ms
+        elif self.state == UP:
+            self._down_since = now
+        print(f"Connection {STATE_NAMES[self.state]} -> {STATE_NAMES[state]}")
+        self.state = state
+        self._state_since = now
+
+    async def _backoff(self):
+        """Wait a random time between half and all of the backoff, then double it"""
+        half = self.backoff_ms // 2
+        await asyncio.sleep_ms(half + (half * random.getrandbits(10) >> 10))
+        self.backoff_ms = min(self.backoff_ms * 2, self.max_backoff_ms)
+
+    async def connection_manager(self):
+        """The one task that connects, watches and reconnects WiFi and MQTT. It steps through DOWN,
+        ASSOCIATING, CONNECTING and UP, polling every poll_ms and only awaiting, so ranging and publishing
+        carry on while it waits; publishers check online() and queue or log their ranges meanwhile.
+        CONNECTING looks the broker name up over UDP first when no address is cached or the cached one
+        failed repeatedly, a failed lookup backs off like a failed connect"""
+        while True:
+            state = self.state
+            if state == UP:
+                if not self.wlan.isconnected():
+                    print("Connection lost, attempting to reconnect...")
+                    self._set_state(DOWN)
+                elif not self.mqtt_client.connected:
+                    print("MQTT connection lost, attempting to reconnect...")
+                    self._set_state(CONNECTING)
+                else:
+                    await asyncio.sleep_ms(self.poll_ms)
+            elif state == DOWN:
+                if self.wlan.isconnected():
+                    self._set_state(CONNECTING)
+                else:
+                    self._associate()
+                    self._set_state(ASSOCIATING)
+            elif state == ASSOCIATING:
+                status = self.wlan.status()
+                if status == STAT_GOT_IP:
+                    print(f'IP Address: {self.wlan.ifconfig()[0]}')
+                    self._set_state(CONNECTING)
+                elif status < 0 or time.ticks_diff(time.ticks_ms(), self._state_since) > self.associate_ms:
+                    print(f"WiFi connection failed, status {status}")
+                    self.connect_failures += 1
+                    self.wlan.disconnect()
+                    self._set_state(DOWN)
+                    await self._backoff()
+                else:
+                    await asyncio.sleep_ms(self.poll_ms)
+            else:
+                try:
+                    if self.mqtt_client.needs_lookup():
+                        # Ask the network's DNS server without blocking, getaddrinfo() would stall ranging
+                        self.dns_lookups += 1
+                        await self.mqtt_client.lookup(self.wlan.ifconfig()[3])
+                    await self.connect_mqtt()
+                    self._set_state(UP)
+                except Exception:
+                    self.connect_failures += 1
+                    await self._backoff()
+                    if not self.wlan.isconnected():
+                        self._set_state(DOWN)
+
     def _on_message(self, topic, msg):
         """Handle incoming MQTT messages"""
         try:
@@ -85,92 +204,148 @@ class AnchorNode:
         except Exception as e:
             print(f"Error processing message: {e}")
             
-    async def send_ranging_data(self, tag_id, distance):
-        """Send ranging data via MQTT when tag is within threshold"""
-        if distance <= self.proximity_threshold:
-            try:
-                data = {
-                    "anchor_id": self.anchor_id,
-                    "tag_id": tag_id,
-                    "distance": distance,
-                    "timestamp": time.time()
-                }
-                
-                message = json.dumps(data)
-                self.mqtt_client.publish(f"ranging/data/{self.anchor_id}", message)
-                
-                # Also send a heartbeat/status message
-                status = {
-                    "status": "active",
-                    "timestamp": time.time()
-                }
-                self.mqtt_client.publish(f"ranging/status/{self.anchor_id}", json.dumps(status))
-                
-            except Exception as e:
-                print(f"Error sending data: {e}")
-                # Attempt to reconnect if connection lost
-                if not self.wlan.isconnected():
-                    self.connected = False
-                    await self.connect_wifi()
-                    await self.connect_mqtt()
+    async def send_ranging_data(self, tag_id, distance, quality=0):
+        """Queue ranging data for the next batch when tag is within threshold, as a binary record (see records.py) or JSON"""
+        if distance > self.proximity_threshold:
+            self.ranges_filtered += 1
+            return
+        if not self._batch_count:
+            self._batch_start = time.ticks_ms()
+        if self.binary_records:
+            records.encode_into(self._batch, self._batch_count * records.RECORD_SIZE,
+                                tag_id, distance, time.time_ns() // 1000, quality)
+        else:
+            self._json_batch.append({
+                "anchor_id": self.anchor_id,
+                "tag_id": tag_id,
+                "distance": distance,
+                "timestamp": time.time()
+            })
+        self._batch_count += 1
+        if self._batch_count >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """Publish the queued ranges in one message"""
+        count = self._batch_count
+        if not count:
+            return
+        if self.binary_records:
+            message = self._batch_view[:count * records.RECORD_SIZE]
+        else:
+            message = json.dumps(self._json_batch)
+        self._batch_count = 0
+        self._json_batch = []
+        if self.log and self.binary_records and not self.online():
+            self.log.append(message)  # copies it, the batch buffer is reused
+            self.ranges_logged += count
+            return
+        # Only queues the message, the client's writer task sends it
+        if self.mqtt_client.publish(self.data_topic, message):
+            self.publishes += 1
+            self.ranges_sent += count
+        else:
+            self.send_errors += 1
+
+    async def batch_flusher(self):
+        """Publish partial batches once their oldest range has waited batch_ms"""
+        while True:
+            if self._batch_count:
+                wait = time.ticks_diff(time.ticks_add(self._batch_start, self.batch_ms), time.ticks_ms())
+                if wait <= 0:
+                    await self.flush()
+                    continue
+            else:
+                wait = self.batch_ms
+            await asyncio.sleep_ms(wait)
     
-    async def check_messages(self):
-        """Check for pending MQTT messages"""
-        try:
-            self.mqtt_client.check_msg()
-        except Exception as e:
-            print(f"Error checking messages: {e}")
-            
+    async def replay(self):
+        """Publish the ring log's backlog once the broker is reachable, a batch at a time at up to replay_rate
+        records per second, and only while the MQTT queue is nearly empty so live ranges are not dropped"""
+        interval = self.batch_size * 1000 // self.replay_rate
+        view = memoryview(self._replay)
+        while True:
+            await asyncio.sleep_ms(interval)
+            client = self.mqtt_client
+            if not self.log.count or not self.online() or client.pending() > client.max_queue // 4:
+                continue
+            n = self.log.read_into(self._replay)
+            if client.publish(self.data_topic, view[:n * records.RECORD_SIZE]):
+                self.log.consume(n)
+                self.ranges_replayed += n
+                self.publishes += 1
+
+    async def log_syncer(self):
+        """Sync the ring log every log_sync_ms, appends between syncs are not durable"""
+        while True:
+            await asyncio.sleep_ms(self.log_sync_ms)
+            try:
+                self.log.sync()
+            except OSError as e:
+                print(f"Ring log sync failed: {e}")
+
+    def uptime_s(self):
+        """Seconds since start, call at least every few days to keep it exact"""
+        now = time.ticks_ms()
+        self.uptime_ms += time.ticks_diff(now, self._uptime_tick)
+        self._uptime_tick = now
+        return self.uptime_ms // 1000
+
     async def heartbeat(self):
-        """Periodic heartbeat to maintain active status"""
+        """Periodic heartbeat to maintain active status, carrying the publish counters in place of per-range status"""
         while True:
             try:
                 status = {
                     "status": "active",
-                    "timestamp": time.time()
+                    "timestamp": time.time(),
+                    "uptime_s": self.uptime_s(),
+                    "ranges_sent": self.ranges_sent,
+                    "ranges_filtered": self.ranges_filtered,
+                    "publishes": self.publishes,
+                    "send_errors": self.send_errors,
+                    "mqtt_dropped": self.mqtt_client.dropped,
+                    "ranges_logged": self.ranges_logged,
+                    "ranges_replayed": self.ranges_replayed,
+                    "log_backlog": self.log.count if self.log else 0,
+                    "log_overwritten": self.log.overwritten if self.log else 0,
+                    "connect_failures": self.connect_failures,
+                    "dns_lookups": self.dns_lookups,
+                    "outages": self.outages,
+                    "last_recover_ms": self.last_recover_ms,
+                    "max_recover_ms": self.max_recover_ms,
+                    "mean_recover_ms": self.total_recover_ms // self.outages if self.outages else 0
                 }
-                self.mqtt_client.publish(f"ranging/status/{self.anchor_id}", json.dumps(status))
+                self.mqtt_client.publish(self.status_topic, json.dumps(status))
+                self.publishes += 1
                 await asyncio.sleep(30)  # Send heartbeat every 30 seconds
             except Exception as e:
                 print(f"Heartbeat error: {e}")
                 await asyncio.sleep(5)  # Wait before retry
                 
-    async def reconnection_monitor(self):
-        """Monitor and handle connection status"""
-        while True:
-            if not self.wlan.isconnected():
-                print("Connection lost, attempting to reconnect...")
-                self.connected = False
-                try:
-                    await self.connect_wifi()
-                    await self.connect_mqtt()
-                except Exception as e:
-                    print(f"Reconnection failed: {e}")
-            await asyncio.sleep(5)  # Check every 5 seconds
-
 async def main():
     # Example usage
     WIFI_SSID = "xxxx"
     WIFI_PASSWORD = "xxxxx"
-    MQTT_BROKER = "test.mosquitto.org"  # Public test broker (replace with your broker)
+    MQTT_BROKER = "192.168.1.10"  # IP address or hostname of your broker, a hostname is looked up once and cached
     MQTT_PORT = 1883
     
     try:
         anchor = AnchorNode(WIFI_SSID, WIFI_PASSWORD, MQTT_BROKER, MQTT_PORT, threshold=5)
-        await anchor.connect_wifi()
-        await anchor.connect_mqtt()
         print("Anchor node ready for ranging")
         
-        # Create tasks for background operations
+        # Create tasks for background operations, ranges are logged until the connection is up
+        asyncio.create_task(anchor.connection_manager())
         asyncio.create_task(anchor.heartbeat())
-        asyncio.create_task(anchor.reconnection_monitor())
+        asyncio.create_task(anchor.batch_flusher())
+        if anchor.log:
+            asyncio.create_task(anchor.log_syncer())
+            asyncio.create_task(anchor.replay())
         
         # Example ranging data (to be replaced with actual DWM1000 ranging code)
         await anchor.send_ranging_data(0x1234, 2)
         
         # Main loop
         while True:
-            await anchor.check_messages()
             await asyncio.sleep(1)
             
     except KeyboardInterrupt: